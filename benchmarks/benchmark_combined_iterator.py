@@ -0,0 +1,35 @@
+"""Measures the per-item access cost of the CombinedDatasetIterator for a growing number of underlying iterators.
+Since indices are resolved via binary search over precomputed offsets, the cost should stay (almost) flat.
+
+Run with DataStack installed (pip install src/): python benchmarks/benchmark_combined_iterator.py
+"""
+import random
+import timeit
+from data_stack.dataset.iterator import SequenceDatasetIterator, DatasetIteratorView, CombinedDatasetIterator
+
+
+def build_combined_iterator(num_children: int, child_length: int) -> CombinedDatasetIterator:
+    children = []
+    for _ in range(num_children):
+        sequence_iterator = SequenceDatasetIterator(dataset_sequences=[list(range(child_length))])
+        # each shard is itself a view, as is the case for split datasets
+        children.append(DatasetIteratorView(sequence_iterator, indices=list(range(child_length))))
+    return CombinedDatasetIterator(children)
+
+
+def benchmark(num_children: int, child_length: int = 1000, num_accesses: int = 100000) -> float:
+    iterator = build_combined_iterator(num_children, child_length)
+    random_gen = random.Random(1)
+    indices = [random_gen.randrange(len(iterator)) for _ in range(num_accesses)]
+
+    def access():
+        for index in indices:
+            iterator[index]
+
+    duration = min(timeit.repeat(access, number=1, repeat=3))
+    return duration / num_accesses
+
+
+if __name__ == "__main__":
+    for num_children in [1, 10, 100, 1000]:
+        print(f"children: {num_children:5d}  per-item access: {benchmark(num_children) * 1e6:.2f} us")
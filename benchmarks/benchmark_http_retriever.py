@@ -0,0 +1,80 @@
+"""Compares the HTTP retriever, which opens a new connection per request, with the pooled HTTP retriever, which reuses
+keep-alive connections, when retrieving many small files from a local HTTP server. On the loopback interface, a
+TCP handshake is almost free, so the gap widens considerably with real network latency and TLS.
+
+Run with DataStack installed (pip install src/): python benchmarks/benchmark_http_retriever.py
+"""
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from data_stack.io.retriever import RetrieverFactory
+from data_stack.io.storage_connectors import StorageConnectorFactory
+from data_stack.io.resource_definition import ResourceDefinition
+from data_stack.util.logger import logger
+
+NUM_FILES = 500
+FILE_SIZE = 4 * 1024
+NUM_WORKERS = 4
+
+
+class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # like production servers, headers and body are not delayed by Nagle's algorithm on persistent connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(description: str, get_retriever, retrieval_jobs):
+    storage_path = tempfile.mkdtemp()
+    try:
+        retriever = get_retriever(StorageConnectorFactory.get_file_storage_connector(storage_path))
+        start = time.perf_counter()
+        retriever.retrieve(retrieval_jobs)
+        duration = time.perf_counter() - start
+    finally:
+        shutil.rmtree(storage_path)
+    print(f"{description:<40} {duration:8.3f} s  {len(retrieval_jobs) / duration:8.0f} files/s")
+    return retriever
+
+
+def main():
+    logger.setLevel(logging.WARNING)
+    server_root = tempfile.mkdtemp()
+    retrieval_jobs = []
+    for i in range(NUM_FILES):
+        content = os.urandom(FILE_SIZE)
+        with open(os.path.join(server_root, f"{i}.bin"), "wb") as fd:
+            fd.write(content)
+        retrieval_jobs.append((f"resources/{i}", f"/{i}.bin", hashlib.md5(content).hexdigest()))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHTTPRequestHandler, directory=server_root))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    retrieval_jobs = [ResourceDefinition(identifier=identifier, source=url + path, md5_sum=md5_sum)
+                      for identifier, path, md5_sum in retrieval_jobs]
+    try:
+        print(f"Retrieving {NUM_FILES} files of {FILE_SIZE // 1024} KiB")
+        for num_workers in [1, NUM_WORKERS]:
+            measure(f"new connection per request ({num_workers} workers)",
+                    partial(RetrieverFactory.get_http_retriever, num_workers=num_workers), retrieval_jobs)
+            retriever = measure(f"pooled connections ({num_workers} workers)",
+                                partial(RetrieverFactory.get_pooled_http_retriever, num_workers=num_workers,
+                                        pool_size=num_workers), retrieval_jobs)
+            statistics = retriever.retriever_impl.connection_pool.statistics
+            print(f"  {statistics.num_connections_created} connections created, "
+                  f"{statistics.reuse_ratio:.1%} of requests reused a connection")
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(server_root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Compares the memory footprint and shuffle speed of Python list based indices with the numpy index arrays used by
+`DatasetIteratorView`, the splitters and the shuffled dataset iterator on a dataset with 10M samples.
+
+Run with DataStack installed (pip install src/): python benchmarks/benchmark_indices.py
+"""
+import random
+import time
+import tracemalloc
+from data_stack.dataset.iterator import SequenceDatasetIterator
+from data_stack.dataset.splitter import SplitterFactory
+from data_stack.dataset.factory import InformedDatasetFactory
+from data_stack.dataset.meta import MetaFactory
+
+NUM_SAMPLES = 10_000_000
+
+
+class RangeSequence:
+    """Stand-in for a large dataset sequence that does not hold any samples in memory."""
+
+    def __init__(self, length: int):
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index: int):
+        return index
+
+
+def measure(description: str, fn):
+    # time and memory are measured in separate runs, since tracing allocations slows down the Python list considerably
+    start = time.perf_counter()
+    fn()
+    duration = time.perf_counter() - start
+    tracemalloc.start()
+    result = fn()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{description:40s} time: {duration:6.2f} s   retained: {retained / 2**20:7.1f} MiB   peak: {peak / 2**20:7.1f} MiB")
+    return result
+
+
+def shuffled_python_list():
+    indices = list(range(NUM_SAMPLES))
+    random.Random(1).shuffle(indices)
+    return indices
+
+
+if __name__ == "__main__":
+    iterator = SequenceDatasetIterator(dataset_sequences=[RangeSequence(NUM_SAMPLES)])
+    meta = MetaFactory.get_dataset_meta(identifier="benchmark")
+
+    measure("shuffled python list (previous)", shuffled_python_list)
+    measure("shuffled dataset iterator", lambda: InformedDatasetFactory.get_shuffled_dataset_iterator(iterator, meta, seed=1))
+    measure("random splitter [0.8, 0.1, 0.1]", lambda: SplitterFactory.get_random_splitter([0.8, 0.1, 0.1], seed=1).split(iterator))
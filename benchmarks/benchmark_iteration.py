@@ -0,0 +1,44 @@
+"""Compares sequential iteration via the dedicated `__iter__` of the iterators with the legacy protocol, where every
+step resolves its index through the whole iterator graph, for increasingly deep graphs of views and combined iterators.
+
+Run with DataStack installed (pip install src/): python benchmarks/benchmark_iteration.py
+"""
+import timeit
+from data_stack.dataset.iterator import DatasetIteratorIF, SequenceDatasetIterator, DatasetIteratorView, \
+    CombinedDatasetIterator, CompiledDatasetIterator
+
+
+def build_nested_iterator(depth: int, num_children: int = 10, child_length: int = 10000) -> DatasetIteratorIF:
+    iterator = SequenceDatasetIterator(dataset_sequences=[list(range(child_length)), list(range(child_length))])
+    for _ in range(depth):
+        # each level splits its child into shards and combines them again, as happens for nested dataset splits
+        shard_length = len(iterator) // num_children
+        shards = [DatasetIteratorView(iterator, indices=range(i * shard_length, (i + 1) * shard_length))
+                  for i in range(num_children)]
+        iterator = CombinedDatasetIterator(shards)
+    return iterator
+
+
+def iterate_legacy(iterator: DatasetIteratorIF):
+    for index in range(len(iterator)):
+        iterator[index]
+
+
+def iterate(iterator: DatasetIteratorIF):
+    for _ in iterator:
+        pass
+
+
+def benchmark(iterator: DatasetIteratorIF, iterate_fun) -> float:
+    duration = min(timeit.repeat(lambda: iterate_fun(iterator), number=1, repeat=3))
+    return duration / len(iterator)
+
+
+if __name__ == "__main__":
+    for depth in [0, 1, 2, 4]:
+        iterator = build_nested_iterator(depth)
+        legacy = benchmark(iterator, iterate_legacy)
+        streamed = benchmark(iterator, iterate)
+        compiled = benchmark(CompiledDatasetIterator(iterator), iterate)
+        print(f"depth: {depth}  per-item legacy: {legacy * 1e6:.2f} us  __iter__: {streamed * 1e6:.2f} us  "
+              f"compiled __iter__: {compiled * 1e6:.2f} us")
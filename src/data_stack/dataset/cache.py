@@ -0,0 +1,107 @@
+from typing import Dict, Any, Optional
+from data_stack.dataset.iterator import DatasetIteratorIF
+from data_stack.dataset.packed_records import PackedRecordWriter, PackedRecordIterator, PackedRecords
+from data_stack.io.storage_connectors import StorageConnector
+from data_stack.io.resources import ResourceFactory
+from data_stack.util.logger import logger
+import numpy as np
+import hashlib
+import json
+import io
+
+
+def get_fingerprint(dataset_iterator: DatasetIteratorIF, config: Dict[str, Any]) -> str:
+    """Fingerprint of the samples of an iterator graph. The graph is flattened (see `DatasetIteratorIF.flatten`), such
+    that the fingerprint covers the order in which the samples are taken from the source iterators, which takes O(N)
+    time and memory for N samples. Source iterators are only identified by their type and length, so the
+    JSON-serializable config is required to tell apart different datasets of the same type, e.g., by the dataset
+    identifier, version and preprocessing parameters."""
+    sources, source_ids, source_indices = dataset_iterator.flatten()
+    md5 = hashlib.md5()
+    md5.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+    for source in sources:
+        md5.update(f"{type(source).__module__}.{type(source).__qualname__}:{len(source)};".encode("utf-8"))
+    md5.update(np.ascontiguousarray(source_ids, dtype=np.int64).tobytes())
+    md5.update(np.ascontiguousarray(source_indices, dtype=np.int64).tobytes())
+    return md5.hexdigest()
+
+
+def get_signature(dataset_iterator: DatasetIteratorIF, config: Dict[str, Any]) -> str:
+    """Cheap counterpart of `get_fingerprint`, which covers the config and the type and length of every iterator in
+    the graph, but not which samples they select. It takes O(#iterators) instead of O(N) time, so graphs that only
+    differ in the selected samples, e.g., splits of the same size, have to be told apart by the config."""
+    md5 = hashlib.md5()
+    md5.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+    pending = [dataset_iterator]
+    while pending:
+        iterator = pending.pop()
+        md5.update(f"{type(iterator).__module__}.{type(iterator).__qualname__}:{len(iterator)};".encode("utf-8"))
+        pending.extend(reversed(iterator.underlying_iterators))
+    return md5.hexdigest()
+
+
+class CachedDatasetIterator(PackedRecordIterator):
+    """Materializes an arbitrary iterator graph once as packed records in the storage connector, keyed by the given
+    `key` or by default by the signature of the graph (see `get_signature`), which also covers the config identifying
+    the dataset. Subsequent runs and other processes reopen the cache via memory mapping instead of evaluating the
+    iterator graph again, as done by the `InMemoryDatasetIterator`, without touching the samples of the graph.
+
+    The fingerprint of the samples (see `get_fingerprint`) is stored along with the cache. With `verify`, it is
+    recomputed on reopening, which flattens the graph in O(N), and the cache is rebuilt if it is stale.
+
+    The cache holds the samples in the order of the graph at the time of caching, so epoch-aware iterators, e.g., the
+    `EpochShuffledDatasetIterator`, have to sit above the cache. `set_epoch` and `set_worker` are not forwarded."""
+
+    def __init__(self, dataset_iterator: DatasetIteratorIF, storage_connector: StorageConnector,
+                 config: Dict[str, Any], identifier_prefix: str = "cache",
+                 max_shard_size: int = 256 * 1024 * 1024, key: Optional[str] = None, verify: bool = False):
+        self.key = key if key is not None else get_signature(dataset_iterator, config)
+        identifier = f"{identifier_prefix}/{self.key}"
+        # the index is written last, so its presence marks a complete cache
+        if not storage_connector.has_resource(PackedRecords.get_shards_identifier(identifier)):
+            logger.debug(f"Caching iterator to {identifier}.")
+            self._write(dataset_iterator, storage_connector, identifier, get_fingerprint(dataset_iterator, config),
+                        max_shard_size)
+        elif verify:
+            fingerprint = get_fingerprint(dataset_iterator, config)
+            if CachedDatasetIterator._read_fingerprint(storage_connector, identifier) != fingerprint:
+                logger.debug(f"Rebuilding stale cached iterator {identifier}.")
+                self._write(dataset_iterator, storage_connector, identifier, fingerprint, max_shard_size)
+        else:
+            logger.debug(f"Reopening cached iterator {identifier}.")
+        super().__init__(storage_connector, identifier)
+        self._dataset_iterator = dataset_iterator
+
+    @staticmethod
+    def get_fingerprint_identifier(identifier: str) -> str:
+        return f"{identifier}/fingerprint"
+
+    @staticmethod
+    def _read_fingerprint(storage_connector: StorageConnector, identifier: str) -> Optional[str]:
+        fingerprint_identifier = CachedDatasetIterator.get_fingerprint_identifier(identifier)
+        if not storage_connector.has_resource(fingerprint_identifier):
+            return None
+        with storage_connector.get_resource(fingerprint_identifier) as resource:
+            return resource.read().decode("utf-8")
+
+    @staticmethod
+    def _write(dataset_iterator: DatasetIteratorIF, storage_connector: StorageConnector, identifier: str,
+               fingerprint: str, max_shard_size: int):
+        fingerprint_identifier = CachedDatasetIterator.get_fingerprint_identifier(identifier)
+        buffer = io.BytesIO(fingerprint.encode("utf-8"))
+        with ResourceFactory.get_resource(identifier=fingerprint_identifier, file_like_object=buffer) as resource:
+            storage_connector.set_resource(fingerprint_identifier, resource)
+        PackedRecordWriter(storage_connector, max_shard_size=max_shard_size).write(identifier, dataset_iterator)
+
+    def set_epoch(self, epoch: int):
+        # the cached samples do not change with the epoch
+        pass
+
+    def set_worker(self, num_workers: int, worker_id: int):
+        pass
+
+    @property
+    def underlying_iterators(self):
+        return [self._dataset_iterator]
+
+
@@ -1,10 +1,15 @@
 from abc import ABC, abstractmethod
 from data_stack.io.storage_connectors import StorageConnector
 from data_stack.dataset.iterator import DatasetIteratorIF, InformedDatasetIteratorIF, InformedDatasetIterator, CombinedDatasetIterator, \
-    DatasetIteratorView, InMemoryDatasetIterator
+    DatasetIteratorView, InMemoryDatasetIterator, CompiledDatasetIterator, PrefetchingDatasetIterator
 from typing import Tuple, List, Dict, Any
 from data_stack.dataset.meta import IteratorMeta, DatasetMeta
-import random
+from data_stack.dataset.cache import CachedDatasetIterator
+from data_stack.dataset.shuffle import EpochShuffledDatasetIterator
+from data_stack.dataset.sharding import ShardedDatasetIterator
+from data_stack.dataset.transforms import MappedDatasetIterator, TransformStage, TransformMemo
+from data_stack.util.helper import get_index_dtype
+import numpy as np
 
 
 class BaseDatasetFactory(ABC):
@@ -26,6 +31,43 @@ class HigherOrderDatasetFactory:
     def get_dataset_iterator_view(iterator: DatasetIteratorIF, indices: List[int], view_tags: Dict[str, Any]) -> DatasetIteratorIF:
         return DatasetIteratorView(iterator, indices, view_tags)
 
+    @staticmethod
+    def get_compiled_dataset_iterator(iterator: DatasetIteratorIF) -> DatasetIteratorIF:
+        return CompiledDatasetIterator(iterator)
+
+    @staticmethod
+    def get_cached_dataset_iterator(iterator: DatasetIteratorIF, storage_connector: StorageConnector,
+                                    config: Dict[str, Any], key: str = None, verify: bool = False) -> DatasetIteratorIF:
+        return CachedDatasetIterator(iterator, storage_connector, config, key=key, verify=verify)
+
+    @staticmethod
+    def get_prefetching_dataset_iterator(iterator: DatasetIteratorIF, num_workers: int = 4, prefetch_size: int = 16,
+                                         use_processes: bool = False, indices: List[int] = None, shuffle: bool = False,
+                                         seed: int = None) -> DatasetIteratorIF:
+        return PrefetchingDatasetIterator(iterator, num_workers=num_workers, prefetch_size=prefetch_size,
+                                          use_processes=use_processes, indices=indices, shuffle=shuffle, seed=seed)
+
+    @staticmethod
+    def get_mapped_dataset_iterator(iterator: DatasetIteratorIF, stages: List[TransformStage],
+                                    memo: TransformMemo = None) -> DatasetIteratorIF:
+        return MappedDatasetIterator(iterator, stages, memo)
+
+    @staticmethod
+    def get_epoch_shuffled_dataset_iterator(iterator: DatasetIteratorIF, seed: int = 0, block_size: int = None,
+                                            bijective: bool = False, epoch: int = 0) -> DatasetIteratorIF:
+        return EpochShuffledDatasetIterator(iterator, seed=seed, block_size=block_size, bijective=bijective,
+                                            epoch=epoch)
+
+    @staticmethod
+    def get_sharded_dataset_iterator(iterator: DatasetIteratorIF, world_size: int = 1, rank: int = 0,
+                                     num_workers: int = 1, worker_id: int = 0, contiguous: bool = False,
+                                     drop_last: bool = False, shuffle: bool = False, seed: int = 0,
+                                     block_size: int = None, bijective: bool = True,
+                                     epoch: int = 0) -> DatasetIteratorIF:
+        return ShardedDatasetIterator(iterator, world_size=world_size, rank=rank, num_workers=num_workers,
+                                      worker_id=worker_id, contiguous=contiguous, drop_last=drop_last, shuffle=shuffle,
+                                      seed=seed, block_size=block_size, bijective=bijective, epoch=epoch)
+
 
 class InformedDatasetFactory:
 
@@ -49,10 +91,59 @@ class InformedDatasetFactory:
         in_memory_iterator = InMemoryDatasetIterator(iterator)
         return InformedDatasetIterator(in_memory_iterator, meta)
 
+    @staticmethod
+    def get_compiled_dataset_iterator(iterator: DatasetIteratorIF, meta: DatasetMeta) -> InformedDatasetIteratorIF:
+        compiled_iterator = HigherOrderDatasetFactory.get_compiled_dataset_iterator(iterator)
+        return InformedDatasetIterator(compiled_iterator, meta)
+
+    @staticmethod
+    def get_cached_dataset_iterator(iterator: DatasetIteratorIF, meta: DatasetMeta, storage_connector: StorageConnector,
+                                    config: Dict[str, Any], key: str = None,
+                                    verify: bool = False) -> InformedDatasetIteratorIF:
+        cached_iterator = HigherOrderDatasetFactory.get_cached_dataset_iterator(iterator, storage_connector, config,
+                                                                               key=key, verify=verify)
+        return InformedDatasetIterator(cached_iterator, meta)
+
+    @staticmethod
+    def get_prefetching_dataset_iterator(iterator: DatasetIteratorIF, meta: DatasetMeta, num_workers: int = 4,
+                                         prefetch_size: int = 16, use_processes: bool = False, indices: List[int] = None,
+                                         shuffle: bool = False, seed: int = None) -> InformedDatasetIteratorIF:
+        prefetching_iterator = HigherOrderDatasetFactory.get_prefetching_dataset_iterator(
+            iterator, num_workers=num_workers, prefetch_size=prefetch_size, use_processes=use_processes,
+            indices=indices, shuffle=shuffle, seed=seed)
+        return InformedDatasetIterator(prefetching_iterator, meta)
+
+    @staticmethod
+    def get_mapped_dataset_iterator(iterator: DatasetIteratorIF, meta: DatasetMeta, stages: List[TransformStage],
+                                    memo: TransformMemo = None) -> InformedDatasetIteratorIF:
+        mapped_iterator = HigherOrderDatasetFactory.get_mapped_dataset_iterator(iterator, stages, memo)
+        return InformedDatasetIterator(mapped_iterator, meta)
+
     @staticmethod
     def get_shuffled_dataset_iterator(iterator: DatasetIteratorIF, meta: DatasetMeta, seed: int) -> InformedDatasetIteratorIF:
-        random_gen = random.Random(seed)
-        indices = list(range(len(iterator)))
-        random_gen.shuffle(indices)
+        random_gen = np.random.RandomState(seed)
+        indices = random_gen.permutation(len(iterator)).astype(get_index_dtype(len(iterator)))
         iterator_view = InformedDatasetFactory.get_dataset_iterator_view(iterator, meta, indices)
         return iterator_view
+
+    @staticmethod
+    def get_epoch_shuffled_dataset_iterator(iterator: DatasetIteratorIF, meta: DatasetMeta, seed: int = 0,
+                                            block_size: int = None, bijective: bool = False,
+                                            epoch: int = 0) -> InformedDatasetIteratorIF:
+        """Unlike `get_shuffled_dataset_iterator`, the order is changed per epoch via `set_epoch` without creating a
+        new iterator."""
+        shuffled_iterator = HigherOrderDatasetFactory.get_epoch_shuffled_dataset_iterator(
+            iterator, seed=seed, block_size=block_size, bijective=bijective, epoch=epoch)
+        return InformedDatasetIterator(shuffled_iterator, meta)
+
+    @staticmethod
+    def get_sharded_dataset_iterator(iterator: DatasetIteratorIF, meta: DatasetMeta, world_size: int = 1, rank: int = 0,
+                                     num_workers: int = 1, worker_id: int = 0, contiguous: bool = False,
+                                     drop_last: bool = False, shuffle: bool = False, seed: int = 0,
+                                     block_size: int = None, bijective: bool = True,
+                                     epoch: int = 0) -> InformedDatasetIteratorIF:
+        sharded_iterator = HigherOrderDatasetFactory.get_sharded_dataset_iterator(
+            iterator, world_size=world_size, rank=rank, num_workers=num_workers, worker_id=worker_id,
+            contiguous=contiguous, drop_last=drop_last, shuffle=shuffle, seed=seed, block_size=block_size,
+            bijective=bijective, epoch=epoch)
+        return InformedDatasetIterator(sharded_iterator, meta)
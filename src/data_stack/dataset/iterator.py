@@ -1,9 +1,64 @@
 from abc import ABC, abstractmethod
-from typing import List, Sequence, Dict, Any
+from typing import List, Sequence, Dict, Any, Tuple, Iterator, Optional
 from data_stack.dataset.meta import DatasetMetaIF
+from data_stack.util.helper import get_index_dtype
+from itertools import accumulate, chain
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque
+from dataclasses import dataclass
+import numpy as np
+import torch
+import bisect
+import time
 import tqdm
 
 
+def _take(column: Sequence, positions: np.ndarray) -> Sequence:
+    """Selects the elements at the given positions from a column, using a single fancy-index for arrays and tensors."""
+    if isinstance(column, np.ndarray):
+        return column[positions]
+    if isinstance(column, torch.Tensor):
+        return column[torch.as_tensor(positions)]
+    return [column[position] for position in positions]
+
+
+def _stack(elements: List[Any]) -> Sequence:
+    """Stacks the elements of a column, if they are arrays or tensors."""
+    if elements and all(isinstance(element, torch.Tensor) for element in elements):
+        return torch.stack(elements)
+    if elements and all(isinstance(element, np.ndarray) for element in elements):
+        return np.stack(elements)
+    return elements
+
+
+def _concat(columns: List[Sequence]) -> Sequence:
+    """Concatenates the parts of a column, e.g., the batches retrieved from different underlying iterators."""
+    if columns and all(isinstance(column, torch.Tensor) for column in columns):
+        return torch.cat(columns)
+    if columns and all(isinstance(column, np.ndarray) for column in columns):
+        return np.concatenate(columns)
+    return list(chain.from_iterable(columns))
+
+
+def _gather_batch(iterators: List["DatasetIteratorIF"], iterator_indices: np.ndarray,
+                  local_indices: np.ndarray) -> Tuple[Sequence, ...]:
+    """Retrieves one batch per iterator, where sample i is read from `iterators[iterator_indices[i]]` at position
+    `local_indices[i]`, and merges the batches in the requested order."""
+    if len(iterator_indices) == 0:
+        # the first iterator determines the number and types of the empty columns
+        return iterators[0].get_batch(local_indices) if iterators else ()
+    positions_per_iterator, batches = [], []
+    for iterator_index in np.unique(iterator_indices):
+        positions = np.flatnonzero(iterator_indices == iterator_index)
+        positions_per_iterator.append(positions)
+        batches.append(iterators[iterator_index].get_batch(local_indices[positions]))
+    if len(batches) == 1:
+        return batches[0]
+    # restore the requested order
+    inverse_order = np.argsort(np.concatenate(positions_per_iterator), kind="stable")
+    return tuple(_take(_concat(list(column_parts)), inverse_order) for column_parts in zip(*batches))
+
+
 class DatasetIteratorIF(ABC):
 
     @abstractmethod
@@ -14,11 +69,48 @@ class DatasetIteratorIF(ABC):
     def __getitem__(self, index: int):
         raise NotImplementedError
 
+    def __iter__(self) -> Iterator:
+        """Iterates sequentially over the samples. Bounded by the length, such that iteration does not rely on
+        `__getitem__` raising an `IndexError`. Iterators override this method, whenever they can stream their samples
+        without resolving each index separately."""
+        for index in range(len(self)):
+            yield self[index]
+
     @property
     @abstractmethod
     def underlying_iterators(self) -> List["DatasetIteratorIF"]:
         raise NotImplementedError
 
+    def set_epoch(self, epoch: int):
+        """Sets the epoch of all epoch-aware iterators in the graph, e.g., of each `EpochShuffledDatasetIterator`.
+        Forwarded to the underlying iterators by default, which is a no-op for source iterators."""
+        for iterator in self.underlying_iterators:
+            iterator.set_epoch(epoch)
+
+    def set_worker(self, num_workers: int, worker_id: int):
+        """Binds all sharded iterators in the graph to the shard of the given data loader worker (see
+        `ShardedDatasetIterator`). Forwarded to the underlying iterators by default."""
+        for iterator in self.underlying_iterators:
+            iterator.set_worker(num_workers, worker_id)
+
+    def get_batch(self, indices: Sequence[int]) -> Tuple[Sequence, ...]:
+        """Returns the samples at the given indices column-wise, i.e., one stacked sequence per position of a sample.
+        Iterators should override this method, whenever they can do better than the per-sample fallback below."""
+        rows = [self[index] for index in indices]
+        return tuple(_stack(list(column)) for column in zip(*rows))
+
+    def flatten(self) -> Tuple[List["DatasetIteratorIF"], np.ndarray, np.ndarray]:
+        """Resolves this iterator to the source iterators holding the actual samples. Returns the source iterators and
+        for each sample of this iterator the position of its source iterator and its index within that source.
+        Iterators that only remap indices (e.g., views and combined iterators) override this method,
+        any other iterator is a source itself."""
+        return [self], np.zeros(len(self), dtype=np.int64), np.arange(len(self), dtype=np.int64)
+
+    def get_column(self, position: int) -> Sequence:
+        """Returns the elements at the given position of all samples, e.g., all targets. The fallback below evaluates
+        every sample, iterators with columnar storage override it to access the column directly."""
+        return [row[position] for row in self]
+
 
 class InformedDatasetIteratorIF(DatasetIteratorIF):
 
@@ -46,6 +138,29 @@ class InformedDatasetIterator(InformedDatasetIteratorIF):
     def __getitem__(self, index: int):
         return self._dataset_iterator[index]
 
+    def __iter__(self):
+        # the wrapped iterator might iterate differently from indexing, e.g., by prefetching
+        return iter(self._dataset_iterator)
+
+    def get_batch(self, indices: Sequence[int]) -> Tuple[Sequence, ...]:
+        return self._dataset_iterator.get_batch(indices)
+
+    def flatten(self) -> Tuple[List["DatasetIteratorIF"], np.ndarray, np.ndarray]:
+        return self._dataset_iterator.flatten()
+
+    def get_column(self, position: int) -> Sequence:
+        return self._dataset_iterator.get_column(position)
+
+    def get_targets(self) -> Sequence:
+        return self.get_column(self._dataset_meta.target_pos)
+
+    def set_epoch(self, epoch: int):
+        # the wrapped iterator is not part of the underlying iterators
+        self._dataset_iterator.set_epoch(epoch)
+
+    def set_worker(self, num_workers: int, worker_id: int):
+        self._dataset_iterator.set_worker(num_workers, worker_id)
+
     @property
     def underlying_iterators(self) -> List["DatasetIteratorIF"]:
         return self._dataset_iterator.underlying_iterators
@@ -66,34 +181,60 @@ class SequenceDatasetIterator(DatasetIterator):
     def __getitem__(self, index: int):
         return tuple([s[index] for s in self._dataset_sequences])
 
+    def __iter__(self) -> Iterator:
+        return zip(*self._dataset_sequences)
+
+    def get_batch(self, indices: Sequence[int]) -> Tuple[Sequence, ...]:
+        indices = np.asarray(indices, dtype=np.int64)
+        return tuple(_take(s, indices) for s in self._dataset_sequences)
+
+    def get_column(self, position: int) -> Sequence:
+        return self._dataset_sequences[position]
+
     @property
     def underlying_iterators(self) -> List["DatasetIteratorIF"]:
         return []
 
 
 class DatasetIteratorView(DatasetIterator):
-    """Provides a view on a `DatasetIterator` for accessing elements of a given split only."""
+    """Provides a view on a `DatasetIterator` for accessing elements of a given split only.
+    The indices are stored as compact numpy array (int32, unless the underlying iterator requires int64)."""
 
-    def __init__(self, dataset_iterator: DatasetIterator, indices: List[int], view_tags: Dict[str, Any] = None):
+    def __init__(self, dataset_iterator: DatasetIterator, indices: Sequence[int], view_tags: Dict[str, Any] = None):
         self._dataset_iterator = dataset_iterator
-        self._indices = indices
+        self._indices = np.asarray(indices, dtype=get_index_dtype(len(dataset_iterator)))
         self._view_tags = view_tags
 
     def __len__(self):
         return len(self._indices)
 
     def __getitem__(self, index: int):
-        if index >= len(self._indices):
-            raise StopIteration
-        original_dataset_index = self._indices[index]
+        original_dataset_index = int(self._indices[index])
         return self._dataset_iterator[original_dataset_index]
 
+    def __iter__(self) -> Iterator:
+        dataset_iterator = self._dataset_iterator
+        # tolist converts all indices to python ints at once
+        for index in self._indices.tolist():
+            yield dataset_iterator[index]
+
+    def get_batch(self, indices: Sequence[int]) -> Tuple[Sequence, ...]:
+        original_dataset_indices = self._indices[np.asarray(indices, dtype=np.int64)]
+        return self._dataset_iterator.get_batch(original_dataset_indices)
+
+    def flatten(self) -> Tuple[List["DatasetIteratorIF"], np.ndarray, np.ndarray]:
+        sources, source_ids, source_indices = self._dataset_iterator.flatten()
+        return sources, source_ids[self._indices], source_indices[self._indices]
+
+    def get_column(self, position: int) -> Sequence:
+        return _take(self._dataset_iterator.get_column(position), self._indices)
+
     @property
     def underlying_iterators(self) -> List["DatasetIteratorIF"]:
         return [self._dataset_iterator]
 
     @property
-    def indices(self) -> List[int]:
+    def indices(self) -> np.ndarray:
         return self._indices
 
     @property
@@ -102,21 +243,71 @@ class DatasetIteratorView(DatasetIterator):
 
 
 class CombinedDatasetIterator(DatasetIterator):
+    """Concatenates the given iterators. The offsets of the underlying iterators are computed once, such that an index is
+    resolved via binary search in O(log k) for k underlying iterators. If the length of an underlying iterator changes,
+    `invalidate()` has to be called to recompute the offsets."""
 
     def __init__(self, iterators: List[DatasetIterator]):
         self._iterators = iterators
+        self._cumulative_lengths: List[int] = []
+        self.invalidate()
+
+    def invalidate(self):
+        """Recomputes the cached offsets of the underlying iterators, e.g., after an underlying iterator has grown."""
+        self._cumulative_lengths = list(accumulate(len(iterator) for iterator in self._iterators))
+
+    def set_worker(self, num_workers: int, worker_id: int):
+        super().set_worker(num_workers, worker_id)
+        # sharded iterators below change their length with the worker
+        self.invalidate()
 
     def __len__(self):
-        return sum([len(iterator) for iterator in self._iterators])
+        return self._cumulative_lengths[-1] if self._cumulative_lengths else 0
 
     def __getitem__(self, index: int):
-        index_copy = index
-        iterator_lengths = [len(iterator) for iterator in self._iterators]
-        for iterator_index, length in enumerate(iterator_lengths):
-            if index_copy - length < 0:
-                return self._iterators[iterator_index][index_copy]
-            index_copy -= length
-        raise IndexError
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError
+        # bisect_right skips empty iterators, as they share their cumulative length with their predecessor
+        iterator_index = bisect.bisect_right(self._cumulative_lengths, index)
+        offset = self._cumulative_lengths[iterator_index - 1] if iterator_index > 0 else 0
+        return self._iterators[iterator_index][index - offset]
+
+    def __iter__(self) -> Iterator:
+        # no index resolution at all, the underlying iterators are simply streamed one after another
+        return chain.from_iterable(self._iterators)
+
+    def get_batch(self, indices: Sequence[int]) -> Tuple[Sequence, ...]:
+        indices = np.asarray(indices, dtype=np.int64)
+        indices = np.where(indices < 0, indices + len(self), indices)
+        if np.any((indices < 0) | (indices >= len(self))):
+            raise IndexError
+        cumulative_lengths = np.asarray(self._cumulative_lengths, dtype=np.int64)
+        offsets = np.concatenate([[0], cumulative_lengths[:-1]])
+        iterator_indices = np.searchsorted(cumulative_lengths, indices, side="right")
+        return _gather_batch(self._iterators, iterator_indices, indices - offsets[iterator_indices])
+
+    def get_column(self, position: int) -> Sequence:
+        return _concat([iterator.get_column(position) for iterator in self._iterators])
+
+    def flatten(self) -> Tuple[List["DatasetIteratorIF"], np.ndarray, np.ndarray]:
+        sources: List[DatasetIteratorIF] = []
+        source_positions: Dict[int, int] = {}
+        source_ids_list, source_indices_list = [], []
+        for iterator in self._iterators:
+            iterator_sources, iterator_source_ids, iterator_source_indices = iterator.flatten()
+            # the same source may be reachable via several underlying iterators
+            for source in iterator_sources:
+                if id(source) not in source_positions:
+                    source_positions[id(source)] = len(sources)
+                    sources.append(source)
+            id_mapping = np.array([source_positions[id(source)] for source in iterator_sources], dtype=np.int64)
+            source_ids_list.append(id_mapping[iterator_source_ids] if len(id_mapping) else iterator_source_ids)
+            source_indices_list.append(iterator_source_indices)
+        if not source_ids_list:
+            return sources, np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        return sources, np.concatenate(source_ids_list), np.concatenate(source_indices_list)
 
     @property
     def underlying_iterators(self) -> List["DatasetIteratorIF"]:
@@ -125,7 +316,9 @@ class CombinedDatasetIterator(DatasetIterator):
 
 class InMemoryDatasetIterator(DatasetIterator):
     """Loads a given iterator into memory to speed up the iteration.
-    Note, that the InMemoryIterator also evaluates the provided iterator, solving the slowdown due to nesting."""
+    Note, that the InMemoryIterator also evaluates the provided iterator, solving the slowdown due to nesting.
+    To resolve the nesting without copying the samples, see `CompiledDatasetIterator`. To keep the evaluated samples
+    across processes and runs, see `CachedDatasetIterator`."""
 
     def __init__(self, dataset_iterator: DatasetIterator):
         self._dataset_iterator = dataset_iterator
@@ -135,10 +328,216 @@ class InMemoryDatasetIterator(DatasetIterator):
         return len(self._samples)
 
     def __getitem__(self, index: int):
-        if index >= len(self._samples):
-            raise StopIteration
         return self._samples[index]
 
+    def __iter__(self) -> Iterator:
+        return iter(self._samples)
+
+    def get_column(self, position: int) -> Sequence:
+        return [sample[position] for sample in self._samples]
+
+    @property
+    def underlying_iterators(self) -> List["DatasetIteratorIF"]:
+        return [self._dataset_iterator]
+
+
+class CompiledDatasetIterator(DatasetIterator):
+    """Collapses an arbitrarily deep graph of views and combined iterators into a flat mapping from each sample to its
+    source iterator and index therein (see `DatasetIteratorIF.flatten`). Each sample is thus resolved in a single hop,
+    without duplicating the samples as done by the `InMemoryDatasetIterator`. The mapping is computed once and only
+    recomputed by `set_epoch` and `set_worker`, i.e., other changes to the underlying iterator graph are not
+    reflected."""
+
+    def __init__(self, dataset_iterator: DatasetIteratorIF):
+        self._dataset_iterator = dataset_iterator
+        self._compile()
+
+    def _compile(self):
+        self._sources, self._source_ids, self._source_indices = self._dataset_iterator.flatten()
+
+    def set_epoch(self, epoch: int):
+        super().set_epoch(epoch)
+        self._compile()
+
+    def set_worker(self, num_workers: int, worker_id: int):
+        super().set_worker(num_workers, worker_id)
+        self._compile()
+
+    def __len__(self):
+        return len(self._source_indices)
+
+    def __getitem__(self, index: int):
+        source_id, source_index = self._source_ids[index], self._source_indices[index]
+        return self._sources[source_id][int(source_index)]
+
+    def __iter__(self) -> Iterator:
+        sources = self._sources
+        for source_id, source_index in zip(self._source_ids.tolist(), self._source_indices.tolist()):
+            yield sources[source_id][source_index]
+
+    def get_batch(self, indices: Sequence[int]) -> Tuple[Sequence, ...]:
+        indices = np.asarray(indices, dtype=np.int64)
+        return _gather_batch(self._sources, self._source_ids[indices], self._source_indices[indices])
+
+    def get_column(self, position: int) -> Sequence:
+        positions_per_source, column_parts = [], []
+        for source_id, source in enumerate(self._sources):
+            positions = np.flatnonzero(self._source_ids == source_id)
+            positions_per_source.append(positions)
+            column_parts.append(_take(source.get_column(position), self._source_indices[positions]))
+        if len(column_parts) <= 1:
+            return column_parts[0] if column_parts else []
+        inverse_order = np.argsort(np.concatenate(positions_per_source), kind="stable")
+        return _take(_concat(column_parts), inverse_order)
+
+    def flatten(self) -> Tuple[List["DatasetIteratorIF"], np.ndarray, np.ndarray]:
+        return self._sources, self._source_ids, self._source_indices
+
+    @property
+    def underlying_iterators(self) -> List["DatasetIteratorIF"]:
+        return [self._dataset_iterator]
+
+
+@dataclass
+class PrefetchStatistics:
+    num_samples: int = 0
+    # number of samples that were not loaded yet when requested, i.e., the consumer had to wait for the workers
+    num_starved: int = 0
+    wait_time: float = 0.0
+
+    @property
+    def starvation_ratio(self) -> float:
+        return self.num_starved / self.num_samples if self.num_samples > 0 else 0.0
+
+
+# dataset iterator of a prefetching worker process, which is transferred only once per process
+_prefetch_worker_iterator: Optional[DatasetIteratorIF] = None
+
+
+def _init_prefetch_worker(dataset_iterator: DatasetIteratorIF):
+    global _prefetch_worker_iterator
+    _prefetch_worker_iterator = dataset_iterator
+
+
+def _load_prefetch_sample(index: int):
+    return _prefetch_worker_iterator[index]
+
+
+class PrefetchingDatasetIterator(DatasetIterator):
+    """Loads the samples ahead of the consumer during iteration, such that loading overlaps with, e.g., the training
+    step. Up to `prefetch_size` samples are loaded concurrently by `num_workers` threads or, with `use_processes`, by
+    worker processes, which circumvents the GIL for CPU-bound loading. The samples are yielded in order of the index
+    stream, which is either the given `indices` or, with `shuffle`, a new permutation for each pass, drawn from a random
+    generator seeded with `seed`. Random access is not prefetched. How often the consumer had to wait for a sample is
+    recorded in `statistics`. The workers are started lazily and stopped by `close`."""
+
+    def __init__(self, dataset_iterator: DatasetIteratorIF, num_workers: int = 4, prefetch_size: int = 16,
+                 use_processes: bool = False, indices: Sequence[int] = None, shuffle: bool = False, seed: int = None):
+        self._dataset_iterator = dataset_iterator
+        self._indices = None if indices is None else np.asarray(indices, dtype=get_index_dtype(len(dataset_iterator)))
+        self.num_workers = num_workers
+        self.prefetch_size = prefetch_size
+        self.use_processes = use_processes
+        self.shuffle = shuffle
+        self._random_gen = np.random.RandomState(seed)
+        self.statistics = PrefetchStatistics()
+        self._executor: Optional[Executor] = None
+
+    def __len__(self):
+        return len(self._dataset_iterator) if self._indices is None else len(self._indices)
+
+    def __getitem__(self, index: int):
+        if self._indices is None:
+            return self._dataset_iterator[index]
+        return self._dataset_iterator[int(self._indices[index])]
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_prefetch_worker,
+                                                     initargs=(self._dataset_iterator,))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.num_workers)
+        return self._executor
+
+    def _get_index_stream(self) -> np.ndarray:
+        indices = np.arange(len(self._dataset_iterator)) if self._indices is None else self._indices
+        return self._random_gen.permutation(indices) if self.shuffle else indices
+
+    def __iter__(self) -> Iterator:
+        executor = self._get_executor()
+        load = _load_prefetch_sample if self.use_processes else self._dataset_iterator.__getitem__
+        index_stream = iter(self._get_index_stream())
+        futures = deque()
+        try:
+            for index in index_stream:
+                futures.append(executor.submit(load, int(index)))
+                if len(futures) < self.prefetch_size:
+                    continue
+                yield self._next_sample(futures)
+            while futures:
+                yield self._next_sample(futures)
+        finally:
+            # e.g., if the consumer stops early
+            for future in futures:
+                future.cancel()
+
+    def _next_sample(self, futures: deque):
+        future = futures.popleft()
+        self.statistics.num_samples += 1
+        if not future.done():
+            self.statistics.num_starved += 1
+            start = time.perf_counter()
+            sample = future.result()
+            self.statistics.wait_time += time.perf_counter() - start
+            return sample
+        return future.result()
+
+    def get_batch(self, indices: Sequence[int]) -> Tuple[Sequence, ...]:
+        if self._indices is None:
+            return self._dataset_iterator.get_batch(indices)
+        return self._dataset_iterator.get_batch(self._indices[np.asarray(indices, dtype=np.int64)])
+
+    def flatten(self) -> Tuple[List["DatasetIteratorIF"], np.ndarray, np.ndarray]:
+        sources, source_ids, source_indices = self._dataset_iterator.flatten()
+        if self._indices is None:
+            return sources, source_ids, source_indices
+        return sources, source_ids[self._indices], source_indices[self._indices]
+
+    def get_column(self, position: int) -> Sequence:
+        column = self._dataset_iterator.get_column(position)
+        return column if self._indices is None else _take(column, self._indices)
+
+    def set_epoch(self, epoch: int):
+        super().set_epoch(epoch)
+        self._restart_worker_processes()
+
+    def set_worker(self, num_workers: int, worker_id: int):
+        super().set_worker(num_workers, worker_id)
+        self._restart_worker_processes()
+
+    def _restart_worker_processes(self):
+        # worker processes hold a copy of the iterator graph from their start, whereas threads share the graph
+        if self.use_processes:
+            self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> "PrefetchingDatasetIterator":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the workers are not transferred, e.g., to a data loader process, but started again on demand
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        return state
+
     @property
     def underlying_iterators(self) -> List["DatasetIteratorIF"]:
         return [self._dataset_iterator]
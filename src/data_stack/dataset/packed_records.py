@@ -0,0 +1,157 @@
+from typing import List, Iterator, Any, Optional
+from data_stack.dataset.iterator import DatasetIterator, DatasetIteratorIF
+from data_stack.io.storage_connectors import StorageConnector
+from data_stack.io.resources import StreamedResource, ResourceFactory, IteratorStream
+from data_stack.io.array_io import ArrayIO
+from data_stack.util.logger import logger
+import numpy as np
+import threading
+import pickle
+import mmap
+
+
+class PackedRecords:
+    """Layout of a packed record dataset below the identifier prefix `<identifier>`:
+
+    - `<identifier>/shard-<i>.bin`: the pickled samples of shard i, stored back to back
+    - `<identifier>/offsets.npy`: start offset of each record as if all shards were concatenated, followed by the
+      total size, i.e., record i spans the bytes [offsets[i], offsets[i + 1])
+    - `<identifier>/shards.npy`: index of the first record of each shard, followed by the number of records
+    """
+
+    @staticmethod
+    def get_shard_identifier(identifier: str, shard: int) -> str:
+        return f"{identifier}/shard-{shard:05d}.bin"
+
+    @staticmethod
+    def get_offsets_identifier(identifier: str) -> str:
+        return f"{identifier}/offsets.npy"
+
+    @staticmethod
+    def get_shards_identifier(identifier: str) -> str:
+        return f"{identifier}/shards.npy"
+
+
+class PackedRecordWriter:
+    """Persists the samples of a dataset iterator as packed records, i.e., many pickled samples per shard resource
+    plus an offset index, instead of one resource per sample. Shards are closed once they exceed `max_shard_size`
+    bytes and are streamed into the storage connector, such that no shard has to be held in memory."""
+
+    def __init__(self, storage_connector: StorageConnector, max_shard_size: int = 256 * 1024 * 1024):
+        self.storage_connector = storage_connector
+        self.max_shard_size = max_shard_size
+
+    def _iter_shard(self, samples: Iterator[Any], offsets: List[int]) -> Iterator[bytes]:
+        shard_size = 0
+        for sample in samples:
+            record = pickle.dumps(sample, protocol=pickle.HIGHEST_PROTOCOL)
+            offsets.append(offsets[-1] + len(record))
+            shard_size += len(record)
+            yield record
+            if shard_size >= self.max_shard_size:
+                break
+
+    def write(self, identifier: str, dataset_iterator: DatasetIteratorIF) -> int:
+        """Writes all samples of the dataset iterator below the given identifier prefix.
+        :return: number of written shards
+        """
+        samples = (dataset_iterator[index] for index in range(len(dataset_iterator)))
+        offsets, shard_starts = [0], []
+        while len(offsets) - 1 < len(dataset_iterator):
+            shard_starts.append(len(offsets) - 1)
+            shard_identifier = PackedRecords.get_shard_identifier(identifier, len(shard_starts) - 1)
+            records = IteratorStream(self._iter_shard(samples, offsets))
+            with ResourceFactory.get_resource(identifier=shard_identifier, file_like_object=records) as resource:
+                self.storage_connector.set_resource(shard_identifier, resource)
+        shard_starts.append(len(offsets) - 1)
+        logger.debug(f"Packed {len(offsets) - 1} records into {len(shard_starts) - 1} shards below {identifier}.")
+        index_resources = {PackedRecords.get_offsets_identifier(identifier): np.array(offsets, dtype=np.int64),
+                           PackedRecords.get_shards_identifier(identifier): np.array(shard_starts, dtype=np.int64)}
+        # the index is written last, such that incomplete datasets cannot be opened
+        for index_identifier, index in index_resources.items():
+            with ArrayIO.to_streamed_resource(index_identifier, index) as resource:
+                self.storage_connector.set_resource(index_identifier, resource)
+        return len(shard_starts) - 1
+
+
+class PackedRecordIterator(DatasetIterator):
+    """Dataset iterator over packed records written by the `PackedRecordWriter`. Random access resolves the shard and
+    offset of a record from the index in O(1) (a binary search over the few shard boundaries). Shards backed by files
+    are memory mapped, other shards (e.g., in an object store or a RAM cache) are read via seek and read. Iterating
+    over the iterator streams the shards sequentially instead. Records are pickled, so only open trusted datasets."""
+
+    READ_BLOCK_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, storage_connector: StorageConnector, identifier: str):
+        with storage_connector.get_resource(PackedRecords.get_offsets_identifier(identifier)) as resource:
+            self._offsets = ArrayIO.from_streamed_resource(resource)
+        with storage_connector.get_resource(PackedRecords.get_shards_identifier(identifier)) as resource:
+            self._shard_starts = np.array(ArrayIO.from_streamed_resource(resource))
+        self._shard_offsets = self._offsets[self._shard_starts]
+        self._shards: List[StreamedResource] = []
+        # shards may be backed differently, e.g., a caching storage connector keeps small shards in RAM
+        self._mmaps: List[Optional[mmap.mmap]] = []
+        for shard in range(len(self._shard_starts) - 1):
+            resource = storage_connector.get_resource(PackedRecords.get_shard_identifier(identifier, shard))
+            self._shards.append(resource)
+            # empty files cannot be memory mapped
+            is_mappable = resource.is_file_backed and self._shard_offsets[shard + 1] > self._shard_offsets[shard]
+            self._mmaps.append(mmap.mmap(resource.fileno(), 0, access=mmap.ACCESS_READ) if is_mappable else None)
+        self._storage_connector = storage_connector
+        self._identifier = identifier
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def _read_record(self, shard: int, start: int, end: int) -> bytes:
+        if self._mmaps[shard] is not None:
+            return self._mmaps[shard][start:end]
+        # shared resources are not thread-safe, as seek and read are two operations
+        with self._lock:
+            resource = self._shards[shard]
+            resource.seek(start)
+            return resource.read(end - start)
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Index {index} out of range for {len(self)} records.")
+        shard = int(np.searchsorted(self._shard_starts, index, side="right")) - 1
+        shard_offset = self._shard_offsets[shard]
+        record = self._read_record(shard, int(self._offsets[index] - shard_offset),
+                                   int(self._offsets[index + 1] - shard_offset))
+        return pickle.loads(record)
+
+    def _iter_shard(self, shard: int) -> Iterator[memoryview]:
+        shard_offset = self._shard_offsets[shard]
+        records = range(self._shard_starts[shard], self._shard_starts[shard + 1])
+        if self._mmaps[shard] is not None:
+            view = memoryview(self._mmaps[shard])
+            for index in records:
+                yield view[self._offsets[index] - shard_offset:self._offsets[index + 1] - shard_offset]
+            return
+        # a separate resource, such that random accesses do not interfere with the sequential reads
+        with self._storage_connector.get_resource(PackedRecords.get_shard_identifier(self._identifier, shard)) as resource:
+            view, view_offset = memoryview(b""), 0
+            for index in records:
+                start, end = int(self._offsets[index] - shard_offset), int(self._offsets[index + 1] - shard_offset)
+                if end > view_offset + len(view):
+                    # the shard is read in large blocks, each holding as many complete records as possible
+                    remainder = view[start - view_offset:]
+                    block = resource.read(max(PackedRecordIterator.READ_BLOCK_SIZE, end - start - len(remainder)))
+                    view, view_offset = memoryview(bytes(remainder) + block), start
+                yield view[start - view_offset:end - view_offset]
+
+    def __iter__(self) -> Iterator[Any]:
+        for shard in range(len(self._shard_starts) - 1):
+            for record in self._iter_shard(shard):
+                yield pickle.loads(record)
+
+    def close(self):
+        for shard_mmap in self._mmaps:
+            if shard_mmap is not None:
+                shard_mmap.close()
+        for resource in self._shards:
+            resource.close()
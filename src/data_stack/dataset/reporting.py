@@ -7,6 +7,8 @@ from enum import Enum
 import json
 import yaml
 import dataclasses
+import numpy as np
+import torch
 from data_stack.dataset.iterator import InformedDatasetIterator
 
 
@@ -34,7 +36,10 @@ class DatasetIteratorReportGenerator:
     def generate_report(iterator: InformedDatasetIterator, report_format: ReportFormat = ReportFormat.DATA_CLASS):
         sub_reports = [DatasetIteratorReportGenerator.generate_report(sub_iterator) for sub_iterator in iterator.underlying_iterators]
         meta = iterator.dataset_meta
-        target_dist = {k: v for k, v in sorted(Counter([row[meta.target_pos] for row in iterator]).items())}
+        targets = iterator.get_targets()
+        if isinstance(targets, (np.ndarray, torch.Tensor)):
+            targets = targets.tolist()
+        target_dist = {k: v for k, v in sorted(Counter(targets).items())}
         iteration_speed = DatasetIteratorReportGenerator.measure_iteration_speed(iterator)
         # generate report
 
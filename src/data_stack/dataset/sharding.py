@@ -0,0 +1,117 @@
+from typing import Sequence, Tuple, List, Iterator
+from data_stack.dataset.iterator import DatasetIterator, DatasetIteratorIF, _take
+from data_stack.dataset.shuffle import EpochShuffledDatasetIterator
+from data_stack.util.helper import get_index_dtype
+import numpy as np
+import torch
+
+
+class ShardedDatasetIterator(DatasetIterator):
+    """Disjoint part of an iterator for a single process in distributed and/or multi-worker training. The samples are
+    split into `world_size * num_workers` shards and the shard of `rank` and `worker_id` is exposed. Since the worker
+    is only known within the worker process of a data loader, it can also be bound after construction via
+    `set_worker`, e.g., by passing `worker_init_fn` to a data loader whose workers each iterate over the dataset.
+    Shards are either strided (sample i belongs to shard i mod #shards) or `contiguous` ranges, which keep the I/O
+    local.
+
+    All shards have the same length, such that all processes run the same number of steps: with `drop_last`, the
+    trailing samples are dropped, otherwise the last shards are padded by repeating samples from the beginning.
+    If `shuffle`, the samples are shuffled before sharding (see `EpochShuffledDatasetIterator`), where all processes
+    have to use the same seed and call `set_epoch` with the same epoch to draw the same permutation. The indices are
+    computed on the fly and, with the default `bijective` permutation, no process materializes the index lists of the
+    other shards. Otherwise, every process holds the permutation of the whole dataset."""
+
+    # number of indices resolved at once during iteration
+    ITER_BLOCK_SIZE = 4096
+
+    def __init__(self, dataset_iterator: DatasetIteratorIF, world_size: int = 1, rank: int = 0, num_workers: int = 1,
+                 worker_id: int = 0, contiguous: bool = False, drop_last: bool = False, shuffle: bool = False,
+                 seed: int = 0, block_size: int = None, bijective: bool = True, epoch: int = 0):
+        if not 0 <= rank < world_size:
+            raise ValueError(f"Rank {rank} is not within the world size {world_size}.")
+        self._dataset_iterator = dataset_iterator
+        self._shuffled_iterator = EpochShuffledDatasetIterator(dataset_iterator, seed=seed, block_size=block_size,
+                                                               bijective=bijective, epoch=epoch) if shuffle else None
+        self.world_size = world_size
+        self.rank = rank
+        self.contiguous = contiguous
+        self.drop_last = drop_last
+        self.set_worker(num_workers, worker_id)
+
+    def set_worker(self, num_workers: int, worker_id: int):
+        """Binds the iterator to the shard of the given worker of this rank."""
+        if not 0 <= worker_id < num_workers:
+            raise ValueError(f"Worker id {worker_id} is not within the number of workers {num_workers}.")
+        self.num_shards = self.world_size * num_workers
+        self.shard = self.rank * num_workers + worker_id
+        length = len(self._dataset_iterator)
+        self._num_samples = length // self.num_shards if self.drop_last else -(-length // self.num_shards)
+
+    @property
+    def epoch(self) -> int:
+        return self._shuffled_iterator.epoch if self._shuffled_iterator is not None else 0
+
+    def set_epoch(self, epoch: int):
+        # without shuffling, the shards are the same in every epoch
+        if self._shuffled_iterator is not None:
+            self._shuffled_iterator.set_epoch(epoch)
+        super().set_epoch(epoch)
+
+    def __len__(self):
+        return self._num_samples
+
+    def _get_positions(self, indices: np.ndarray) -> np.ndarray:
+        """Maps indices of this shard to indices of the underlying (shuffled) iterator."""
+        if self.contiguous:
+            positions = self.shard * self._num_samples + indices
+        else:
+            positions = indices * self.num_shards + self.shard
+        # padding wraps around to the beginning
+        return positions % len(self._dataset_iterator)
+
+    def _get_underlying_indices(self, indices: np.ndarray) -> np.ndarray:
+        positions = self._get_positions(indices)
+        if self._shuffled_iterator is not None:
+            return self._shuffled_iterator.order[positions]
+        return positions.astype(get_index_dtype(len(self._dataset_iterator)))
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Index {index} out of range for {len(self)} samples.")
+        return self._dataset_iterator[int(self._get_underlying_indices(np.array([index], dtype=np.int64))[0])]
+
+    def __iter__(self) -> Iterator:
+        dataset_iterator = self._dataset_iterator
+        for start in range(0, len(self), ShardedDatasetIterator.ITER_BLOCK_SIZE):
+            end = min(start + ShardedDatasetIterator.ITER_BLOCK_SIZE, len(self))
+            for index in self._get_underlying_indices(np.arange(start, end, dtype=np.int64)).tolist():
+                yield dataset_iterator[index]
+
+    def get_batch(self, indices: Sequence[int]) -> Tuple[Sequence, ...]:
+        indices = np.asarray(indices, dtype=np.int64)
+        indices = np.where(indices < 0, indices + len(self), indices)
+        if np.any((indices < 0) | (indices >= len(self))):
+            raise IndexError
+        return self._dataset_iterator.get_batch(self._get_underlying_indices(indices))
+
+    def flatten(self) -> Tuple[List["DatasetIteratorIF"], np.ndarray, np.ndarray]:
+        sources, source_ids, source_indices = self._dataset_iterator.flatten()
+        underlying_indices = self._get_underlying_indices(np.arange(len(self), dtype=np.int64))
+        return sources, source_ids[underlying_indices], source_indices[underlying_indices]
+
+    def get_column(self, position: int) -> Sequence:
+        underlying_indices = self._get_underlying_indices(np.arange(len(self), dtype=np.int64))
+        return _take(self._dataset_iterator.get_column(position), underlying_indices)
+
+    @property
+    def underlying_iterators(self) -> List["DatasetIteratorIF"]:
+        return [self._dataset_iterator]
+
+
+def worker_init_fn(worker_id: int):
+    """Worker init function for a `torch.utils.data.DataLoader`, which binds all sharded iterators of the worker's copy
+    of the dataset to the shards of the worker."""
+    worker_info = torch.utils.data.get_worker_info()
+    worker_info.dataset.set_worker(worker_info.num_workers, worker_id)
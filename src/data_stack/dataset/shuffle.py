@@ -0,0 +1,211 @@
+from typing import Sequence, Tuple, List, Iterator, Union, Optional
+from data_stack.dataset.iterator import DatasetIterator, DatasetIteratorIF, _take
+from data_stack.util.helper import get_index_dtype
+import numpy as np
+
+_MASK32 = 0xFFFFFFFF
+
+
+def _mix32(x: int) -> int:
+    # murmur3 finalizer on 32 bit integers
+    x = ((x ^ (x >> 16)) * 0x85EBCA6B) & _MASK32
+    x = ((x ^ (x >> 13)) * 0xC2B2AE35) & _MASK32
+    return x ^ (x >> 16)
+
+
+def _mix32_array(x: np.ndarray) -> np.ndarray:
+    # same as `_mix32` on uint64 arrays, the products of two 32 bit integers cannot overflow
+    x = ((x ^ (x >> np.uint64(16))) * np.uint64(0x85EBCA6B)) & np.uint64(_MASK32)
+    x = ((x ^ (x >> np.uint64(13))) * np.uint64(0xC2B2AE35)) & np.uint64(_MASK32)
+    return x ^ (x >> np.uint64(16))
+
+
+def _get_half_bits(length: int) -> int:
+    # smallest even number of bits covering the length, such that the domain is smaller than 4 * length
+    return max(1, ((length - 1).bit_length() + 1) // 2)
+
+
+def _feistel(index: int, half_bits: int, keys: Sequence[int]) -> int:
+    mask = (1 << half_bits) - 1
+    left, right = index >> half_bits, index & mask
+    for key in keys:
+        left, right = right, left ^ (_mix32(right ^ key) & mask)
+    return (left << half_bits) | right
+
+
+def _feistel_array(indices: np.ndarray, half_bits: int, keys: np.ndarray) -> np.ndarray:
+    mask = np.uint64((1 << half_bits) - 1)
+    left, right = indices >> np.uint64(half_bits), indices & mask
+    for key in keys:
+        left, right = right, left ^ (_mix32_array(right ^ key) & mask)
+    return (left << np.uint64(half_bits)) | right
+
+
+def _walk(index: int, length: int, keys: Sequence[int]) -> int:
+    half_bits = _get_half_bits(length)
+    index = _feistel(index, half_bits, keys)
+    # cycle walking: indices beyond the length are permuted again until they fall into range
+    while index >= length:
+        index = _feistel(index, half_bits, keys)
+    return index
+
+
+def _walk_array(indices: np.ndarray, length: int, keys: np.ndarray) -> np.ndarray:
+    """Vectorized `_walk`. The keys have the shape (rounds, 1) or, for individual keys per index, (rounds, n)."""
+    half_bits = _get_half_bits(length)
+    result = _feistel_array(indices, half_bits, keys)
+    pending = np.flatnonzero(result >= length)
+    while len(pending) > 0:
+        pending_keys = keys if keys.shape[1] == 1 else keys[:, pending]
+        result[pending] = _feistel_array(result[pending], half_bits, pending_keys)
+        pending = pending[result[pending] >= length]
+    return result
+
+
+class FeistelPermutation:
+    """Pseudo-random permutation of range(length), where each element is computed on demand in O(1) memory by a
+    4-round Feistel network instead of materializing the permutation. The Feistel network is a bijection on
+    [0, 4^h) with h bits per half; results beyond the length are permuted again (cycle walking), which takes less than
+    four rounds on average. With `block_size`, the full blocks are permuted and the elements are permuted within each
+    block only, while the trailing partial block stays last. Indexing accepts integers and numpy arrays."""
+
+    NUM_ROUNDS = 4
+
+    def __init__(self, length: int, seed: Union[int, Sequence[int]], block_size: Optional[int] = None):
+        self.length = length
+        self.block_size = block_size
+        keys = np.random.SeedSequence(seed).generate_state(2 * FeistelPermutation.NUM_ROUNDS).astype(np.uint64)
+        self._keys, self._block_keys = keys[:FeistelPermutation.NUM_ROUNDS], keys[FeistelPermutation.NUM_ROUNDS:]
+        self._key_list, self._block_key_list = self._keys.tolist(), self._block_keys.tolist()
+
+    def __len__(self):
+        return self.length
+
+    def _get_item(self, index: int) -> int:
+        if self.block_size is None:
+            return _walk(index, self.length, self._key_list)
+        block, offset = divmod(index, self.block_size)
+        num_full_blocks = self.length // self.block_size
+        if block < num_full_blocks:
+            block = _walk(block, num_full_blocks, self._block_key_list)
+        block_length = min(self.block_size, self.length - block * self.block_size)
+        # each block is permuted with its own keys
+        block_hash = _mix32(block & _MASK32)
+        return block * self.block_size + _walk(offset, block_length, [key ^ block_hash for key in self._key_list])
+
+    def _get_items(self, indices: np.ndarray) -> np.ndarray:
+        indices = indices.astype(np.uint64)
+        if self.block_size is None:
+            return _walk_array(indices, self.length, self._keys[:, None])
+        block_size = np.uint64(self.block_size)
+        blocks, offsets = indices // block_size, indices % block_size
+        num_full_blocks = self.length // self.block_size
+        full = blocks < num_full_blocks
+        if num_full_blocks > 0:
+            blocks[full] = _walk_array(blocks[full], num_full_blocks, self._block_keys[:, None])
+        keys = self._keys[:, None] ^ _mix32_array(blocks & np.uint64(_MASK32))[None, :]
+        offsets[full] = _walk_array(offsets[full], self.block_size, keys[:, full])
+        if not full.all():
+            partial = ~full
+            offsets[partial] = _walk_array(offsets[partial], self.length - num_full_blocks * self.block_size,
+                                           keys[:, partial])
+        return blocks * block_size + offsets
+
+    def __getitem__(self, index: Union[int, np.ndarray]) -> Union[int, np.ndarray]:
+        if isinstance(index, np.ndarray):
+            if len(index) > 0 and (index.min() < 0 or index.max() >= self.length):
+                raise IndexError(f"Indices out of range for a permutation of length {self.length}.")
+            return self._get_items(index).astype(get_index_dtype(self.length))
+        index = int(index)
+        if not 0 <= index < self.length:
+            raise IndexError(f"Index {index} out of range for a permutation of length {self.length}.")
+        return self._get_item(index)
+
+
+def get_permutation_array(length: int, seed: Union[int, Sequence[int]], block_size: Optional[int] = None) -> np.ndarray:
+    """Materializes a random permutation as compact index array (int32, if possible), which is shuffled in place.
+    With `block_size`, the same block-local scheme as in `FeistelPermutation` is applied."""
+    random_gen = np.random.default_rng(seed)
+    order = np.arange(length, dtype=get_index_dtype(length))
+    if block_size is None:
+        random_gen.shuffle(order)
+        return order
+    num_full_blocks = length // block_size
+    blocks = order[:num_full_blocks * block_size].reshape(num_full_blocks, block_size)
+    random_gen.shuffle(blocks)
+    random_gen.permuted(blocks, axis=1, out=blocks)
+    random_gen.shuffle(order[num_full_blocks * block_size:])
+    return order
+
+
+class EpochShuffledDatasetIterator(DatasetIterator):
+    """Shuffled view on an iterator, whose order is reproducible given the seed and the epoch set via `set_epoch`.
+    Each epoch's permutation is either materialized as compact index array or, if `bijective`, computed per index by a
+    `FeistelPermutation`, which requires O(1) memory regardless of the dataset size. With `block_size`, only the order of
+    the blocks and the order within each block are shuffled, such that consecutive samples stay local, e.g., within a
+    shard or page of the underlying storage."""
+
+    # number of indices resolved at once during iteration
+    ITER_BLOCK_SIZE = 4096
+
+    def __init__(self, dataset_iterator: DatasetIteratorIF, seed: int = 0, block_size: int = None,
+                 bijective: bool = False, epoch: int = 0):
+        self._dataset_iterator = dataset_iterator
+        self.seed = seed
+        self.block_size = block_size
+        self.bijective = bijective
+        self._epoch = epoch
+        self._order: Optional[Union[np.ndarray, FeistelPermutation]] = None
+
+    @property
+    def epoch(self) -> int:
+        return self._epoch
+
+    def set_epoch(self, epoch: int):
+        if epoch != self._epoch:
+            self._epoch = epoch
+            self._order = None
+
+    @property
+    def order(self) -> Union[np.ndarray, FeistelPermutation]:
+        """Permutation of the current epoch, which maps each index to the index of the underlying iterator."""
+        if self._order is None:
+            if self.bijective:
+                self._order = FeistelPermutation(len(self), [self.seed, self._epoch], self.block_size)
+            else:
+                self._order = get_permutation_array(len(self), [self.seed, self._epoch], self.block_size)
+        return self._order
+
+    def __len__(self):
+        return len(self._dataset_iterator)
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Index {index} out of range for {len(self)} samples.")
+        return self._dataset_iterator[int(self.order[index])]
+
+    def __iter__(self) -> Iterator:
+        dataset_iterator = self._dataset_iterator
+        for start in range(0, len(self), EpochShuffledDatasetIterator.ITER_BLOCK_SIZE):
+            end = min(start + EpochShuffledDatasetIterator.ITER_BLOCK_SIZE, len(self))
+            for index in self.order[np.arange(start, end)].tolist():
+                yield dataset_iterator[index]
+
+    def get_batch(self, indices: Sequence[int]) -> Tuple[Sequence, ...]:
+        indices = np.asarray(indices, dtype=np.int64)
+        indices = np.where(indices < 0, indices + len(self), indices)
+        return self._dataset_iterator.get_batch(self.order[indices])
+
+    def flatten(self) -> Tuple[List["DatasetIteratorIF"], np.ndarray, np.ndarray]:
+        sources, source_ids, source_indices = self._dataset_iterator.flatten()
+        order = self.order[np.arange(len(self))]
+        return sources, source_ids[order], source_indices[order]
+
+    def get_column(self, position: int) -> Sequence:
+        return _take(self._dataset_iterator.get_column(position), self.order[np.arange(len(self))])
+
+    @property
+    def underlying_iterators(self) -> List["DatasetIteratorIF"]:
+        return [self._dataset_iterator]
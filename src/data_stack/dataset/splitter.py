@@ -2,8 +2,8 @@ from data_stack.dataset.iterator import DatasetIteratorIF, DatasetIteratorView
 from typing import List, Tuple, Any, Optional
 from abc import ABC, abstractmethod
 from sklearn.model_selection import train_test_split
-import random
 from sklearn.model_selection import StratifiedKFold, KFold
+from data_stack.util.helper import get_index_dtype
 import numpy as np
 
 
@@ -67,31 +67,33 @@ class RandomSplitterImpl(SplitterIF):
 
     def __init__(self, ratios: List[float], seed: int = 1):
         self.ratios = ratios
-        self.random_gen = random.Random(seed)
+        self.random_gen = np.random.RandomState(seed)
 
     def split(self, dataset_iterator: DatasetIteratorIF) -> List[DatasetIteratorView]:
         dataset_length = len(dataset_iterator)
-        splits_indices = self._determine_split_indices(dataset_length, self.ratios)
+        splits_indices = self._determine_split_index_arrays(dataset_length, self.ratios)
 
         return [DatasetIteratorView(dataset_iterator, split_indices) for split_indices in splits_indices]
 
-    def _determine_split_indices(self, dataset_length: int, ratios: List[float]) -> List[List[int]]:
+    def _determine_split_index_arrays(self, dataset_length: int, ratios: List[float]) -> List[np.ndarray]:
         def ratio_to_index(ratio: float) -> int:
             return int(ratio*dataset_length)
 
-        indices = list(range(dataset_length))
-        self.random_gen.shuffle(indices)
+        indices = self.random_gen.permutation(dataset_length).astype(get_index_dtype(dataset_length))
         lower = 0
         upper = 0
-        split_indices: List[List[int]] = []
+        split_indices: List[np.ndarray] = []
         for ratio in ratios:
             upper = upper + ratio_to_index(ratio)
             split_indices.append(indices[lower: upper])
             lower = upper
         # if we don't have a round split, we add the remaining samples to the last split.
-        split_indices[-1] = split_indices[-1] + indices[upper:]
+        split_indices[-1] = np.concatenate([split_indices[-1], indices[upper:]])
         return split_indices
 
+    def _determine_split_indices(self, dataset_length: int, ratios: List[float]) -> List[List[int]]:
+        return [split_indices.tolist() for split_indices in self._determine_split_index_arrays(dataset_length, ratios)]
+
     def get_indices(self, dataset_iterator: DatasetIteratorIF) -> List[List[int]]:
         dataset_length = len(dataset_iterator)
         splits_indices = self._determine_split_indices(dataset_length, self.ratios)
@@ -111,12 +113,12 @@ class StratifiedSplitterImpl(SplitterIF):
         return [DatasetIteratorView(dataset_iterator, split_indices) for split_indices in splits_indices]
 
     def _determine_split_indices(self, dataset_length: int, ratios: List[float], dataset_iterator: DatasetIteratorIF)\
-            -> List[List[int]]:
-        indices_remaining = list(range(dataset_length))
+            -> List[np.ndarray]:
+        indices_remaining = np.arange(dataset_length, dtype=get_index_dtype(dataset_length))
         initial_length = len(indices_remaining)
-        targets_remaining = [sample[1] for sample in dataset_iterator]
+        targets_remaining = np.asarray(dataset_iterator.get_column(1))
 
-        split_indices: List[List[int]] = []
+        split_indices: List[np.ndarray] = []
 
         # split the data set until the desired number of splits is reached
         for split_ratio in ratios[:-1]:
@@ -132,7 +134,7 @@ class StratifiedSplitterImpl(SplitterIF):
     def get_indices(self, dataset_iterator: DatasetIteratorIF) -> List[List[int]]:
         dataset_length = len(dataset_iterator)
         splits_indices = self._determine_split_indices(dataset_length, self.ratios, dataset_iterator)
-        return splits_indices
+        return [split_indices.tolist() for split_indices in splits_indices]
 
 
 class NestedCVSplitterImpl(SplitterIF):
@@ -161,7 +163,7 @@ class NestedCVSplitterImpl(SplitterIF):
 
     def split(self, dataset_iterator: DatasetIteratorIF) -> Tuple[List[DatasetIteratorIF], List[List[DatasetIteratorIF]]]:
         # create outer loop folds
-        targets = np.array([sample[self.target_pos] for sample in dataset_iterator])
+        targets = np.asarray(dataset_iterator.get_column(self.target_pos))
         outer_folds_indices = [fold[1] for fold in self.outer_splitter.split(X=np.zeros(len(targets)), y=targets)]
         outer_fold_iterators = [DatasetIteratorView(dataset_iterator, fold_indices) for fold_indices in outer_folds_indices]
         # create inner loop folds
@@ -169,7 +171,7 @@ class NestedCVSplitterImpl(SplitterIF):
         for outer_fold_id in range(len(outer_fold_iterators)):
             # concat the indices of the splits which belong to the train splits
             train_split_ids = [i for i in range(len(outer_folds_indices)) if i != outer_fold_id]
-            outer_train_fold_indices = np.array([indice for i in train_split_ids for indice in outer_folds_indices[i]])
+            outer_train_fold_indices = np.concatenate([outer_folds_indices[i] for i in train_split_ids])
             inner_targets = targets[outer_train_fold_indices]
             inner_folds_indices = [outer_train_fold_indices[inner_fold[1]]
                                    for inner_fold in self.inner_splitter.split(X=np.zeros(len(inner_targets)), y=inner_targets)]
@@ -203,12 +205,12 @@ class CVSplitterImpl(SplitterIF):
             self.splitter = KFold(n_splits=num_folds, shuffle=shuffle, random_state=self.random_state)
 
     def split(self, dataset_iterator: DatasetIteratorIF) -> List[DatasetIteratorView]:
-        targets = np.array([sample[self.target_pos] for sample in dataset_iterator])
-        folds_indices = [fold[1].tolist() for fold in self.splitter.split(X=np.zeros(len(targets)), y=targets)]
+        targets = np.asarray(dataset_iterator.get_column(self.target_pos))
+        folds_indices = [fold[1] for fold in self.splitter.split(X=np.zeros(len(targets)), y=targets)]
         fold_iterators = [DatasetIteratorView(dataset_iterator, fold_indices) for fold_indices in folds_indices]
         return fold_iterators
 
     def get_indices(self, dataset_iterator: DatasetIteratorIF) -> List[List[int]]:
         folds = self.split(dataset_iterator)
-        folds_indices = [fold.indices for fold in folds]
+        folds_indices = [fold.indices.tolist() for fold in folds]
         return folds_indices
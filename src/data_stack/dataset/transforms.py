@@ -0,0 +1,204 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Any, Optional, Sequence, Tuple, List, Iterator
+from data_stack.dataset.iterator import DatasetIterator, DatasetIteratorIF, _stack
+from data_stack.io.storage_connectors import StorageConnector
+from data_stack.io.resources import ResourceFactory
+import numpy as np
+import threading
+import pickle
+import io
+
+
+@dataclass
+class TransformStage:
+    """A single stage of a transform chain. If `position` is given, the transform is applied to the element at this
+    position of each sample only (e.g., the image), otherwise to the whole sample. The optional `batch_transform` is
+    the vectorized counterpart, which receives the column (or the tuple of all columns) of a batch at once and is used
+    for batch access. Deterministic stages can be flagged as `cacheable`, such that their results are memoized."""
+    transform: Callable[[Any], Any]
+    position: Optional[int] = None
+    batch_transform: Optional[Callable[[Any], Any]] = None
+    cacheable: bool = False
+
+    def apply(self, sample: Tuple) -> Tuple:
+        if self.position is None:
+            return self.transform(sample)
+        sample = tuple(sample)
+        return sample[:self.position] + (self.transform(sample[self.position]),) + sample[self.position + 1:]
+
+    def apply_batch(self, batch: Tuple[Sequence, ...]) -> Tuple[Sequence, ...]:
+        if self.batch_transform is None:
+            # per-sample fallback
+            rows = [self.apply(row) for row in zip(*batch)]
+            return tuple(_stack(list(column)) for column in zip(*rows))
+        if self.position is None:
+            return tuple(self.batch_transform(batch))
+        return batch[:self.position] + (self.batch_transform(batch[self.position]),) + batch[self.position + 1:]
+
+
+class TransformMemo(ABC):
+    """Memoizes the transformed samples by an integer key, e.g., the position of the sample."""
+
+    @abstractmethod
+    def lookup(self, index: int) -> Tuple[bool, Any]:
+        """Returns whether the sample has been memoized and the sample itself."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def store(self, index: int, sample: Any):
+        raise NotImplementedError
+
+
+class LRUTransformMemo(TransformMemo):
+    """Keeps up to `max_size` samples in memory and evicts the least recently used ones."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._samples: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def lookup(self, index: int) -> Tuple[bool, Any]:
+        with self._lock:
+            if index not in self._samples:
+                return False, None
+            self._samples.move_to_end(index)
+            return True, self._samples[index]
+
+    def store(self, index: int, sample: Any):
+        with self._lock:
+            self._samples[index] = sample
+            self._samples.move_to_end(index)
+            while len(self._samples) > self.max_size:
+                self._samples.popitem(last=False)
+
+
+class StorageTransformMemo(TransformMemo):
+    """Persists the pickled samples as `<identifier_prefix>/<index>` in the storage connector, such that the memo
+    survives across runs and processes. The identifier prefix has to identify both the iterator and the transforms,
+    e.g., via `get_fingerprint(iterator, config)` with the transform parameters in the config. Combine it with a
+    `CachingStorageConnector` to bound the disk usage. Samples are pickled, so only use trusted storages."""
+
+    def __init__(self, storage_connector: StorageConnector, identifier_prefix: str):
+        self.storage_connector = storage_connector
+        self.identifier_prefix = identifier_prefix
+
+    def _get_identifier(self, index: int) -> str:
+        return f"{self.identifier_prefix}/{index}"
+
+    def lookup(self, index: int) -> Tuple[bool, Any]:
+        identifier = self._get_identifier(index)
+        if not self.storage_connector.has_resource(identifier):
+            return False, None
+        with self.storage_connector.get_resource(identifier) as resource:
+            return True, pickle.loads(resource.read())
+
+    def store(self, index: int, sample: Any):
+        identifier = self._get_identifier(index)
+        buffer = io.BytesIO(pickle.dumps(sample, protocol=pickle.HIGHEST_PROTOCOL))
+        with ResourceFactory.get_resource(identifier=identifier, file_like_object=buffer) as resource:
+            self.storage_connector.set_resource(identifier, resource)
+
+
+class MappedDatasetIterator(DatasetIterator):
+    """Applies a chain of transform stages lazily to the samples of the underlying iterator, i.e., whenever a sample
+    is accessed. If a memo is given, the output of the leading run of cacheable stages is memoized per sample; later
+    stages always run, since their input depends on a non-cacheable (e.g., random augmentation) stage. Batch access
+    applies the batch transforms of the stages to the whole batch instead of transforming sample by sample.
+
+    Samples are memoized by their position within the source iterators of the graph (see `flatten`), such that the
+    memo stays valid when the order of the underlying iterator changes, e.g., via `set_epoch` on this iterator."""
+
+    def __init__(self, dataset_iterator: DatasetIteratorIF, stages: List[TransformStage],
+                 memo: TransformMemo = None):
+        self._dataset_iterator = dataset_iterator
+        self._stages = stages
+        self._memo = memo
+        num_cacheable = 0
+        while num_cacheable < len(stages) and stages[num_cacheable].cacheable:
+            num_cacheable += 1
+        # without memo, there is nothing to split
+        self._num_memoized = num_cacheable if memo is not None else 0
+        self._memo_keys: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self._dataset_iterator)
+
+    @staticmethod
+    def _apply(stages: List[TransformStage], sample: Tuple) -> Tuple:
+        for stage in stages:
+            sample = stage.apply(sample)
+        return sample
+
+    def _get_memo_keys(self) -> np.ndarray:
+        # position of each sample within the concatenation of all source iterators
+        if self._memo_keys is None:
+            sources, source_ids, source_indices = self._dataset_iterator.flatten()
+            source_offsets = np.cumsum([0] + [len(source) for source in sources[:-1]], dtype=np.int64)
+            self._memo_keys = source_offsets[source_ids] + source_indices
+        return self._memo_keys
+
+    def _get_memoized(self, index: int) -> Tuple:
+        key = int(self._get_memo_keys()[index])
+        found, sample = self._memo.lookup(key)
+        if not found:
+            sample = MappedDatasetIterator._apply(self._stages[:self._num_memoized], self._dataset_iterator[index])
+            self._memo.store(key, sample)
+        return sample
+
+    def set_epoch(self, epoch: int):
+        super().set_epoch(epoch)
+        # the order of the underlying iterator might have changed
+        self._memo_keys = None
+
+    def set_worker(self, num_workers: int, worker_id: int):
+        super().set_worker(num_workers, worker_id)
+        self._memo_keys = None
+
+    def _resolve_index(self, index: int) -> int:
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Index {index} out of range for {len(self)} samples.")
+        return index
+
+    def __getitem__(self, index: int):
+        index = self._resolve_index(index)
+        if self._num_memoized == 0:
+            return MappedDatasetIterator._apply(self._stages, self._dataset_iterator[index])
+        return MappedDatasetIterator._apply(self._stages[self._num_memoized:], self._get_memoized(index))
+
+    def __iter__(self) -> Iterator:
+        if self._num_memoized == 0:
+            for sample in self._dataset_iterator:
+                yield MappedDatasetIterator._apply(self._stages, sample)
+            return
+        # memoized samples must not be loaded from the underlying iterator, so it cannot be streamed
+        remaining_stages = self._stages[self._num_memoized:]
+        for index in range(len(self)):
+            yield MappedDatasetIterator._apply(remaining_stages, self._get_memoized(index))
+
+    def get_batch(self, indices: Sequence[int]) -> Tuple[Sequence, ...]:
+        if self._num_memoized == 0:
+            batch = self._dataset_iterator.get_batch(indices)
+        else:
+            rows = [self._get_memoized(self._resolve_index(index)) for index in indices]
+            batch = tuple(_stack(list(column)) for column in zip(*rows))
+        for stage in self._stages[self._num_memoized:]:
+            batch = stage.apply_batch(batch)
+        return batch
+
+    def get_column(self, position: int) -> Sequence:
+        # columns that no stage touches, e.g., the targets, are taken from the underlying iterator directly
+        if all(stage.position is not None and stage.position != position for stage in self._stages):
+            return self._dataset_iterator.get_column(position)
+        return super().get_column(position)
+
+    @property
+    def underlying_iterators(self) -> List["DatasetIteratorIF"]:
+        return [self._dataset_iterator]
@@ -31,3 +31,6 @@ class ResourceNotFoundError(Exception):
 class MalformedIdentifierError(Exception):
     """Thrown when an identifier string is malformed."""
 
+
+class IncompleteDownloadError(Exception):
+    """Thrown when a download ended before all announced bytes were received."""
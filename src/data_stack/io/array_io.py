@@ -0,0 +1,41 @@
+import io
+import numpy as np
+from typing import Tuple
+from numpy.lib import format as npy_format
+from data_stack.io.resources import ResourceFactory, StreamedResource
+
+
+class ArrayIO:
+    """Stores numpy arrays as `StreamedResource`s in the npy format, i.e., a small header followed by the raw
+    contiguous array. Resources that are backed by a real file are opened via memory mapping, such that loading
+    is near-instant and all processes reading the same resource share a single copy in the page cache."""
+
+    @staticmethod
+    def to_streamed_resource(identifier: str, array: np.ndarray) -> StreamedResource:
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(array), allow_pickle=False)
+        return ResourceFactory.get_resource(identifier=identifier, file_like_object=buffer)
+
+    @staticmethod
+    def get_npy_header(shape: Tuple[int, ...], dtype: np.dtype) -> bytes:
+        """Returns the npy header of a C-contiguous array, such that the array can be written chunk by chunk."""
+        buffer = io.BytesIO()
+        header = {"descr": npy_format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": tuple(shape)}
+        npy_format.write_array_header_1_0(buffer, header)
+        return buffer.getvalue()
+
+    @staticmethod
+    def from_streamed_resource(resource: StreamedResource, mmap: bool = True) -> np.ndarray:
+        resource.seek(0)
+        if mmap and resource.is_file_backed:
+            version = npy_format.read_magic(resource)
+            if version == (1, 0):
+                shape, fortran_order, dtype = npy_format.read_array_header_1_0(resource)
+            else:
+                shape, fortran_order, dtype = npy_format.read_array_header_2_0(resource)
+            order = "F" if fortran_order else "C"
+            if int(np.prod(shape)) == 0:
+                # empty files cannot be memory mapped
+                return np.empty(shape, dtype=dtype, order=order)
+            return np.memmap(resource, dtype=dtype, mode="r", shape=shape, order=order, offset=resource.tell())
+        return np.load(resource, allow_pickle=False)
@@ -0,0 +1,65 @@
+from abc import ABC, abstractmethod
+import asyncio
+import functools
+from concurrent.futures import Executor
+from typing import Optional, Any, Callable
+from data_stack.io.resources import ResourceFactory, StreamedResource
+from data_stack.io.storage_connectors import StorageConnector
+
+
+class AsyncStorageConnectorFactory:
+
+    @classmethod
+    def get_executor_storage_connector(cls, storage_connector: StorageConnector,
+                                       executor: Optional[Executor] = None) -> "AsyncStorageConnector":
+        return ExecutorStorageConnector(storage_connector, executor)
+
+
+class AsyncStorageConnector(ABC):
+    """asyncio counterpart of the `StorageConnector`. The returned resources are regular `StreamedResource`s."""
+
+    @abstractmethod
+    async def get_resource(self, identifier: str, resource_type: ResourceFactory.SupportedStreamedResourceTypes = ResourceFactory.SupportedStreamedResourceTypes.STREAMED_BINARY_RESOURCE) -> StreamedResource:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_resource(self, identifier: str, resource: StreamedResource):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def has_resource(self, identifier: str) -> bool:
+        raise NotImplementedError
+
+    async def get_resource_size(self, identifier: str) -> int:
+        raise NotImplementedError
+
+    async def delete_resource(self, identifier: str):
+        raise NotImplementedError
+
+
+class ExecutorStorageConnector(AsyncStorageConnector):
+    """Adapts a blocking `StorageConnector` by running its operations in an executor, such that the event loop is not
+    blocked by disk I/O. If no executor is given, the event loop's default executor is used."""
+
+    def __init__(self, storage_connector: StorageConnector, executor: Optional[Executor] = None):
+        self.storage_connector = storage_connector
+        self.executor = executor
+
+    async def _run(self, func: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def get_resource(self, identifier: str, resource_type: ResourceFactory.SupportedStreamedResourceTypes = ResourceFactory.SupportedStreamedResourceTypes.STREAMED_BINARY_RESOURCE) -> StreamedResource:
+        return await self._run(self.storage_connector.get_resource, identifier, resource_type)
+
+    async def set_resource(self, identifier: str, resource: StreamedResource):
+        return await self._run(self.storage_connector.set_resource, identifier, resource)
+
+    async def has_resource(self, identifier: str) -> bool:
+        return await self._run(self.storage_connector.has_resource, identifier)
+
+    async def get_resource_size(self, identifier: str) -> int:
+        return await self._run(self.storage_connector.get_resource_size, identifier)
+
+    async def delete_resource(self, identifier: str):
+        return await self._run(self.storage_connector.delete_resource, identifier)
@@ -0,0 +1,178 @@
+from dataclasses import dataclass
+from typing import Dict, List, Tuple, Optional
+from urllib.parse import urlsplit, urljoin
+import http.client
+import urllib.error
+import threading
+import time
+import io
+
+
+@dataclass
+class ConnectionPoolStatistics:
+    num_requests: int = 0
+    num_connections_created: int = 0
+    num_connections_reused: int = 0
+
+    @property
+    def reuse_ratio(self) -> float:
+        # share of requests that were sent over an already established connection
+        return self.num_connections_reused / self.num_requests if self.num_requests > 0 else 0.0
+
+
+class PooledResponse:
+    """Wraps an `http.client.HTTPResponse`. When used as a context manager, the connection is returned to the pool
+    once the response has been read completely. Otherwise, e.g., if an error occurred while reading, the connection
+    is in an undefined state and is closed instead."""
+
+    def __init__(self, pool: "ConnectionPool", key: Tuple[str, str, int], connection: http.client.HTTPConnection,
+                 response: http.client.HTTPResponse):
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+
+    @property
+    def status(self) -> int:
+        return self._response.status
+
+    @property
+    def headers(self) -> http.client.HTTPMessage:
+        return self._response.headers
+
+    def read(self, amt: int = None) -> bytes:
+        return self._response.read(amt)
+
+    def readinto(self, b) -> int:
+        return self._response.readinto(b)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def release(self):
+        if self._connection is None:
+            return
+        # a response that has been closed before all announced bytes were received indicates a dropped connection
+        complete = self._response.isclosed() and not self._response.length
+        if complete and not self._response.will_close:
+            self._pool._release(self._key, self._connection)
+        else:
+            self._connection.close()
+        self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None and self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        self.release()
+
+
+class ConnectionPool:
+    """Thread-safe pool of persistent (keep-alive) HTTP(S) connections, such that subsequent requests to the same host
+    do not pay for the TCP and TLS handshakes again. Up to `pool_size` idle connections are kept per host; connections
+    that have been idle for longer than `idle_timeout` seconds are discarded, as servers close them eventually.
+    `timeout` is the socket timeout for connecting and reading. Unlike urllib, proxies are not supported."""
+
+    MAX_REDIRECTS = 5
+    # errors that indicate that the server closed an idle connection before it was reused
+    STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+    def __init__(self, pool_size: int = 8, timeout: float = 60, idle_timeout: float = 30):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.statistics = ConnectionPoolStatistics()
+        self._idle_connections: Dict[Tuple[str, str, int], List[Tuple[http.client.HTTPConnection, float]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_key(url: str) -> Tuple[str, str, int]:
+        parts = urlsplit(url)
+        if parts.scheme not in ["http", "https"]:
+            raise ValueError(f"Unsupported URL scheme {parts.scheme} of {url}.")
+        default_port = 443 if parts.scheme == "https" else 80
+        return parts.scheme, parts.hostname, parts.port if parts.port is not None else default_port
+
+    def _acquire(self, key: Tuple[str, str, int]) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle_connections = self._idle_connections.get(key, [])
+            while idle_connections:
+                connection, released_at = idle_connections.pop()
+                if time.monotonic() - released_at <= self.idle_timeout:
+                    return connection, True
+                connection.close()
+        scheme, host, port = key
+        connection_cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return connection_cls(host, port, timeout=self.timeout), False
+
+    def _release(self, key: Tuple[str, str, int], connection: http.client.HTTPConnection):
+        with self._lock:
+            idle_connections = self._idle_connections.setdefault(key, [])
+            if len(idle_connections) < self.pool_size:
+                idle_connections.append((connection, time.monotonic()))
+                return
+        connection.close()
+
+    def _send(self, key: Tuple[str, str, int], path: str, method: str, headers: Dict[str, str],
+              body: Optional[bytes]) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        while True:
+            connection, reused = self._acquire(key)
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+            except ConnectionPool.STALE_CONNECTION_ERRORS:
+                connection.close()
+                if reused:
+                    # only requests over reused connections are retried, since the server might have closed them
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            with self._lock:
+                self.statistics.num_requests += 1
+                if reused:
+                    self.statistics.num_connections_reused += 1
+                else:
+                    self.statistics.num_connections_created += 1
+            return connection, response
+
+    def request(self, url: str, headers: Dict[str, str] = None, method: str = "GET",
+                body: Optional[bytes] = None) -> PooledResponse:
+        """Sends the request over a pooled connection and follows redirects. Like urllib, error status codes are
+        raised as `urllib.error.HTTPError`.
+        """
+        headers = dict(headers) if headers else {}
+        for _ in range(ConnectionPool.MAX_REDIRECTS + 1):
+            key = self._get_key(url)
+            parts = urlsplit(url)
+            path = parts.path if parts.path else "/"
+            if parts.query:
+                path = f"{path}?{parts.query}"
+            connection, response = self._send(key, path, method, headers, body)
+            pooled_response = PooledResponse(self, key, connection, response)
+            location = response.headers.get("Location")
+            if response.status in [301, 302, 303, 307, 308] and location is not None:
+                response.read()
+                pooled_response.release()
+                url = urljoin(url, location)
+                continue
+            if response.status >= 400:
+                body = response.read()
+                pooled_response.release()
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(body))
+            return pooled_response
+        raise urllib.error.URLError(f"Too many redirects for {url}.")
+
+    def close(self):
+        with self._lock:
+            for idle_connections in self._idle_connections.values():
+                for connection, _ in idle_connections:
+                    connection.close()
+            self._idle_connections = {}
@@ -0,0 +1,187 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple, Optional, Iterator
+from urllib.parse import quote, urlsplit
+import xml.etree.ElementTree as ElementTree
+import urllib.error
+import hashlib
+import hmac
+import io
+from data_stack.io.connection_pool import ConnectionPool
+
+EMPTY_PAYLOAD_HASH = hashlib.sha256(b"").hexdigest()
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+
+
+def get_signature_v4_headers(method: str, host: str, path: str, query: Dict[str, str], headers: Dict[str, str],
+                             payload_hash: str, access_key: str, secret_key: str, region: str, service: str = "s3",
+                             timestamp: datetime = None) -> Dict[str, str]:
+    """Signs the request with AWS Signature Version 4 and returns the headers, including the `Authorization` header,
+    to be sent. `path` has to be URI-encoded already.
+    """
+    timestamp = timestamp if timestamp is not None else datetime.now(timezone.utc)
+    amz_date = timestamp.strftime("%Y%m%dT%H%M%SZ")
+    date = amz_date[:8]
+    headers = dict(headers, **{"Host": host, "x-amz-date": amz_date, "x-amz-content-sha256": payload_hash})
+    canonical_headers = {name.lower(): " ".join(str(value).split()) for name, value in headers.items()}
+    signed_headers = ";".join(sorted(canonical_headers))
+    canonical_query = "&".join(f"{quote(key, safe='-_.~')}={quote(value, safe='-_.~')}"
+                               for key, value in sorted(query.items()))
+    canonical_request = "\n".join([method, path, canonical_query,
+                                   "".join(f"{name}:{canonical_headers[name]}\n" for name in sorted(canonical_headers)),
+                                   signed_headers, payload_hash])
+    scope = f"{date}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope,
+                                hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()])
+    signing_key = f"AWS4{secret_key}".encode("utf-8")
+    for message in [date, region, service, "aws4_request"]:
+        signing_key = hmac.new(signing_key, message.encode("utf-8"), hashlib.sha256).digest()
+    signature = hmac.new(signing_key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+    headers["Authorization"] = (f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+                                f"SignedHeaders={signed_headers}, Signature={signature}")
+    return headers
+
+
+class ObjectStoreClient:
+    """Minimal client for S3-compatible object stores (AWS S3, MinIO, Ceph, ...) using path-style addressing, i.e.,
+    `<endpoint_url>/<bucket>/<key>`. Requests are signed with AWS Signature Version 4, if credentials are given, and
+    sent over pooled keep-alive connections."""
+
+    def __init__(self, endpoint_url: str, bucket: str, access_key: str = None, secret_key: str = None,
+                 region: str = "us-east-1", pool_size: int = 8, timeout: float = 60):
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.connection_pool = ConnectionPool(pool_size=pool_size, timeout=timeout)
+        self._host = urlsplit(self.endpoint_url).netloc
+
+    def _request(self, method: str, key: str = "", query: Dict[str, str] = None, headers: Dict[str, str] = None,
+                 body: Optional[bytes] = None):
+        query = query if query is not None else {}
+        headers = headers if headers is not None else {}
+        path = quote(f"/{self.bucket}/{key}" if key else f"/{self.bucket}", safe="/-_.~")
+        if self.access_key is not None:
+            payload_hash = hashlib.sha256(body).hexdigest() if body is not None else EMPTY_PAYLOAD_HASH
+            headers = get_signature_v4_headers(method, self._host, path, query, headers, payload_hash,
+                                               self.access_key, self.secret_key, self.region)
+        query_string = "&".join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(query.items()))
+        url = f"{self.endpoint_url}{path}{'?' + query_string if query_string else ''}"
+        return self.connection_pool.request(url, headers=headers, method=method, body=body)
+
+    @staticmethod
+    def _parse(response) -> ElementTree.Element:
+        root = ElementTree.fromstring(response.read())
+        # the S3 namespace is stripped, such that elements can be found by their plain names
+        for element in root.iter():
+            element.tag = element.tag.split("}")[-1]
+        return root
+
+    def head_object(self, key: str) -> Optional[int]:
+        """Returns the size of the object or None, if it does not exist."""
+        try:
+            with self._request("HEAD", key) as response:
+                response.read()
+                return int(response.headers["Content-Length"])
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def get_object_range(self, key: str, b, start: int) -> int:
+        """Reads up to len(b) bytes of the object starting at `start` into the buffer `b` via a ranged GET.
+        :return: number of bytes read
+        """
+        view = memoryview(b).cast("B")
+        with self._request("GET", key, headers={"Range": f"bytes={start}-{start + len(view) - 1}"}) as response:
+            num_bytes = 0
+            while num_bytes < len(view):
+                n = response.readinto(view[num_bytes:])
+                if n == 0:
+                    break
+                num_bytes += n
+            # the remaining bytes are drained, in case the server ignored the range
+            response.read()
+        return num_bytes
+
+    def put_object(self, key: str, body: bytes):
+        with self._request("PUT", key, body=body) as response:
+            response.read()
+
+    def copy_object(self, source_key: str, key: str):
+        headers = {"x-amz-copy-source": quote(f"/{self.bucket}/{source_key}", safe="/-_.~")}
+        with self._request("PUT", key, headers=headers) as response:
+            response.read()
+
+    def delete_object(self, key: str):
+        with self._request("DELETE", key) as response:
+            response.read()
+
+    def list_objects(self, prefix: str = "") -> Iterator[Tuple[str, int]]:
+        """Lists the keys and sizes of all objects starting with the prefix, following the pagination of
+        ListObjectsV2 (up to 1000 objects per request)."""
+        query = {"list-type": "2", "prefix": prefix}
+        while True:
+            with self._request("GET", query=query) as response:
+                root = ObjectStoreClient._parse(response)
+            for contents in root.findall("Contents"):
+                yield contents.findtext("Key"), int(contents.findtext("Size"))
+            if root.findtext("IsTruncated") != "true":
+                break
+            query = dict(query, **{"continuation-token": root.findtext("NextContinuationToken")})
+
+    def create_multipart_upload(self, key: str) -> str:
+        with self._request("POST", key, query={"uploads": ""}) as response:
+            return ObjectStoreClient._parse(response).findtext("UploadId")
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, body: bytes) -> str:
+        query = {"partNumber": str(part_number), "uploadId": upload_id}
+        with self._request("PUT", key, query=query, body=body) as response:
+            response.read()
+            return response.headers["ETag"]
+
+    def complete_multipart_upload(self, key: str, upload_id: str, etags: List[str]):
+        parts = "".join(f"<Part><PartNumber>{part_number}</PartNumber><ETag>{etag}</ETag></Part>"
+                        for part_number, etag in enumerate(etags, start=1))
+        body = f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode("utf-8")
+        with self._request("POST", key, query={"uploadId": upload_id}, body=body) as response:
+            # S3 reports some failures with status 200 and an error document
+            root = ObjectStoreClient._parse(response)
+        if root.tag == "Error":
+            raise IOError(f"Multipart upload of {key} failed: {root.findtext('Message')}")
+
+    def abort_multipart_upload(self, key: str, upload_id: str):
+        with self._request("DELETE", key, query={"uploadId": upload_id}) as response:
+            response.read()
+
+
+class ObjectStream(io.RawIOBase):
+    """Seekable read-only stream over an object, where each read is served by a ranged GET."""
+
+    def __init__(self, client: ObjectStoreClient, key: str, size: int):
+        self._client = client
+        self._key = key
+        self._size = size
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self._size}[whence]
+        self._position = max(base + offset, 0)
+        return self._position
+
+    def readinto(self, b) -> int:
+        num_bytes = min(len(memoryview(b).cast("B")), self._size - self._position)
+        if num_bytes <= 0:
+            return 0
+        num_bytes = self._client.get_object_range(self._key, memoryview(b).cast("B")[:num_bytes], self._position)
+        self._position += num_bytes
+        return num_bytes
@@ -1,7 +1,11 @@
 from abc import ABC, abstractmethod
 import io
-from typing import AnyStr, List
+import hashlib
+import os
+import shutil
+from typing import AnyStr, List, Iterator, Optional
 from enum import Enum
+from data_stack.exception import DatasetFileCorruptError
 
 
 class ResourceFactory:
@@ -11,12 +15,17 @@ class ResourceFactory:
         STREAMED_TEXT_RESOURCE = "STREAMED_TEXT_RESOURCE"
 
     @staticmethod
-    def get_resource(identifier: str, file_like_object: io.IOBase, chunk_size: int = 1024, resource_type: SupportedStreamedResourceTypes = SupportedStreamedResourceTypes.STREAMED_BINARY_RESOURCE) -> "StreamedResource":
+    def get_resource(identifier: str, file_like_object: io.IOBase, chunk_size: Optional[int] = None, resource_type: SupportedStreamedResourceTypes = SupportedStreamedResourceTypes.STREAMED_BINARY_RESOURCE) -> "StreamedResource":
         if resource_type == ResourceFactory.SupportedStreamedResourceTypes.STREAMED_TEXT_RESOURCE:
             return StreamedTextResource(identifier, file_like_object, chunk_size)
         else:
             return StreamedResource(identifier, file_like_object, chunk_size)
 
+    @staticmethod
+    def get_verified_resource(identifier: str, file_like_object: io.IOBase, md5_sum: str,
+                              chunk_size: Optional[int] = None) -> "VerifiedStreamedResource":
+        return VerifiedStreamedResource(identifier, file_like_object, md5_sum, chunk_size)
+
 
 class IterableIF(ABC):
 
@@ -26,27 +35,102 @@ class IterableIF(ABC):
 
 
 class Buffer(IterableIF):
-    def __init__(self, buffer: io.IOBase, chunk_size: int = 1024):
+    """Iterable wrapper around a file-like object. If no `chunk_size` is given, the chunk size adapts to the stream:
+    starting at `MIN_CHUNK_SIZE`, it doubles with every completely filled chunk up to `MAX_CHUNK_SIZE`."""
+
+    MIN_CHUNK_SIZE = 64 * 1024
+    MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, buffer: io.IOBase, chunk_size: Optional[int] = None):
         self._chunk_size = chunk_size
         self._buffer = buffer
 
     # ==============================PROPERTIES==================================
 
     @property
-    def chunk_size(self) -> int:
+    def chunk_size(self) -> Optional[int]:
         return self._chunk_size
 
+    @property
+    def is_file_backed(self) -> bool:
+        """Whether the resource directly wraps a binary file, as opposed to, e.g., a decompressing stream whose
+        `fileno()` refers to the compressed file."""
+        raw_buffer = getattr(self._buffer, "raw", self._buffer)
+        return isinstance(raw_buffer, io.FileIO) and not raw_buffer.closed
+
+    @property
+    def allows_direct_copy(self) -> bool:
+        """Whether the resource may be copied without passing its chunks through Python."""
+        return self.is_file_backed
+
     # ==============================ITERATOR====================================
 
+    def _rewind(self):
+        # non-seekable streams, e.g., HTTP responses, can only be iterated once
+        if self._buffer.seekable():
+            self._buffer.seek(0)
+
+    def _next_chunk_size(self, chunk_size: int, num_bytes_read: int) -> int:
+        if self._chunk_size is None and num_bytes_read == chunk_size:
+            return min(2 * chunk_size, Buffer.MAX_CHUNK_SIZE)
+        return chunk_size
+
     def __iter__(self):
-        self._buffer.seek(0)
+        self._rewind()
+        chunk_size = self._chunk_size if self._chunk_size is not None else Buffer.MIN_CHUNK_SIZE
         while True:
-            chunk = self._buffer.read(self.chunk_size)
+            chunk = self._buffer.read(chunk_size)
             if chunk:
                 yield chunk
+                chunk_size = self._next_chunk_size(chunk_size, len(chunk))
             else:
                 break
 
+    def iter_into(self) -> Iterator[memoryview]:
+        """Iterates the resource via `readinto` over a single, reused buffer. In contrast to `__iter__`, no bytes object
+        is allocated per chunk. Note, that each yielded memoryview is only valid until the next chunk is requested."""
+        if not hasattr(self._buffer, "readinto"):
+            # e.g., text streams
+            yield from self
+            return
+        self._rewind()
+        chunk_size = self._chunk_size if self._chunk_size is not None else Buffer.MIN_CHUNK_SIZE
+        view = memoryview(bytearray(chunk_size))
+        while True:
+            num_bytes_read = self._buffer.readinto(view)
+            if not num_bytes_read:
+                break
+            yield view[:num_bytes_read]
+            chunk_size = self._next_chunk_size(chunk_size, num_bytes_read)
+            # the buffer only grows along with the adaptive chunk size, such that small resources stay cheap
+            if chunk_size > len(view):
+                view = memoryview(bytearray(chunk_size))
+
+    def copy_to(self, destination: io.IOBase) -> int:
+        """Copies the complete resource to the destination file, using `os.sendfile` if available, such that the bytes
+        are copied within the kernel. Requires `allows_direct_copy`.
+        :return: number of bytes copied
+        """
+        self._rewind()
+        source_fd, destination_fd = self._buffer.fileno(), destination.fileno()
+        if hasattr(os, "sendfile"):
+            destination.flush()
+            offset, size = self._buffer.tell(), os.fstat(source_fd).st_size
+            try:
+                while offset < size:
+                    num_bytes_sent = os.sendfile(destination_fd, source_fd, offset, size - offset)
+                    if num_bytes_sent == 0:
+                        break
+                    offset += num_bytes_sent
+                return offset
+            except OSError:
+                # e.g., not supported by the file system, fall back to copying via user space
+                if offset > 0:
+                    raise
+        num_bytes = self._buffer.tell()
+        shutil.copyfileobj(self._buffer, destination, Buffer.MAX_CHUNK_SIZE)
+        return self._buffer.tell() - num_bytes
+
     # ===========================CONTEXT=MANAGER===============================
 
     def __enter__(self) -> "StreamedResource":
@@ -74,6 +158,9 @@ class Buffer(IterableIF):
     def read(self, n: int = -1) -> AnyStr:
         return self._buffer.read(n)
 
+    def readinto(self, b) -> int:
+        return self._buffer.readinto(b)
+
     def readable(self) -> bool:
         return self._buffer.readable()
 
@@ -112,7 +199,7 @@ class Buffer(IterableIF):
 class StreamedResource(Buffer):
     """"Implements Iterable and context manager"""
 
-    def __init__(self, identifier: str, buffer: io.IOBase, chunk_size: int = 1024):
+    def __init__(self, identifier: str, buffer: io.IOBase, chunk_size: Optional[int] = None):
         super().__init__(buffer, chunk_size)
         self._identifier = identifier
 
@@ -126,8 +213,98 @@ class StreamedResource(Buffer):
     #     return bytesIO_buffer
 
 
+class VerifiedStreamedResource(StreamedResource):
+    """Computes the MD5 sum while the resource is being iterated and raises a `DatasetFileCorruptError` after the last
+    chunk, if it does not match the expected MD5 sum. Consumers like storage connectors thus fail before committing
+    a corrupt resource, without hashing it in a separate pass."""
+
+    def __init__(self, identifier: str, buffer: io.IOBase, md5_sum: str, chunk_size: Optional[int] = None):
+        super().__init__(identifier, buffer, chunk_size)
+        self._md5_sum = md5_sum
+        self._num_bytes = 0
+
+    @property
+    def num_bytes(self) -> int:
+        # number of bytes streamed during the last iteration
+        return self._num_bytes
+
+    @property
+    def allows_direct_copy(self) -> bool:
+        # every chunk has to pass the hash
+        return False
+
+    def _verify(self, chunks: Iterator[AnyStr]) -> Iterator[AnyStr]:
+        md5 = hashlib.md5()
+        self._num_bytes = 0
+        for chunk in chunks:
+            md5.update(chunk)
+            self._num_bytes += len(chunk)
+            yield chunk
+        if md5.hexdigest() != self._md5_sum:
+            raise DatasetFileCorruptError(f"MD5 sum of resource {self.identifier} does not match {self._md5_sum}.")
+
+    def __iter__(self):
+        return self._verify(super().__iter__())
+
+    def iter_into(self) -> Iterator[memoryview]:
+        return self._verify(super().iter_into())
+
+
+class ChainedStream(io.RawIOBase):
+    """Read-only stream that reads the given streams one after another, e.g., the segments of a resource."""
+
+    def __init__(self, streams: List[io.IOBase]):
+        self._streams = list(streams)
+        self._current = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while self._current < len(self._streams):
+            data = self._streams[self._current].read(len(b))
+            if data:
+                b[:len(data)] = data
+                return len(data)
+            self._current += 1
+        return 0
+
+    def close(self):
+        for stream in self._streams:
+            stream.close()
+        super().close()
+
+
+class IteratorStream(io.RawIOBase):
+    """Read-only stream over an iterator of bytes-like chunks, e.g., a generator that encodes the content lazily. Each
+    chunk is copied out before the next one is requested, so generators may reuse their chunk buffers."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._chunk:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk).cast("B")
+        num_bytes = min(len(b), len(self._chunk))
+        b[:num_bytes] = self._chunk[:num_bytes]
+        self._chunk = self._chunk[num_bytes:]
+        return num_bytes
+
+    def close(self):
+        if hasattr(self._chunks, "close"):
+            self._chunks.close()
+        super().close()
+
+
 class StreamedTextResource(StreamedResource):
-    def __init__(self, identifier: str, buffer: io.IOBase, chunk_size: int = 1024, encoding: str = "utf-8"):
+    def __init__(self, identifier: str, buffer: io.IOBase, chunk_size: Optional[int] = None, encoding: str = "utf-8"):
         text_buffer = io.TextIOWrapper(buffer, encoding=encoding)
         super().__init__(identifier, text_buffer,  chunk_size)
 
@@ -1,28 +1,59 @@
 from abc import ABC, abstractmethod
-import torchvision
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+from dataclasses import dataclass
 from data_stack.util.logger import logger
-from typing import List
+from typing import List, Dict, Tuple, Optional, Iterator
 from data_stack.io.storage_connectors import StorageConnector
-from data_stack.exception import DatasetFileCorruptError
-import tempfile
-import os
+from data_stack.exception import DatasetFileCorruptError, IncompleteDownloadError
+import threading
+import hashlib
+import http.client
+import urllib.error
+import urllib.request
+import time
 from data_stack.util.helper import calculate_md5
-from data_stack.io.resources import ResourceFactory
+from data_stack.io.resources import ResourceFactory, ChainedStream, IteratorStream
+from data_stack.io.connection_pool import ConnectionPool
 from data_stack.io.resource_definition import ResourceDefinition
 
 
 class RetrieverFactory:
 
     @classmethod
-    def get_http_retriever(cls, storage_connector: StorageConnector) -> "Retriever":
-        retriever_impl = HTTPRetrieverImpl(storage_connector)
+    def get_http_retriever(cls, storage_connector: StorageConnector, num_workers: int = 1,
+                           num_segments: int = 1, deep_verify: bool = False) -> "Retriever":
+        retriever_impl = HTTPRetrieverImpl(storage_connector, num_workers=num_workers, num_segments=num_segments,
+                                           deep_verify=deep_verify)
         return Retriever(retriever_impl)
 
     @classmethod
-    def get_file_retriever(cls, storage_connector: StorageConnector) -> "Retriever":
-        retriever_impl = FileRetrieverImpl(storage_connector)
+    def get_pooled_http_retriever(cls, storage_connector: StorageConnector, num_workers: int = 1, pool_size: int = 8,
+                                  timeout: float = 60, idle_timeout: float = 30, num_segments: int = 1,
+                                  deep_verify: bool = False) -> "Retriever":
+        retriever_impl = PooledHTTPRetrieverImpl(storage_connector, num_workers=num_workers, pool_size=pool_size,
+                                                 timeout=timeout, idle_timeout=idle_timeout, num_segments=num_segments,
+                                                 deep_verify=deep_verify)
         return Retriever(retriever_impl)
 
+    @classmethod
+    def get_file_retriever(cls, storage_connector: StorageConnector, num_workers: int = 1,
+                           deep_verify: bool = False) -> "Retriever":
+        retriever_impl = FileRetrieverImpl(storage_connector, num_workers=num_workers, deep_verify=deep_verify)
+        return Retriever(retriever_impl)
+
+    @classmethod
+    def get_async_http_retriever(cls, storage_connector: StorageConnector, max_concurrency: int = 8,
+                                 num_segments: int = 1, deep_verify: bool = False) -> "AsyncRetriever":
+        retriever_impl = HTTPRetrieverImpl(storage_connector, num_segments=num_segments, deep_verify=deep_verify)
+        return AsyncRetriever(retriever_impl, max_concurrency=max_concurrency)
+
+    @classmethod
+    def get_async_file_retriever(cls, storage_connector: StorageConnector, max_concurrency: int = 8,
+                                 deep_verify: bool = False) -> "AsyncRetriever":
+        retriever_impl = FileRetrieverImpl(storage_connector, deep_verify=deep_verify)
+        return AsyncRetriever(retriever_impl, max_concurrency=max_concurrency)
+
 
 class Retriever:
 
@@ -33,73 +64,331 @@ class Retriever:
         return self.retriever_impl.retrieve(retrieval_jobs)
 
 
+class AsyncRetriever:
+    """asyncio counterpart of the `Retriever`. Each resource is retrieved by the blocking retriever implementation
+    (see `RetrieverImplIF.retrieve_resource`) in a dedicated thread, such that up to `max_concurrency` resources are
+    downloaded and written at the same time without blocking the event loop."""
+
+    def __init__(self, retriever_impl: "RetrieverImplIF", max_concurrency: int = 8):
+        self.retriever_impl = retriever_impl
+        self.max_concurrency = max_concurrency
+
+    async def retrieve(self, retrieval_jobs: List[ResourceDefinition]) -> List[str]:
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            futures = [loop.run_in_executor(executor, self.retriever_impl.retrieve_resource, retrieval_job)
+                       for retrieval_job in retrieval_jobs]
+            # like the blocking retriever, all retrievals are finished before the first error is raised
+            results = await asyncio.gather(*futures, return_exceptions=True)
+        finally:
+            # e.g., if the task is cancelled, the running retrievals are finished without blocking the event loop
+            await loop.run_in_executor(None, executor.shutdown, True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+
+@dataclass
+class DownloadStatistics:
+    source: str
+    num_bytes: int
+    duration: float
+
+    @property
+    def throughput(self) -> float:
+        # bytes per second
+        return self.num_bytes / self.duration if self.duration > 0 else float("inf")
+
+
 class RetrieverImplIF(ABC):
+    """Resources that have been retrieved and verified before are recorded with their MD5 sum in the storage
+    connector's manifest and are not retrieved again. In `deep_verify` mode, the MD5 sums of present resources
+    are recomputed instead of trusting the manifest."""
 
-    def __init__(self, storage_connector: StorageConnector):
+    def __init__(self, storage_connector: StorageConnector, deep_verify: bool = False):
         self.storage_connector = storage_connector
+        self.deep_verify = deep_verify
+
+    def _is_retrieved(self, retrieval_job: ResourceDefinition) -> bool:
+        if not self.storage_connector.has_resource(retrieval_job.identifier):
+            return False
+        if not self.deep_verify:
+            return self.storage_connector.get_verified_checksum(retrieval_job.identifier) == retrieval_job.md5_sum
+        with self.storage_connector.get_resource(retrieval_job.identifier) as resource:
+            calculated_md5_sum = calculate_md5(resource)
+        if calculated_md5_sum != retrieval_job.md5_sum:
+            return False
+        self.storage_connector.set_verified_checksum(retrieval_job.identifier, calculated_md5_sum)
+        return True
+
+    def _retrieve_from_storage(self, retrieval_job: ResourceDefinition) -> bool:
+        """Checks whether the resource is already present in the storage, either under its identifier or, for
+        content-addressed storages, under any other identifier.
+        :return: True, if the resource does not need to be retrieved
+        """
+        if self._is_retrieved(retrieval_job):
+            logger.debug(f"Resource {retrieval_job.identifier} has been verified already, skipping {retrieval_job.source}.")
+            return True
+        if self.storage_connector.link_resource(retrieval_job.identifier, retrieval_job.md5_sum):
+            logger.debug(f"Resource {retrieval_job.identifier} is already present in the storage, skipping {retrieval_job.source}.")
+            self.storage_connector.set_verified_checksum(retrieval_job.identifier, retrieval_job.md5_sum)
+            return True
+        return False
 
     @abstractmethod
     def retrieve(self, retrieval_jobs: List[ResourceDefinition]) -> List[str]:
         raise NotImplementedError
 
+    def retrieve_resource(self, retrieval_job: ResourceDefinition) -> str:
+        """Retrieves a single resource in the calling thread. Implementations override this method, whenever
+        `retrieve` runs its own worker pool."""
+        return self.retrieve([retrieval_job])[0]
+
 
 class HTTPRetrieverImpl(RetrieverImplIF):
-    def __init__(self, storage_connector: StorageConnector):
-        super().__init__(storage_connector)
-
-    def _download_file(self, dest_folder: str, url: str, md5: str) -> str:
-        """ Downloads a file given by the url.
-        :param dest_path: destination path
-        :param url: URL to the dataset
-        :return: Path to downloaded file
+    """Downloads resources via HTTP(S) into the storage connector. With `num_workers` > 1, several resources are
+    downloaded concurrently by a thread pool. The throughput of each download is collected in `download_statistics`.
+
+    Downloads are persisted as partial resources (`<identifier>.partial`) in the storage connector. If the connection
+    drops, the download is resumed via HTTP range requests (up to `max_retries` times), which also applies to
+    partial resources left behind by previous runs. With `num_segments` > 1, resources of at least twice
+    `min_segment_size` are downloaded as parallel byte-range segments, given that the server supports range requests.
+    Only once the MD5 sum of the complete resource matches, the resource is committed under its identifier.
+    Storages that cannot persist partial resources (see `StorageConnector.supports_partial_resources`), e.g., object
+    stores, receive the download as a single verified stream instead, which is restarted if the connection drops."""
+
+    def __init__(self, storage_connector: StorageConnector, num_workers: int = 1, chunk_size: int = 1024 * 1024,
+                 timeout: float = 60, max_retries: int = 3, num_segments: int = 1, min_segment_size: int = 8 * 1024 * 1024,
+                 deep_verify: bool = False):
+        super().__init__(storage_connector, deep_verify=deep_verify)
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.num_segments = num_segments
+        self.min_segment_size = min_segment_size
+        self.download_statistics: List[DownloadStatistics] = []
+        self._statistics_lock = threading.Lock()
+
+    @staticmethod
+    def _get_partial_identifier(identifier: str, segment: int = None) -> str:
+        partial_identifier = f"{identifier}.partial"
+        return partial_identifier if segment is None else f"{partial_identifier}.{segment}"
+
+    def _get_partial_size(self, partial_identifier: str) -> int:
+        if self.storage_connector.has_resource(partial_identifier):
+            return self.storage_connector.get_resource_size(partial_identifier)
+        return 0
+
+    def _hash_partial(self, partial_identifier: str) -> "hashlib._Hash":
+        md5_hash = hashlib.md5()
+        if self.storage_connector.has_resource(partial_identifier):
+            with self.storage_connector.get_resource(partial_identifier) as resource:
+                for chunk in iter(lambda: resource.read(self.chunk_size), b''):
+                    md5_hash.update(chunk)
+        return md5_hash
+
+    def _open(self, url: str, headers: Dict[str, str] = None, method: str = "GET"):
+        request = urllib.request.Request(url, headers=headers if headers else {}, method=method)
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _get_content_info(self, url: str) -> Tuple[Optional[int], bool]:
+        """Returns the content length of the given URL and whether the server supports range requests."""
+        with self._open(url, method="HEAD") as response:
+            content_length = response.headers.get("Content-Length")
+            accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        return (int(content_length) if content_length is not None else None), accepts_ranges
+
+    def _stream_chunks(self, response, md5_hash: Optional["hashlib._Hash"], progress: List[int]) -> Iterator[bytes]:
+        for chunk in iter(lambda: response.read(self.chunk_size), b''):
+            if md5_hash is not None:
+                md5_hash.update(chunk)
+            progress[0] += len(chunk)
+            yield chunk
+
+    def _download_range(self, url: str, partial_identifier: str, start: int = 0, end: int = None,
+                        hash_content: bool = False) -> Tuple[int, Optional["hashlib._Hash"]]:
+        """Downloads the bytes [start, end] (end is inclusive, None denotes the end of the resource) of the given URL and
+        appends them to the partial resource. Bytes already present in the partial resource are skipped.
+        :return: number of bytes downloaded and, if requested, the MD5 hash over the complete partial resource
         """
-        logger.debug(f"Downloading data file from {url} ...")
-        # download file
-        filename = url.rpartition('/')[2]
-        torchvision.datasets.utils.download_url(url, root=dest_folder, filename=filename)
-        logger.debug("Done.")
-        file_path = os.path.join(dest_folder, filename)
-        with open(file_path, 'rb') as fd:
-            calculated_md5_sum = calculate_md5(fd)
-        if calculated_md5_sum != md5:
-            logger.fatal(f"Given MD5 hash did not match with the md5 has of file {file_path}")
-            raise DatasetFileCorruptError
-        return file_path
-
-    def _download(self, retrieval_jobs: List[ResourceDefinition], dest_folder: str) -> List[str]:
-        file_paths = [self._download_file(
-            url=retrieval_job.source, dest_folder=dest_folder, md5=retrieval_job.md5_sum) for retrieval_job in retrieval_jobs]
-        return file_paths
-
-    def retrieve(self, retrieval_jobs: List[ResourceDefinition]):
-        resource_identifiers = []
-        with tempfile.TemporaryDirectory() as tmp_dest_folder:
-            logger.debug(f'Created temporary directory {tmp_dest_folder} for downloading resources...')
-            # download dataset files
-            tmp_resource_paths = self._download(retrieval_jobs, tmp_dest_folder)
-            # store datset files
-            for retrieval_job, tmp_resource_path in zip(retrieval_jobs, tmp_resource_paths):
-                with open(tmp_resource_path, "rb") as fd:
-                    resource = ResourceFactory.get_resource(identifier=retrieval_job.identifier, file_like_object=fd)
+        num_bytes = 0
+        md5_hash, hashed_bytes = hashlib.md5(), 0
+        for attempt in range(self.max_retries + 1):
+            partial_size = self._get_partial_size(partial_identifier)
+            if hash_content and partial_size != hashed_bytes:
+                # the partial resource stems from a previous run or a failed write, so we (re)hash its content
+                md5_hash, hashed_bytes = self._hash_partial(partial_identifier), partial_size
+            offset = start + partial_size
+            if end is not None and offset > end:
+                break
+            headers = {"Range": f"bytes={offset}-{'' if end is None else end}"} if offset > 0 or end is not None else {}
+            progress = [0]
+            try:
+                with self._open(url, headers=headers) as response:
+                    if headers and response.status != 206:
+                        if start > 0 or end is not None:
+                            raise IncompleteDownloadError(f"Server of {url} does not support range requests.")
+                        logger.debug(f"Server of {url} does not support range requests, restarting download.")
+                        self.storage_connector.delete_resource(partial_identifier)
+                        md5_hash, hashed_bytes = hashlib.md5(), 0
+                    expected_bytes = response.headers.get("Content-Length")
+                    chunks = IteratorStream(self._stream_chunks(response, md5_hash if hash_content else None, progress))
+                    with ResourceFactory.get_resource(partial_identifier, chunks) as resource:
+                        self.storage_connector.append_resource(partial_identifier, resource)
+                if expected_bytes is not None and progress[0] < int(expected_bytes):
+                    raise IncompleteDownloadError(f"Received {progress[0]} of {expected_bytes} bytes from {url}.")
+                num_bytes += progress[0]
+                hashed_bytes += progress[0]
+                break
+            except urllib.error.HTTPError as e:
+                if e.code == 416:
+                    # the partial resource is already complete
+                    break
+                raise
+            except (OSError, http.client.HTTPException, IncompleteDownloadError) as e:
+                num_bytes += progress[0]
+                hashed_bytes += progress[0]
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Download of {url} interrupted ({e}), resuming (attempt {attempt + 1}/{self.max_retries}).")
+        return num_bytes, (md5_hash if hash_content else None)
+
+    def _retrieve_single(self, retrieval_job: ResourceDefinition) -> int:
+        partial_identifier = HTTPRetrieverImpl._get_partial_identifier(retrieval_job.identifier)
+        num_bytes, md5_hash = self._download_range(retrieval_job.source, partial_identifier, hash_content=True)
+        if md5_hash.hexdigest() != retrieval_job.md5_sum:
+            self.storage_connector.delete_resource(partial_identifier)
+            raise DatasetFileCorruptError(f"MD5 sum of resource {retrieval_job.identifier} does not match.")
+        self.storage_connector.move_resource(partial_identifier, retrieval_job.identifier)
+        return num_bytes
+
+    def _retrieve_streamed(self, retrieval_job: ResourceDefinition) -> int:
+        """Streams the resource directly into the storage connector, for storages that cannot persist partial
+        resources (e.g., object stores). Interrupted downloads are restarted from scratch."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._open(retrieval_job.source) as response:
+                    expected_bytes = response.headers.get("Content-Length")
+                    resource = ResourceFactory.get_verified_resource(identifier=retrieval_job.identifier,
+                                                                     file_like_object=response,
+                                                                     md5_sum=retrieval_job.md5_sum,
+                                                                     chunk_size=self.chunk_size)
                     self.storage_connector.set_resource(identifier=retrieval_job.identifier, resource=resource)
-                    resource_identifiers.append(retrieval_job.identifier)
+                if expected_bytes is not None and resource.num_bytes < int(expected_bytes):
+                    raise IncompleteDownloadError(f"Received {resource.num_bytes} of {expected_bytes} bytes from "
+                                                  f"{retrieval_job.source}.")
+                return resource.num_bytes
+            except (OSError, http.client.HTTPException, IncompleteDownloadError) as e:
+                if isinstance(e, urllib.error.HTTPError) or attempt == self.max_retries:
+                    raise
+                logger.warning(f"Download of {retrieval_job.source} interrupted ({e}), restarting "
+                               f"(attempt {attempt + 1}/{self.max_retries}).")
+
+    def _retrieve_segmented(self, retrieval_job: ResourceDefinition, content_length: int) -> int:
+        segment_size = -(-content_length // self.num_segments)
+        segments = [(segment, start, min(start + segment_size, content_length) - 1)
+                    for segment, start in enumerate(range(0, content_length, segment_size))]
+        partial_identifiers = [HTTPRetrieverImpl._get_partial_identifier(retrieval_job.identifier, segment)
+                               for segment, _, _ in segments]
+        with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+            futures = [executor.submit(self._download_range, retrieval_job.source, partial_identifier, start, end)
+                       for partial_identifier, (_, start, end) in zip(partial_identifiers, segments)]
+            num_bytes = sum(future.result()[0] for future in futures)
+        # the segments are concatenated into the final resource, while its MD5 sum is verified on the fly
+        streams = [self.storage_connector.get_resource(partial_identifier) for partial_identifier in partial_identifiers]
+        resource = ResourceFactory.get_verified_resource(identifier=retrieval_job.identifier,
+                                                         file_like_object=ChainedStream(streams),
+                                                         md5_sum=retrieval_job.md5_sum, chunk_size=self.chunk_size)
+        try:
+            with resource:
+                self.storage_connector.set_resource(identifier=retrieval_job.identifier, resource=resource)
+        except DatasetFileCorruptError:
+            for partial_identifier in partial_identifiers:
+                self.storage_connector.delete_resource(partial_identifier)
+            raise
+        for partial_identifier in partial_identifiers:
+            self.storage_connector.delete_resource(partial_identifier)
+        return num_bytes
+
+    def _retrieve(self, retrieval_job: ResourceDefinition) -> int:
+        if not self.storage_connector.supports_partial_resources:
+            return self._retrieve_streamed(retrieval_job)
+        content_length, accepts_ranges = (self._get_content_info(retrieval_job.source) if self.num_segments > 1
+                                          else (None, False))
+        if accepts_ranges and content_length is not None and content_length >= 2 * self.min_segment_size:
+            return self._retrieve_segmented(retrieval_job, content_length)
+        return self._retrieve_single(retrieval_job)
+
+    def retrieve_resource(self, retrieval_job: ResourceDefinition) -> str:
+        """Downloads a resource into the storage connector and verifies its MD5 sum.
+        :param retrieval_job: definition of the resource to be retrieved
+        :return: identifier of the stored resource
+        """
+        url = retrieval_job.source
+        if self._retrieve_from_storage(retrieval_job):
+            return retrieval_job.identifier
+        logger.debug(f"Downloading data file from {url} ...")
+        start = time.time()
+        try:
+            num_bytes = self._retrieve(retrieval_job)
+        except DatasetFileCorruptError:
+            logger.fatal(f"Given MD5 hash did not match with the md5 hash of {url}")
+            raise
+        self.storage_connector.set_verified_checksum(retrieval_job.identifier, retrieval_job.md5_sum)
+        statistics = DownloadStatistics(source=url, num_bytes=num_bytes, duration=time.time() - start)
+        with self._statistics_lock:
+            self.download_statistics.append(statistics)
+        logger.debug(f"Done. Downloaded {statistics.num_bytes} bytes from {url} at {statistics.throughput / 2**20:.2f} MiB/s.")
+        return retrieval_job.identifier
+
+    def retrieve(self, retrieval_jobs: List[ResourceDefinition]) -> List[str]:
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = [executor.submit(self.retrieve_resource, retrieval_job) for retrieval_job in retrieval_jobs]
+            resource_identifiers = [future.result() for future in futures]
         return resource_identifiers
 
 
+class PooledHTTPRetrieverImpl(HTTPRetrieverImpl):
+    """HTTP retriever that sends all requests over pooled keep-alive connections instead of opening a new connection
+    per request, which dominates the retrieval time of many small resources. The pool keeps up to `pool_size` idle
+    connections per host; its reuse statistics are available via `connection_pool.statistics`."""
+
+    def __init__(self, storage_connector: StorageConnector, num_workers: int = 1, pool_size: int = 8,
+                 timeout: float = 60, idle_timeout: float = 30, **kwargs):
+        super().__init__(storage_connector, num_workers=num_workers, timeout=timeout, **kwargs)
+        self.connection_pool = ConnectionPool(pool_size=pool_size, timeout=timeout, idle_timeout=idle_timeout)
+
+    def _open(self, url: str, headers: Dict[str, str] = None, method: str = "GET"):
+        return self.connection_pool.request(url, headers=headers, method=method)
+
+
 class FileRetrieverImpl(RetrieverImplIF):
+    """Copies local files into the storage connector, while verifying their MD5 sums on the fly. With `num_workers` > 1,
+    several files are copied and hashed concurrently by a thread pool."""
+
+    def __init__(self, storage_connector: StorageConnector, num_workers: int = 1, deep_verify: bool = False):
+        super().__init__(storage_connector, deep_verify=deep_verify)
+        self.num_workers = num_workers
 
-    def __init__(self, storage_connector: StorageConnector):
-        super().__init__(storage_connector)
-
-    def retrieve(self, retrieval_jobs: List[ResourceDefinition]):
-        resource_identifiers = []
-        for retrieval_job in retrieval_jobs:
-            with open(retrieval_job.source, "rb") as fd:
-                resource = ResourceFactory.get_resource(identifier=retrieval_job.identifier, file_like_object=fd)
-                calculated_md5_sum = calculate_md5(resource)
-                if calculated_md5_sum != retrieval_job.md5_sum:
-                    logger.fatal(f"Given MD5 hash did not match with the md5 has of file {retrieval_job.source}")
-                    raise DatasetFileCorruptError
+    def retrieve_resource(self, retrieval_job: ResourceDefinition) -> str:
+        if self._retrieve_from_storage(retrieval_job):
+            return retrieval_job.identifier
+        with open(retrieval_job.source, "rb") as fd:
+            resource = ResourceFactory.get_verified_resource(identifier=retrieval_job.identifier, file_like_object=fd,
+                                                             md5_sum=retrieval_job.md5_sum)
+            try:
                 self.storage_connector.set_resource(identifier=retrieval_job.identifier, resource=resource)
-                resource_identifiers.append(retrieval_job.identifier)
+            except DatasetFileCorruptError:
+                logger.fatal(f"Given MD5 hash did not match with the md5 has of file {retrieval_job.source}")
+                raise
+        self.storage_connector.set_verified_checksum(retrieval_job.identifier, retrieval_job.md5_sum)
+        return retrieval_job.identifier
+
+    def retrieve(self, retrieval_jobs: List[ResourceDefinition]) -> List[str]:
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = [executor.submit(self.retrieve_resource, retrieval_job) for retrieval_job in retrieval_jobs]
+            resource_identifiers = [future.result() for future in futures]
         return resource_identifiers
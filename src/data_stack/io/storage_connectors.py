@@ -2,10 +2,40 @@
 
 from abc import ABC, abstractmethod
 from data_stack.util.logger import logger
-from data_stack.util.helper import is_safe_path
+from data_stack.util.helper import is_safe_path, calculate_md5
 from data_stack.exception import MaliciousFilePathError, ResourceNotFoundError
+import io
 import os
-from data_stack.io.resources import ResourceFactory, StreamedResource
+import shutil
+import hashlib
+import tempfile
+import threading
+import json
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Iterator, Tuple
+from data_stack.io.resources import ResourceFactory, StreamedResource, Buffer
+from data_stack.io.object_store import ObjectStoreClient, ObjectStream
+try:
+    import fcntl
+except ImportError:
+    # no file locking on Windows, where the disk tier should not be shared between processes
+    fcntl = None
+
+# the umask can only be read by setting it, which is not thread-safe, so it is read once on import
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+
+def _mkstemp(folder: str, prefix: str = None, suffix: str = None) -> Tuple[int, str]:
+    """Creates a temporary file like `tempfile.mkstemp`, but with the permissions of a regularly created file (0666
+    without the umask) instead of 0600, as the temporary file is committed as resource later on."""
+    fd, path = tempfile.mkstemp(dir=folder, prefix=prefix, suffix=suffix)
+    # not supported on Windows, where the permissions are not restricted in the first place
+    if hasattr(os, "fchmod"):
+        os.fchmod(fd, 0o666 & ~_UMASK)
+    return fd, path
 
 
 class StorageConnectorFactory:
@@ -14,6 +44,24 @@ class StorageConnectorFactory:
     def get_file_storage_connector(cls, folder_path: str) -> "StorageConnector":
         return FileStorageConnector(folder_path)
 
+    @classmethod
+    def get_content_addressed_file_storage_connector(cls, folder_path: str) -> "StorageConnector":
+        return ContentAddressedFileStorageConnector(folder_path)
+
+    @classmethod
+    def get_object_store_storage_connector(cls, endpoint_url: str, bucket: str, prefix: str = "", access_key: str = None,
+                                           secret_key: str = None, region: str = "us-east-1",
+                                           part_size: int = 8 * 1024 * 1024) -> "StorageConnector":
+        client = ObjectStoreClient(endpoint_url, bucket, access_key=access_key, secret_key=secret_key, region=region)
+        return ObjectStoreStorageConnector(client, prefix=prefix, part_size=part_size)
+
+    @classmethod
+    def get_caching_storage_connector(cls, storage_connector: "StorageConnector", cache_folder_path: str,
+                                      max_disk_bytes: int = 10 * 1024**3,
+                                      max_memory_bytes: int = 256 * 1024**2) -> "StorageConnector":
+        return CachingStorageConnector(storage_connector, cache_folder_path, max_disk_bytes=max_disk_bytes,
+                                       max_memory_bytes=max_memory_bytes)
+
 
 class StorageConnector(ABC):
 
@@ -29,10 +77,64 @@ class StorageConnector(ABC):
     def has_resource(self, identifier: str) -> bool:
         raise NotImplementedError
 
+    def has_resources(self, identifiers: List[str]) -> List[bool]:
+        """Batched version of `has_resource`, which storages may implement more efficiently."""
+        return [self.has_resource(identifier) for identifier in identifiers]
+
+    # The following operations are optional. They are required for persisting partial resources, e.g., for resuming
+    # interrupted downloads.
+
+    @property
+    def supports_partial_resources(self) -> bool:
+        """Whether partial resources can be persisted, i.e., whether resources can be appended to."""
+        return type(self).append_resource is not StorageConnector.append_resource
+
+    def get_resource_size(self, identifier: str) -> int:
+        raise NotImplementedError
+
+    def append_resource(self, identifier: str, resource: StreamedResource):
+        raise NotImplementedError
+
+    def move_resource(self, source_identifier: str, target_identifier: str):
+        raise NotImplementedError
+
+    def delete_resource(self, identifier: str):
+        raise NotImplementedError
+
+    def link_resource(self, identifier: str, md5_sum: str) -> bool:
+        """Stores the resource under the given identifier, if a resource with the given MD5 sum is already present
+        in the storage, e.g., under another identifier. Returns whether the resource could be linked."""
+        return False
+
+    def get_verified_checksum(self, identifier: str) -> Optional[str]:
+        """Returns the MD5 sum of the resource, if it has been verified before and the resource has not changed since.
+        Storages without a manifest of verified resources return None."""
+        return None
+
+    def set_verified_checksum(self, identifier: str, md5_sum: str):
+        """Records the MD5 sum of a verified resource, such that it does not need to be rehashed."""
+        pass
+
 
 class FileStorageConnector(StorageConnector):
+    """Stores resources as files below the root path. The MD5 sums of verified resources are kept in an append-only
+    manifest (one JSON entry per line, later entries take precedence) together with their size and modification time.
+    If either changed, the manifest entry is no longer trusted. Once most lines are superseded, the manifest is
+    compacted, i.e., replaced by a file holding the latest entry of each existing resource only."""
+
+    MANIFEST_FILE = ".manifest.jsonl"
+    # the manifest is compacted once it has more than COMPACTION_FACTOR lines per entry (and at least COMPACTION_MIN_LINES)
+    COMPACTION_FACTOR = 2
+    COMPACTION_MIN_LINES = 1024
+
     def __init__(self, root_path: str):
         self._root_path = os.path.abspath(root_path)
+        self._manifest: Dict[str, Dict[str, Any]] = {}
+        self._manifest_offset = 0
+        self._manifest_num_lines = 0
+        # (device, inode) of the manifest file read so far, which changes when the file is replaced
+        self._manifest_file_id: Optional[Tuple[int, int]] = None
+        self._manifest_lock = threading.Lock()
 
     @property
     def root_path(self):
@@ -50,16 +152,533 @@ class FileStorageConnector(StorageConnector):
         logger.debug(f"Storing resource {identifier}")
         full_path = self._get_full_path(identifier)
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        with open(full_path, "wb") as f:
-            for chunk in resource:
-                f.write(chunk)
+        # the resource is written to a temporary file first and only committed once it has been streamed completely
+        fd, tmp_path = _mkstemp(os.path.dirname(full_path), prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                FileStorageConnector._write(resource, f)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
 
     def has_resource(self, identifier: str) -> bool:
         full_path = self._get_full_path(identifier)
         return os.path.exists(full_path)
 
+    def get_resource_size(self, identifier: str) -> int:
+        if not self.has_resource(identifier):
+            raise ResourceNotFoundError(f"Resource {identifier} not found.")
+        return os.path.getsize(self._get_full_path(identifier))
+
+    def append_resource(self, identifier: str, resource: StreamedResource):
+        # chunks are flushed immediately, such that everything received so far survives an interruption
+        full_path = self._get_full_path(identifier)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "ab") as f:
+            for chunk in resource:
+                f.write(chunk)
+                f.flush()
+
+    def _get_manifest_path(self) -> str:
+        return os.path.join(self.root_path, FileStorageConnector.MANIFEST_FILE)
+
+    def _reset_manifest(self, file_id: Optional[Tuple[int, int]]):
+        self._manifest, self._manifest_offset, self._manifest_num_lines = {}, 0, 0
+        self._manifest_file_id = file_id
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        # entries appended since the last call, also by other processes, are read incrementally
+        with self._manifest_lock:
+            try:
+                with open(self._get_manifest_path(), "rb") as f:
+                    stat = os.fstat(f.fileno())
+                    file_id = (stat.st_dev, stat.st_ino)
+                    # the manifest has been compacted or truncated in the meantime, so it is read from the start
+                    if file_id != self._manifest_file_id or stat.st_size < self._manifest_offset:
+                        self._reset_manifest(file_id)
+                    f.seek(self._manifest_offset)
+                    lines = f.read().split(b"\n")
+            except FileNotFoundError:
+                self._reset_manifest(None)
+                return self._manifest
+            # the last line is either empty or still being written
+            for line in lines[:-1]:
+                self._manifest_offset += len(line) + 1
+                self._manifest_num_lines += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self._manifest[entry.pop("identifier")] = entry
+            return self._manifest
+
+    def _compact_manifest(self):
+        """Rewrites the manifest with the latest entry of each existing resource. Entries appended by other processes
+        while compacting might get lost, which only means that these resources are rehashed once."""
+        with self._manifest_lock:
+            entries = {identifier: entry for identifier, entry in self._manifest.items()
+                       if os.path.exists(self._get_full_path(identifier))}
+            fd, tmp_path = _mkstemp(self.root_path, prefix=".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for identifier, entry in entries.items():
+                        f.write((json.dumps(dict(entry, identifier=identifier)) + "\n").encode("utf-8"))
+                    stat = os.fstat(f.fileno())
+                os.replace(tmp_path, self._get_manifest_path())
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self._manifest, self._manifest_offset, self._manifest_num_lines = entries, stat.st_size, len(entries)
+            self._manifest_file_id = (stat.st_dev, stat.st_ino)
+
+    def get_verified_checksum(self, identifier: str) -> Optional[str]:
+        if not self.has_resource(identifier):
+            return None
+        entry = self._load_manifest().get(identifier)
+        stat = os.stat(self._get_full_path(identifier))
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            return None
+        return entry["md5_sum"]
+
+    def set_verified_checksum(self, identifier: str, md5_sum: str):
+        stat = os.stat(self._get_full_path(identifier))
+        entry = {"identifier": identifier, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "md5_sum": md5_sum}
+        # each entry is appended as a single line with a single write, such that concurrent writers do not interleave
+        fd = os.open(self._get_manifest_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(entry) + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
+        manifest = self._load_manifest()
+        if self._manifest_num_lines >= max(FileStorageConnector.COMPACTION_MIN_LINES,
+                                           FileStorageConnector.COMPACTION_FACTOR * len(manifest)):
+            self._compact_manifest()
+
+    @staticmethod
+    def _write(resource: StreamedResource, f: io.IOBase):
+        if isinstance(resource, Buffer):
+            if resource.allows_direct_copy:
+                # file to file copy within the kernel
+                resource.copy_to(f)
+            else:
+                for chunk in resource.iter_into():
+                    f.write(chunk)
+        else:
+            for chunk in resource:
+                f.write(chunk)
+
+    def move_resource(self, source_identifier: str, target_identifier: str):
+        if not self.has_resource(source_identifier):
+            raise ResourceNotFoundError(f"Resource {source_identifier} not found.")
+        target_path = self._get_full_path(target_identifier)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        os.replace(self._get_full_path(source_identifier), target_path)
+
+    def delete_resource(self, identifier: str):
+        if not self.has_resource(identifier):
+            raise ResourceNotFoundError(f"Resource {identifier} not found.")
+        os.remove(self._get_full_path(identifier))
+
     def _get_full_path(self, identifier: str) -> str:
         full_path = os.path.join(self.root_path, identifier)
         if not is_safe_path(basedir=self.root_path, path=full_path):
             raise MaliciousFilePathError
         return full_path
+
+
+class ContentAddressedFileStorageConnector(FileStorageConnector):
+    """File storage connector that stores the content of each resource only once as a blob keyed by its MD5 sum.
+    The identifiers are hard links to the blobs, such that resources are still regular files, e.g., for memory mapping.
+    Resources whose MD5 sum is already known (e.g., from a `ResourceDefinition`) can be linked without being retrieved
+    again via `link_resource`. Blobs that are no longer referenced are removed by `collect_garbage`."""
+
+    BLOB_FOLDER = ".blobs"
+
+    def _get_blob_path(self, md5_sum: str) -> str:
+        return os.path.join(self.root_path, ContentAddressedFileStorageConnector.BLOB_FOLDER, md5_sum[:2], md5_sum)
+
+    def _store_blob(self, path: str, md5_sum: str) -> str:
+        # moves the file at the given path into the blob storage, unless the blob exists already
+        blob_path = self._get_blob_path(md5_sum)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        if os.path.exists(blob_path):
+            os.remove(path)
+        else:
+            os.replace(path, blob_path)
+        return blob_path
+
+    def _link(self, blob_path: str, identifier: str):
+        full_path = self._get_full_path(identifier)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # the link is created next to the target first, such that replacing an existing resource is atomic
+        tmp_path = os.path.join(os.path.dirname(full_path), f".{os.path.basename(full_path)}.{uuid.uuid4().hex}.link")
+        os.link(blob_path, tmp_path)
+        os.replace(tmp_path, full_path)
+
+    def has_blob(self, md5_sum: str) -> bool:
+        return os.path.exists(self._get_blob_path(md5_sum))
+
+    def link_resource(self, identifier: str, md5_sum: str) -> bool:
+        if not self.has_blob(md5_sum):
+            return False
+        logger.debug(f"Linking resource {identifier} to existing blob {md5_sum}")
+        self._link(self._get_blob_path(md5_sum), identifier)
+        return True
+
+    def set_resource(self, identifier: str, resource: StreamedResource):
+        logger.debug(f"Storing resource {identifier}")
+        blob_folder = os.path.join(self.root_path, ContentAddressedFileStorageConnector.BLOB_FOLDER)
+        os.makedirs(blob_folder, exist_ok=True)
+        fd, tmp_path = _mkstemp(blob_folder, suffix=".tmp")
+        md5 = hashlib.md5()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in (resource.iter_into() if isinstance(resource, Buffer) else resource):
+                    md5.update(chunk)
+                    f.write(chunk)
+            blob_path = self._store_blob(tmp_path, md5.hexdigest())
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._link(blob_path, identifier)
+
+    def append_resource(self, identifier: str, resource: StreamedResource):
+        full_path = self._get_full_path(identifier)
+        if os.path.exists(full_path) and os.stat(full_path).st_nlink > 1:
+            # copy on write, as the blob is shared with other identifiers
+            tmp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+            shutil.copyfile(full_path, tmp_path)
+            os.replace(tmp_path, full_path)
+        super().append_resource(identifier, resource)
+
+    def move_resource(self, source_identifier: str, target_identifier: str):
+        if not self.has_resource(source_identifier):
+            raise ResourceNotFoundError(f"Resource {source_identifier} not found.")
+        source_path = self._get_full_path(source_identifier)
+        with open(source_path, "rb") as fd:
+            md5_sum = calculate_md5(fd)
+        blob_path = self._store_blob(source_path, md5_sum)
+        self._link(blob_path, target_identifier)
+
+    def collect_garbage(self) -> int:
+        """Removes all blobs that are not referenced by any identifier anymore.
+        :return: number of removed blobs
+        """
+        num_removed = 0
+        blob_folder = os.path.join(self.root_path, ContentAddressedFileStorageConnector.BLOB_FOLDER)
+        for folder, _, file_names in os.walk(blob_folder):
+            for file_name in file_names:
+                blob_path = os.path.join(folder, file_name)
+                if not file_name.endswith(".tmp") and os.stat(blob_path).st_nlink == 1:
+                    os.remove(blob_path)
+                    num_removed += 1
+        return num_removed
+
+
+class ObjectStoreStorageConnector(StorageConnector):
+    """Stores resources as objects below the key prefix in an S3-compatible object store, such that resources are
+    produced once and streamed to every node. Resources are uploaded in parts of `part_size` bytes via multipart
+    uploads (S3 requires at least 5 MiB per part) and read lazily via ranged GETs of at least `block_size` bytes.
+    Objects cannot be appended to, so partial downloads cannot be persisted in an object store."""
+
+    def __init__(self, client: ObjectStoreClient, prefix: str = "", part_size: int = 8 * 1024 * 1024,
+                 block_size: int = 1024 * 1024):
+        self.client = client
+        self.prefix = prefix
+        self.part_size = part_size
+        self.block_size = block_size
+
+    def _get_key(self, identifier: str) -> str:
+        return f"{self.prefix}{identifier}"
+
+    def get_resource(self, identifier: str, resource_type: ResourceFactory.SupportedStreamedResourceTypes = ResourceFactory.SupportedStreamedResourceTypes.STREAMED_BINARY_RESOURCE) -> StreamedResource:
+        key = self._get_key(identifier)
+        size = self.client.head_object(key)
+        if size is None:
+            raise ResourceNotFoundError(f"Resource {identifier} not found.")
+        stream = io.BufferedReader(ObjectStream(self.client, key, size), buffer_size=self.block_size)
+        return ResourceFactory.get_resource(identifier=identifier, file_like_object=stream, resource_type=resource_type)
+
+    def _iter_parts(self, resource: StreamedResource) -> Iterator[bytes]:
+        part, num_parts = bytearray(), 0
+        if isinstance(resource, Buffer):
+            # iterating the resource itself, such that, e.g., verified resources check their MD5 sum
+            chunks = resource.iter_into()
+        elif hasattr(resource, "read"):
+            chunks = iter(lambda: resource.read(self.part_size), b'')
+        else:
+            chunks = iter(resource)
+        for chunk in chunks:
+            part += chunk
+            while len(part) >= self.part_size:
+                yield bytes(part[:self.part_size])
+                del part[:self.part_size]
+                num_parts += 1
+        if part or num_parts == 0:
+            yield bytes(part)
+
+    def set_resource(self, identifier: str, resource: StreamedResource):
+        logger.debug(f"Storing resource {identifier}")
+        key = self._get_key(identifier)
+        if hasattr(resource, "seekable") and resource.seekable():
+            resource.seek(0)
+        parts = self._iter_parts(resource)
+        first_part = next(parts)
+        second_part = next(parts, None)
+        if second_part is None:
+            # small resources are uploaded with a single request
+            self.client.put_object(key, first_part)
+            return
+        upload_id = self.client.create_multipart_upload(key)
+        try:
+            etags = [self.client.upload_part(key, upload_id, 1, first_part),
+                     self.client.upload_part(key, upload_id, 2, second_part)]
+            for part in parts:
+                etags.append(self.client.upload_part(key, upload_id, len(etags) + 1, part))
+            self.client.complete_multipart_upload(key, upload_id, etags)
+        except BaseException:
+            self.client.abort_multipart_upload(key, upload_id)
+            raise
+
+    def has_resource(self, identifier: str) -> bool:
+        return self.client.head_object(self._get_key(identifier)) is not None
+
+    def has_resources(self, identifiers: List[str]) -> List[bool]:
+        if not identifiers:
+            return []
+        # a single (paginated) listing of the common prefix replaces one request per resource
+        keys = [self._get_key(identifier) for identifier in identifiers]
+        existing_keys = {key for key, _ in self.client.list_objects(os.path.commonprefix(keys))}
+        return [key in existing_keys for key in keys]
+
+    def get_resource_size(self, identifier: str) -> int:
+        size = self.client.head_object(self._get_key(identifier))
+        if size is None:
+            raise ResourceNotFoundError(f"Resource {identifier} not found.")
+        return size
+
+    def move_resource(self, source_identifier: str, target_identifier: str):
+        if not self.has_resource(source_identifier):
+            raise ResourceNotFoundError(f"Resource {source_identifier} not found.")
+        self.client.copy_object(self._get_key(source_identifier), self._get_key(target_identifier))
+        self.client.delete_object(self._get_key(source_identifier))
+
+    def delete_resource(self, identifier: str):
+        if not self.has_resource(identifier):
+            raise ResourceNotFoundError(f"Resource {identifier} not found.")
+        self.client.delete_object(self._get_key(identifier))
+
+
+@dataclass
+class CacheStatistics:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    memory_evictions: int = 0
+    disk_evictions: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        num_requests = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / num_requests if num_requests > 0 else 0.0
+
+
+class CachingStorageConnector(StorageConnector):
+    """Wraps a (slow) storage connector with a local disk tier and a RAM tier, each bounded in size and evicted in
+    least recently used order. Resources are fetched from the wrapped connector only on a miss of both tiers. Resources
+    not larger than `max_memory_bytes` are kept in RAM, others are served from the disk tier as regular files.
+    Writes go through to the wrapped connector and invalidate the cached copies.
+
+    Several processes may share the disk tier: files are committed atomically, the last access is tracked via the
+    modification time of the cached files and the eviction is serialized via a lock file. Processes do not see
+    each other's RAM tier, though, so resources should be written via a single process."""
+
+    LOCK_FILE = ".lock"
+
+    def __init__(self, storage_connector: StorageConnector, cache_folder_path: str, max_disk_bytes: int = 10 * 1024**3,
+                 max_memory_bytes: int = 256 * 1024**2):
+        self.storage_connector = storage_connector
+        self.disk_cache = FileStorageConnector(cache_folder_path)
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.statistics = CacheStatistics()
+        self._memory_cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        # estimate of the disk tier's size, which is synchronized with the file system on eviction
+        self._disk_bytes: Optional[int] = None
+        self._lock = threading.RLock()
+
+    def _get_disk_path(self, identifier: str) -> str:
+        return self.disk_cache._get_full_path(identifier)
+
+    def _list_disk_cache(self) -> List[Tuple[int, int, str]]:
+        # (last access, size, path) of all cached files, skipping temporary files and the lock file
+        entries = []
+        for folder, _, file_names in os.walk(self.disk_cache.root_path):
+            for file_name in file_names:
+                if file_name.startswith("."):
+                    continue
+                path = os.path.join(folder, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return entries
+
+    def _evict_disk(self):
+        os.makedirs(self.disk_cache.root_path, exist_ok=True)
+        with open(os.path.join(self.disk_cache.root_path, CachingStorageConnector.LOCK_FILE), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entries = sorted(self._list_disk_cache())
+            disk_bytes = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if disk_bytes <= self.max_disk_bytes:
+                    break
+                try:
+                    # processes that have the file opened already can still read it
+                    os.remove(path)
+                    self.statistics.disk_evictions += 1
+                except FileNotFoundError:
+                    pass
+                disk_bytes -= size
+            self._disk_bytes = disk_bytes
+
+    def _add_to_disk(self, identifier: str, resource: StreamedResource) -> io.BufferedReader:
+        disk_path = self._get_disk_path(identifier)
+        os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+        tmp_fd, tmp_path = _mkstemp(os.path.dirname(disk_path), prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(tmp_fd, "wb") as f:
+                FileStorageConnector._write(resource, f)
+            # the file is opened before it is committed, such that it stays readable even if another process
+            # evicts it right away
+            fd = open(tmp_path, "rb")
+            os.replace(tmp_path, disk_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            if self._disk_bytes is None:
+                self._evict_disk()
+            else:
+                self._disk_bytes += os.fstat(fd.fileno()).st_size
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_disk()
+        return fd
+
+    def _add_to_memory(self, identifier: str, data: bytes):
+        with self._lock:
+            self._remove_from_memory(identifier)
+            self._memory_cache[identifier] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted_data = self._memory_cache.popitem(last=False)
+                self._memory_bytes -= len(evicted_data)
+                self.statistics.memory_evictions += 1
+
+    def _remove_from_memory(self, identifier: str):
+        with self._lock:
+            data = self._memory_cache.pop(identifier, None)
+            if data is not None:
+                self._memory_bytes -= len(data)
+
+    def _invalidate(self, identifier: str):
+        self._remove_from_memory(identifier)
+        try:
+            os.remove(self._get_disk_path(identifier))
+        except FileNotFoundError:
+            pass
+
+    def _get_from_memory(self, identifier: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory_cache.get(identifier)
+            if data is not None:
+                self._memory_cache.move_to_end(identifier)
+                self.statistics.memory_hits += 1
+            return data
+
+    def _get_from_disk(self, identifier: str) -> Optional[io.BufferedReader]:
+        disk_path = self._get_disk_path(identifier)
+        try:
+            # the modification time marks the last access for the LRU eviction of all processes
+            os.utime(disk_path)
+            return open(disk_path, "rb")
+        except FileNotFoundError:
+            return None
+
+    def get_resource(self, identifier: str, resource_type: ResourceFactory.SupportedStreamedResourceTypes = ResourceFactory.SupportedStreamedResourceTypes.STREAMED_BINARY_RESOURCE) -> StreamedResource:
+        data = self._get_from_memory(identifier)
+        if data is None:
+            fd = self._get_from_disk(identifier)
+            with self._lock:
+                if fd is None:
+                    self.statistics.misses += 1
+                else:
+                    self.statistics.disk_hits += 1
+            if fd is None:
+                with self.storage_connector.get_resource(identifier) as resource:
+                    fd = self._add_to_disk(identifier, resource)
+            if os.fstat(fd.fileno()).st_size > self.max_memory_bytes:
+                return ResourceFactory.get_resource(identifier=identifier, file_like_object=fd,
+                                                    resource_type=resource_type)
+            with fd:
+                data = fd.read()
+            self._add_to_memory(identifier, data)
+        return ResourceFactory.get_resource(identifier=identifier, file_like_object=io.BytesIO(data),
+                                            resource_type=resource_type)
+
+    def set_resource(self, identifier: str, resource: StreamedResource):
+        self._invalidate(identifier)
+        self.storage_connector.set_resource(identifier, resource)
+
+    def has_resource(self, identifier: str) -> bool:
+        with self._lock:
+            if identifier in self._memory_cache:
+                return True
+        return os.path.exists(self._get_disk_path(identifier)) or self.storage_connector.has_resource(identifier)
+
+    def has_resources(self, identifiers: List[str]) -> List[bool]:
+        return self.storage_connector.has_resources(identifiers)
+
+    def get_resource_size(self, identifier: str) -> int:
+        with self._lock:
+            if identifier in self._memory_cache:
+                return len(self._memory_cache[identifier])
+        try:
+            return os.path.getsize(self._get_disk_path(identifier))
+        except FileNotFoundError:
+            return self.storage_connector.get_resource_size(identifier)
+
+    @property
+    def supports_partial_resources(self) -> bool:
+        return self.storage_connector.supports_partial_resources
+
+    def append_resource(self, identifier: str, resource: StreamedResource):
+        self._invalidate(identifier)
+        self.storage_connector.append_resource(identifier, resource)
+
+    def move_resource(self, source_identifier: str, target_identifier: str):
+        self._invalidate(source_identifier)
+        self._invalidate(target_identifier)
+        self.storage_connector.move_resource(source_identifier, target_identifier)
+
+    def delete_resource(self, identifier: str):
+        self._invalidate(identifier)
+        self.storage_connector.delete_resource(identifier)
+
+    def clear(self):
+        """Removes all resources from both cache tiers."""
+        with self._lock:
+            self._memory_cache.clear()
+            self._memory_bytes = 0
+            for _, _, path in self._list_disk_cache():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._disk_bytes = 0
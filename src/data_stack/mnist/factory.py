@@ -45,9 +45,9 @@ class MNISTFactory(BaseDatasetFactory):
         super().__init__(storage_connector)
 
     def check_exists(self) -> bool:
-        # TODO come up with a better check!
-        sample_identifier = self._get_resource_id(data_type="preprocessed", split="train", element="samples.pt")
-        return self.storage_connector.has_resource(sample_identifier)
+        # all preprocessed resources of all splits need to be present
+        return all(self.storage_connector.has_resource(self._get_resource_id(data_type="preprocessed", split=split, element=element))
+                   for split in self.resource_definitions.keys() for element in ["samples.npy", "targets.npy"])
 
     def _get_resource_id(self, data_type: str,  split: str, element: str) -> str:
         return os.path.join("mnist", data_type, split, element)
@@ -63,8 +63,8 @@ class MNISTFactory(BaseDatasetFactory):
 
     def _prepare_split(self, split: str):
         preprocessor = MNISTPreprocessor(self.storage_connector)
-        sample_identifier = self._get_resource_id(data_type="preprocessed", split=split, element="samples.pt")
-        target_identifier = self._get_resource_id(data_type="preprocessed", split=split, element="targets.pt")
+        sample_identifier = self._get_resource_id(data_type="preprocessed", split=split, element="samples.npy")
+        target_identifier = self._get_resource_id(data_type="preprocessed", split=split, element="targets.npy")
         preprocessor.preprocess(*[r.identifier for r in self.resource_definitions[split]],
                                 sample_identifier=sample_identifier,
                                 target_identifier=target_identifier)
@@ -78,8 +78,8 @@ class MNISTFactory(BaseDatasetFactory):
             for s in splits:
                 self._prepare_split(s)
 
-        sample_identifier = self._get_resource_id(data_type="preprocessed", split=split, element="samples.pt")
-        target_identifier = self._get_resource_id(data_type="preprocessed", split=split, element="targets.pt")
+        sample_identifier = self._get_resource_id(data_type="preprocessed", split=split, element="samples.npy")
+        target_identifier = self._get_resource_id(data_type="preprocessed", split=split, element="targets.npy")
         sample_resource = self.storage_connector.get_resource(identifier=sample_identifier)
         target_resource = self.storage_connector.get_resource(identifier=target_identifier)
         return MNISTIterator(sample_resource, target_resource)
@@ -1,14 +1,48 @@
 import torch
+import numpy as np
+from typing import Sequence, Tuple, Iterator
 from data_stack.io.resources import StreamedResource
+from data_stack.io.array_io import ArrayIO
 from data_stack.dataset.iterator import SequenceDatasetIterator
 
 
 class MNISTIterator(SequenceDatasetIterator):
     """ MNIST dataset iterator (http://yann.lecun.com/exdb/mnist/)
+
+    The preprocessed samples and targets are memory mapped, i.e., samples are only read from disk when accessed
+    and forked worker processes share the same pages instead of holding their own copy of the dataset.
     """
 
     def __init__(self, samples_stream: StreamedResource, targets_stream: StreamedResource):
-        targets = [int(target) for target in torch.load(targets_stream)]
-        dataset_sequences = [torch.load(samples_stream), targets, targets]
+        samples = ArrayIO.from_streamed_resource(samples_stream)
+        targets = ArrayIO.from_streamed_resource(targets_stream)
         samples_stream.close()
-        super().__init__(dataset_sequences=dataset_sequences)
+        targets_stream.close()
+        super().__init__(dataset_sequences=[samples, targets, targets])
+
+    # number of samples copied out of the memory map at once during sequential iteration
+    READ_BLOCK_SIZE = 1024
+
+    def __getitem__(self, index: int):
+        samples, targets, _ = self._dataset_sequences
+        # copy the sample out of the (read-only) memory map
+        sample = torch.from_numpy(np.array(samples[index]))
+        target = int(targets[index])
+        return sample, target, target
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, int, int]]:
+        samples, targets, _ = self._dataset_sequences
+        for start in range(0, len(self), MNISTIterator.READ_BLOCK_SIZE):
+            end = start + MNISTIterator.READ_BLOCK_SIZE
+            # the yielded samples are views into a single copy of the block
+            sample_block = torch.from_numpy(np.array(samples[start:end]))
+            for sample, target in zip(sample_block, targets[start:end].tolist()):
+                yield sample, target, target
+
+    def get_batch(self, indices: Sequence[int]) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        samples, targets, _ = self._dataset_sequences
+        indices = np.asarray(indices, dtype=np.int64)
+        # a single fancy-index on the memory map copies the whole batch at once
+        sample_batch = torch.from_numpy(samples[indices])
+        target_batch = torch.from_numpy(np.asarray(targets[indices], dtype=np.int64))
+        return sample_batch, target_batch, target_batch
@@ -1,28 +1,46 @@
 import torch
 import codecs
+import io
 import numpy as np
+from typing import Optional, Iterator, Tuple
 from data_stack.dataset.preprocesor import PreprocessingHelpers
-from data_stack.io.resources import ResourceFactory, StreamedResource
-import io
+from data_stack.io.resources import StreamedResource, ResourceFactory, IteratorStream
+from data_stack.io.array_io import ArrayIO
 from data_stack.io.storage_connectors import StorageConnector
-from torchvision import transforms
 
 
 class MNISTPreprocessor:
+    """Converts the raw IDX files into npy arrays. The images are normalized to [0, 1] with a single vectorized
+    operation over all images. If a `chunk_size` (number of images) is given, the images are decoded, normalized and
+    stored block by block instead, such that the peak memory does not depend on the number of images."""
+
+    SN3_PASCALVINCENT_TYPEMAP = {
+        8: (torch.uint8, np.uint8, np.uint8),
+        9: (torch.int8, np.int8, np.int8),
+        11: (torch.int16, np.dtype('>i2'), 'i2'),
+        12: (torch.int32, np.dtype('>i4'), 'i4'),
+        13: (torch.float32, np.dtype('>f4'), 'f4'),
+        14: (torch.float64, np.dtype('>f8'), 'f8')
+    }
 
-    def __init__(self, storage_connector: StorageConnector):
+    READ_BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, storage_connector: StorageConnector, chunk_size: Optional[int] = None):
         self.storage_connector = storage_connector
+        self.chunk_size = chunk_size
 
     def preprocess(self, raw_sample_identifier: str, raw_target_identifier: str, sample_identifier: str, target_identifier: str):
-        with self._preprocess_sample_resource(raw_sample_identifier, sample_identifier) as sample_resource:
-            self.storage_connector.set_resource(identifier=sample_resource.identifier, resource=sample_resource)
+        if self.chunk_size is not None:
+            self._preprocess_sample_resource_chunked(raw_sample_identifier, sample_identifier)
+        else:
+            with self._preprocess_sample_resource(raw_sample_identifier, sample_identifier) as sample_resource:
+                self.storage_connector.set_resource(identifier=sample_resource.identifier, resource=sample_resource)
         with self._preprocess_target_resource(raw_target_identifier, target_identifier) as target_resource:
             self.storage_connector.set_resource(identifier=target_resource.identifier, resource=target_resource)
 
     def _torch_tensor_to_streamed_resource(self, identifier: str, tensor: torch.Tensor) -> StreamedResource:
-        buffer = io.BytesIO()
-        torch.save(tensor, buffer)
-        resource = ResourceFactory.get_resource(identifier=identifier, file_like_object=buffer)
+        # stored as raw npy array, such that the iterator can memory map it
+        resource = ArrayIO.to_streamed_resource(identifier=identifier, array=tensor.numpy())
         return resource
 
     def _preprocess_target_resource(self, raw_identifier: str, prep_identifier: str) -> StreamedResource:
@@ -36,55 +54,93 @@ class MNISTPreprocessor:
         with self.storage_connector.get_resource(raw_identifier) as raw_resource:
             with PreprocessingHelpers.get_gzip_stream(resource=raw_resource) as unzipped_resource:
                 torch_tensor = MNISTPreprocessor._read_image_file(unzipped_resource)
-        img_transformed = [transforms.ToTensor()(torch_tensor[i].numpy()) for i in range(len(torch_tensor))]
-        img_tensor = torch.cat(img_transformed, dim=0)
+        img_tensor = MNISTPreprocessor._normalize_images(torch_tensor)
         resource = self._torch_tensor_to_streamed_resource(prep_identifier, img_tensor)
         return resource
 
+    def _preprocess_sample_resource_chunked(self, raw_identifier: str, prep_identifier: str):
+        with self.storage_connector.get_resource(raw_identifier) as raw_resource:
+            with PreprocessingHelpers.get_gzip_stream(resource=raw_resource) as unzipped_resource:
+                # the chunks are decoded lazily while the storage connector writes them
+                chunks = IteratorStream(self._iter_normalized_image_chunks(unzipped_resource))
+                with ResourceFactory.get_resource(identifier=prep_identifier, file_like_object=chunks) as resource:
+                    self.storage_connector.set_resource(identifier=prep_identifier, resource=resource)
+
+    def _iter_normalized_image_chunks(self, resource: StreamedResource) -> Iterator[memoryview]:
+        magic, dtype, shape = MNISTPreprocessor._read_idx_header(resource)
+        assert magic == 2051
+        yield memoryview(ArrayIO.get_npy_header(shape, np.float32))
+        # both buffers are allocated once and reused for every chunk
+        images = np.empty((min(self.chunk_size, shape[0]), *shape[1:]), dtype=dtype.newbyteorder("="))
+        normalized_images = torch.empty(images.shape, dtype=torch.float32)
+        for start in range(0, shape[0], self.chunk_size):
+            num_images = min(self.chunk_size, shape[0] - start)
+            MNISTPreprocessor._read_idx_payload(resource, images[:num_images], dtype)
+            chunk = normalized_images[:num_images]
+            chunk.copy_(torch.from_numpy(images[:num_images])).div_(255)
+            # the chunk is written before the buffers are reused for the next one
+            yield memoryview(chunk.numpy()).cast("B")
+
+    @staticmethod
+    def _normalize_images(images: torch.Tensor) -> torch.Tensor:
+        # equivalent to applying transforms.ToTensor to each image (and concatenating the results)
+        return images.float().div_(255)
+
     @classmethod
     def _get_int(cls, b):
         return int(codecs.encode(b, 'hex'), 16)
 
+    @classmethod
+    def _read_idx_header(cls, stream: io.RawIOBase) -> Tuple[int, np.dtype, Tuple[int, ...]]:
+        """Reads the header of an IDX file from the stream and returns its magic number, the (big-endian) data type
+        and the shape of the payload that follows."""
+        magic = cls._get_int(stream.read(4))
+        nd, ty = magic % 256, magic // 256
+        assert 1 <= nd <= 3
+        assert 8 <= ty <= 14
+        shape = tuple(cls._get_int(stream.read(4)) for _ in range(nd))
+        return magic, np.dtype(MNISTPreprocessor.SN3_PASCALVINCENT_TYPEMAP[ty][1]), shape
+
+    @classmethod
+    def _read_idx_payload(cls, stream: io.RawIOBase, out: np.ndarray, dtype: np.dtype):
+        """Fills the preallocated, C-contiguous array with the next elements of the stream, which are decompressed
+        and read block by block directly into the array and converted to the native byte order in place."""
+        buffer = memoryview(out.reshape(-1).view(np.uint8))
+        position = 0
+        while position < len(buffer):
+            num_bytes = stream.readinto(buffer[position:position + MNISTPreprocessor.READ_BLOCK_SIZE])
+            if not num_bytes:
+                raise ValueError(f"IDX file ended after {position} of {len(buffer)} payload bytes.")
+            position += num_bytes
+        if not dtype.isnative:
+            out.byteswap(inplace=True)
+
+    @classmethod
+    def _read_idx(cls, stream: io.RawIOBase, magic: int = None, out: np.ndarray = None, strict: bool = True) -> np.ndarray:
+        file_magic, dtype, shape = cls._read_idx_header(stream)
+        assert magic is None or file_magic == magic
+        if out is None:
+            out = np.empty(shape, dtype=dtype.newbyteorder("="))
+        assert out.shape == shape and out.dtype == dtype.newbyteorder("=") and out.flags.c_contiguous
+        cls._read_idx_payload(stream, out, dtype)
+        # strictly, the payload has to end with the file
+        assert not strict or not stream.read(1)
+        return out
+
     @classmethod
     def _read_label_file(cls, resource: StreamedResource):
-        data = resource.read()
-        assert cls._get_int(data[:4]) == 2049
-        length = cls._get_int(data[4:8])
-        parsed = np.frombuffer(data, dtype=np.uint8, offset=8)
-        torch_tensor = torch.from_numpy(parsed).view(length).long()
-        torch_tensor = torch_tensor.long()
-        return torch_tensor
+        labels = cls._read_idx(resource, magic=2049)
+        return torch.from_numpy(labels).long()
 
     @classmethod
     def _read_image_file(cls, resource: StreamedResource):
-        data = resource.read()
-        assert cls._get_int(data[:4]) == 2051
-        return MNISTPreprocessor.read_sn3_pascalvincent_tensor(data, strict=False)
+        return torch.from_numpy(cls._read_idx(resource, magic=2051, strict=False))
 
     @staticmethod
-    def read_sn3_pascalvincent_tensor(data, strict: bool = True) -> torch.Tensor:
+    def read_sn3_pascalvincent_tensor(data, strict: bool = True, out: np.ndarray = None) -> torch.Tensor:
         """Read a SN3 file in "Pascal Vincent" format (Lush file 'libidx/idx-io.lsh').
-        Argument may be a filename, compressed filename, or file object.
+        Argument may be the file's content or a (decompressing) binary stream, which is decoded incrementally. The
+        payload is written into `out`, if given, e.g., a memory mapped output file, or into a newly allocated array.
         """
-        def get_int(b: bytes) -> int:
-            return int(codecs.encode(b, 'hex'), 16)
-
-        SN3_PASCALVINCENT_TYPEMAP = {
-            8: (torch.uint8, np.uint8, np.uint8),
-            9: (torch.int8, np.int8, np.int8),
-            11: (torch.int16, np.dtype('>i2'), 'i2'),
-            12: (torch.int32, np.dtype('>i4'), 'i4'),
-            13: (torch.float32, np.dtype('>f4'), 'f4'),
-            14: (torch.float64, np.dtype('>f8'), 'f8')
-        }
-        # parse
-        magic = get_int(data[0:4])
-        nd = magic % 256
-        ty = magic // 256
-        assert 1 <= nd <= 3
-        assert 8 <= ty <= 14
-        m = SN3_PASCALVINCENT_TYPEMAP[ty]
-        s = [get_int(data[4 * (i + 1): 4 * (i + 2)]) for i in range(nd)]
-        parsed = np.frombuffer(data, dtype=m[1], offset=(4 * (nd + 1)))
-        assert parsed.shape[0] == np.prod(s) or not strict
-        return torch.from_numpy(parsed.astype(m[2])).view(*s)
+        stream = io.BytesIO(data) if isinstance(data, (bytes, bytearray, memoryview)) else data
+        return torch.from_numpy(MNISTPreprocessor._read_idx(stream, out=out, strict=strict))
@@ -1,6 +1,7 @@
 import os
 import hashlib
 import io
+import numpy as np
 
 
 def is_safe_path(basedir, path, follow_symlinks=True):
@@ -16,3 +17,8 @@ def calculate_md5(byte_stream: io.BytesIO, chunk_size: int = 1024 * 1024):
     for chunk in iter(lambda: byte_stream.read(chunk_size), b''):
         md5.update(chunk)
     return md5.hexdigest()
+
+
+def get_index_dtype(num_elements: int) -> np.dtype:
+    # int32 halves the memory footprint of index arrays for datasets with less than 2^31 samples
+    return np.dtype(np.int32) if num_elements <= np.iinfo(np.int32).max else np.dtype(np.int64)
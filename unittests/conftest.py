@@ -1,6 +1,14 @@
 import tempfile
 import pytest
 import shutil
+import os
+import threading
+import hashlib
+import re
+from functools import partial
+from urllib.parse import urlsplit, parse_qs, unquote
+from xml.sax.saxutils import escape
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler, BaseHTTPRequestHandler
 
 
 @pytest.fixture
@@ -8,3 +16,200 @@ def tmp_folder_path() -> str:
     path = tempfile.mkdtemp()
     yield path
     shutil.rmtree(path)
+
+
+class RangeHTTPRequestHandler(SimpleHTTPRequestHandler):
+    """Serves files including single byte range requests. For simulating connection failures, the server's
+    `drop_after` maps request paths to the number of bytes after which the connection is dropped (once)."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        path = self.translate_path(self.path)
+        range_header = self.headers.get("Range")
+        self.server.requests.append((self.command, self.path, range_header))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as fd:
+            content = fd.read()
+        status, start, end = 200, 0, len(content) - 1
+        if range_header is not None and self.server.support_ranges:
+            range_start, range_end = range_header.replace("bytes=", "").split("-")
+            start, end = int(range_start), int(range_end) if range_end else len(content) - 1
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(content)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        body = content[start:end + 1]
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        if self.server.support_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+        self.end_headers()
+        if not send_body:
+            return
+        drop_after = self.server.drop_after.pop(self.path, None)
+        if drop_after is not None:
+            self.wfile.write(body[:drop_after])
+            self.close_connection = True
+        else:
+            self.wfile.write(body)
+
+
+@pytest.fixture
+def http_server_root() -> str:
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+@pytest.fixture
+def http_server(http_server_root: str) -> ThreadingHTTPServer:
+    """Local HTTP server serving the files in `http_server_root`, standing in for a remote server."""
+    handler = partial(RangeHTTPRequestHandler, directory=http_server_root)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.requests = []
+    server.drop_after = {}
+    server.support_ranges = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def http_server_url(http_server: ThreadingHTTPServer) -> str:
+    return f"http://127.0.0.1:{http_server.server_address[1]}"
+
+
+class ObjectStoreRequestHandler(BaseHTTPRequestHandler):
+    """Minimal S3-compatible object store keeping all objects of a single bucket in memory. Supports object GET
+    (including ranges), HEAD, PUT, copy and DELETE, ListObjectsV2 with pagination and multipart uploads."""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _parse_request(self):
+        parts = urlsplit(self.path)
+        self.server.requests.append((self.command, parts.path, parts.query, self.headers.get("Authorization")))
+        query = {key: values[0] for key, values in parse_qs(parts.query, keep_blank_values=True).items()}
+        _, bucket, key = (unquote(parts.path).split("/", 2) + [""])[:3]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        return bucket, key, query, body
+
+    def _respond(self, status: int, body: bytes = b"", headers=None, send_body: bool = True):
+        self.send_response(status)
+        for name, value in (headers if headers else {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _respond_xml(self, xml: str):
+        self._respond(200, f'<?xml version="1.0" encoding="UTF-8"?>{xml}'.encode("utf-8"))
+
+    def _get(self, send_body: bool):
+        bucket, key, query, _ = self._parse_request()
+        if bucket != self.server.bucket:
+            self._respond(404, send_body=send_body)
+        elif not key and "list-type" in query:
+            keys = sorted(k for k in self.server.objects if k.startswith(query.get("prefix", "")))
+            keys = [k for k in keys if k > query.get("continuation-token", "")]
+            page, is_truncated = keys[:self.server.max_keys], len(keys) > self.server.max_keys
+            contents = "".join(f"<Contents><Key>{escape(k)}</Key><Size>{len(self.server.objects[k])}</Size></Contents>"
+                               for k in page)
+            token = f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if is_truncated else ""
+            self._respond_xml(f"<ListBucketResult xmlns=\"http://s3.amazonaws.com/doc/2006-03-01/\">{contents}"
+                              f"<IsTruncated>{str(is_truncated).lower()}</IsTruncated>{token}</ListBucketResult>")
+        elif key not in self.server.objects:
+            self._respond(404, send_body=send_body)
+        else:
+            content = self.server.objects[key]
+            range_header = self.headers.get("Range")
+            if range_header is None:
+                self._respond(200, content, send_body=send_body)
+                return
+            start, end = re.match(r"bytes=(\d+)-(\d*)", range_header).groups()
+            start, end = int(start), min(int(end) if end else len(content) - 1, len(content) - 1)
+            self._respond(206, content[start:end + 1], {"Content-Range": f"bytes {start}-{end}/{len(content)}"},
+                          send_body=send_body)
+
+    def do_GET(self):
+        self._get(send_body=True)
+
+    def do_HEAD(self):
+        self._get(send_body=False)
+
+    def do_PUT(self):
+        bucket, key, query, body = self._parse_request()
+        if "uploadId" in query:
+            parts = self.server.uploads[query["uploadId"]][1]
+            parts[int(query["partNumber"])] = body
+            self._respond(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+        elif "x-amz-copy-source" in self.headers:
+            _, _, source_key = unquote(self.headers["x-amz-copy-source"]).split("/", 2)
+            self.server.objects[key] = self.server.objects[source_key]
+            self._respond_xml("<CopyObjectResult></CopyObjectResult>")
+        else:
+            self.server.objects[key] = body
+            self._respond(200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+    def do_POST(self):
+        bucket, key, query, body = self._parse_request()
+        if "uploads" in query:
+            upload_id = str(len(self.server.uploads))
+            self.server.uploads[upload_id] = (key, {})
+            self._respond_xml(f"<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId>"
+                              f"</InitiateMultipartUploadResult>")
+        else:
+            _, parts = self.server.uploads.pop(query["uploadId"])
+            part_numbers = [int(n) for n in re.findall(r"<PartNumber>(\d+)</PartNumber>", body.decode("utf-8"))]
+            self.server.objects[key] = b"".join(parts[n] for n in part_numbers)
+            self._respond_xml("<CompleteMultipartUploadResult></CompleteMultipartUploadResult>")
+
+    def do_DELETE(self):
+        bucket, key, query, _ = self._parse_request()
+        if "uploadId" in query:
+            self.server.uploads.pop(query["uploadId"], None)
+        else:
+            self.server.objects.pop(key, None)
+        self._respond(204)
+
+
+@pytest.fixture
+def object_store_server() -> ThreadingHTTPServer:
+    """Local S3-compatible server with the bucket `test-bucket`, standing in for a remote object store."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ObjectStoreRequestHandler)
+    server.bucket = "test-bucket"
+    server.objects = {}
+    server.uploads = {}
+    server.requests = []
+    server.max_keys = 1000
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def object_store_url(object_store_server: ThreadingHTTPServer) -> str:
+    return f"http://127.0.0.1:{object_store_server.server_address[1]}"
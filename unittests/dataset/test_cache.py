@@ -0,0 +1,106 @@
+import pytest
+from typing import List
+from data_stack.dataset.iterator import DatasetIteratorIF, SequenceDatasetIterator, DatasetIteratorView, \
+    CombinedDatasetIterator
+from data_stack.dataset.cache import CachedDatasetIterator, get_fingerprint
+from data_stack.dataset.shuffle import EpochShuffledDatasetIterator
+from data_stack.dataset.factory import InformedDatasetFactory
+from data_stack.dataset.meta import MetaFactory
+from data_stack.io.storage_connectors import StorageConnectorFactory, StorageConnector
+
+
+class CountingDatasetIterator(SequenceDatasetIterator):
+
+    def __init__(self, dataset_sequences: List[List]):
+        super().__init__(dataset_sequences)
+        self.num_accesses = 0
+
+    def __getitem__(self, index: int):
+        self.num_accesses += 1
+        return super().__getitem__(index)
+
+
+class TestCachedDatasetIterator:
+
+    @pytest.fixture
+    def dataset_iterator(self) -> CountingDatasetIterator:
+        return CountingDatasetIterator(dataset_sequences=[[(i, i + 1) for i in range(100)], list(range(100))])
+
+    @pytest.fixture
+    def storage_connector(self, tmp_folder_path: str) -> StorageConnector:
+        return StorageConnectorFactory.get_file_storage_connector(tmp_folder_path)
+
+    def test_cache_and_reopen(self, dataset_iterator: CountingDatasetIterator, storage_connector: StorageConnector):
+        view = DatasetIteratorView(dataset_iterator, indices=list(range(99, -1, -2)))
+        cached_iterator = CachedDatasetIterator(view, storage_connector, config={"dataset": "counting"})
+        assert dataset_iterator.num_accesses == len(view)
+        assert [cached_iterator[i] for i in range(len(view))] == [view[i] for i in range(len(view))]
+        dataset_iterator.num_accesses = 0
+        # the second time, the cache is reopened without evaluating the iterator graph
+        reopened_iterator = CachedDatasetIterator(view, storage_connector, config={"dataset": "counting"})
+        assert dataset_iterator.num_accesses == 0
+        assert reopened_iterator.key == cached_iterator.key
+        assert list(reopened_iterator) == [view[i] for i in range(len(view))]
+
+    def test_reopen_without_flatten(self, dataset_iterator: CountingDatasetIterator,
+                                    storage_connector: StorageConnector, monkeypatch):
+        view = DatasetIteratorView(dataset_iterator, indices=[3, 1, 2])
+        CachedDatasetIterator(view, storage_connector, config={"dataset": "counting"})
+
+        def flatten(self):
+            raise AssertionError("The iterator graph must not be flattened.")
+
+        monkeypatch.setattr(DatasetIteratorView, "flatten", flatten)
+        reopened_iterator = CachedDatasetIterator(view, storage_connector, config={"dataset": "counting"})
+        assert list(reopened_iterator) == [view[i] for i in range(len(view))]
+
+    def test_key_and_verify(self, dataset_iterator: CountingDatasetIterator, storage_connector: StorageConnector):
+        config = {"dataset": "counting"}
+        view = DatasetIteratorView(dataset_iterator, indices=[3, 1, 2])
+        cached_iterator = CachedDatasetIterator(view, storage_connector, config, key="split")
+        assert cached_iterator.key == "split"
+        # without verification, the explicit key is trusted, even if the graph selects other samples now
+        other_view = DatasetIteratorView(dataset_iterator, indices=[4, 5, 6])
+        assert list(CachedDatasetIterator(other_view, storage_connector, config, key="split")) == list(view)
+        # verification compares the fingerprints of the samples and rebuilds the stale cache
+        verified_iterator = CachedDatasetIterator(other_view, storage_connector, config, key="split", verify=True)
+        assert list(verified_iterator) == list(other_view)
+        # a cache that is up to date is not rebuilt, the only accesses stem from the expected samples
+        dataset_iterator.num_accesses = 0
+        assert list(CachedDatasetIterator(other_view, storage_connector, config, key="split", verify=True)) == \
+            list(other_view)
+        assert dataset_iterator.num_accesses == len(other_view)
+
+    def test_fingerprint(self, dataset_iterator: DatasetIteratorIF):
+        view = DatasetIteratorView(dataset_iterator, indices=[0, 1, 2])
+        config = {"dataset": "counting"}
+        fingerprint = get_fingerprint(view, config)
+        assert get_fingerprint(DatasetIteratorView(dataset_iterator, indices=[0, 1, 2]), config) == fingerprint
+        # equivalent graphs share the fingerprint
+        combined = CombinedDatasetIterator([DatasetIteratorView(dataset_iterator, indices=[0]),
+                                            DatasetIteratorView(dataset_iterator, indices=[1, 2])])
+        assert get_fingerprint(combined, config) == fingerprint
+        assert get_fingerprint(DatasetIteratorView(dataset_iterator, indices=[0, 2, 1]), config) != fingerprint
+        # different datasets of the same type and length are told apart by the config
+        assert get_fingerprint(view, {"dataset": "counting", "version": 2}) != fingerprint
+
+    def test_set_epoch(self, dataset_iterator: CountingDatasetIterator, storage_connector: StorageConnector):
+        shuffled_iterator = EpochShuffledDatasetIterator(dataset_iterator, seed=1)
+        cached_iterator = CachedDatasetIterator(shuffled_iterator, storage_connector, config={"dataset": "counting"})
+        samples = list(cached_iterator)
+        # the cache keeps the order at the time of caching, so the epoch is not forwarded below it
+        cached_iterator.set_epoch(1)
+        assert shuffled_iterator.epoch == 0
+        assert list(cached_iterator) == samples
+        # shuffling above the cache reorders the cached samples
+        iterator = EpochShuffledDatasetIterator(cached_iterator, seed=1)
+        iterator.set_epoch(1)
+        assert sorted(iterator) == sorted(samples) and list(iterator) != samples
+
+    def test_factory(self, dataset_iterator: DatasetIteratorIF, storage_connector: StorageConnector):
+        meta = MetaFactory.get_dataset_meta(identifier="id x", dataset_name="counting", dataset_tag="train")
+        cached_iterator = InformedDatasetFactory.get_cached_dataset_iterator(dataset_iterator, meta, storage_connector,
+                                                                             config={"dataset": "counting"})
+        assert len(cached_iterator) == len(dataset_iterator)
+        assert cached_iterator.dataset_meta == meta
+        assert cached_iterator[5] == dataset_iterator[5]
@@ -1,7 +1,9 @@
 import pytest
+import numpy as np
+import torch
 from typing import List, Any, Tuple
 from data_stack.dataset.iterator import DatasetIteratorIF, SequenceDatasetIterator, DatasetIteratorView, \
-    CombinedDatasetIterator, InMemoryDatasetIterator
+    CombinedDatasetIterator, InMemoryDatasetIterator, CompiledDatasetIterator, PrefetchingDatasetIterator
 from data_stack.dataset.factory import InformedDatasetFactory
 from itertools import chain
 from data_stack.dataset.meta import MetaFactory
@@ -75,3 +77,140 @@ class TestIterator:
             len(indices) == len(set(indices)) and \
             len(indices) == len(set(indices).intersection(set(shuffled_iterator._dataset_iterator.indices))) and \
             any([indice != indices[i] for i, indice in enumerate(shuffled_iterator._dataset_iterator.indices)])
+
+    def test_dataset_iterator_combined_index_resolution(self, sequences):
+        iterators = [SequenceDatasetIterator(dataset_sequences=[list(range(length))]) for length in [3, 0, 1, 4]]
+        combined_iterator = CombinedDatasetIterator(iterators=iterators)
+        expected = [(0,), (1,), (2,), (0,), (0,), (1,), (2,), (3,)]
+        assert len(combined_iterator) == len(expected)
+        assert [combined_iterator[i] for i in range(len(combined_iterator))] == expected
+        assert combined_iterator[-1] == (3,)
+        with pytest.raises(IndexError):
+            combined_iterator[len(expected)]
+
+    def test_dataset_iterator_combined_invalidate(self):
+        growing_sequence = [0, 1]
+        combined_iterator = CombinedDatasetIterator(iterators=[SequenceDatasetIterator(dataset_sequences=[growing_sequence]),
+                                                               SequenceDatasetIterator(dataset_sequences=[["a"]])])
+        growing_sequence.append(2)
+        assert len(combined_iterator) == 3
+        combined_iterator.invalidate()
+        assert len(combined_iterator) == 4
+        assert combined_iterator[2] == (2,) and combined_iterator[3] == ("a",)
+
+    def test_get_batch(self, dataset_iterator: DatasetIteratorIF, dataset_iterator_view: DatasetIteratorIF, sequences):
+        combined_iterator = CombinedDatasetIterator(iterators=[dataset_iterator_view, dataset_iterator, dataset_iterator_view])
+        meta = MetaFactory.get_dataset_meta(identifier="id_1")
+        informed_iterator = InformedDatasetFactory.get_dataset_iterator(combined_iterator, meta)
+        indices = [8, 0, 3, 7, 1, 3]
+        batch = informed_iterator.get_batch(indices)
+        assert len(batch) == len(sequences)
+        for position, column in enumerate(batch):
+            assert list(column) == [combined_iterator[index][position] for index in indices]
+        for iterator in [informed_iterator, CompiledDatasetIterator(combined_iterator)]:
+            empty_batch = iterator.get_batch([])
+            assert len(empty_batch) == len(sequences) and all(len(column) == 0 for column in empty_batch)
+
+    def test_get_batch_fancy_index(self):
+        samples = np.arange(20).reshape(10, 2)
+        targets = torch.arange(10)
+        iterator = SequenceDatasetIterator(dataset_sequences=[samples, targets])
+        combined_iterator = CombinedDatasetIterator(iterators=[DatasetIteratorView(iterator, indices=[9, 8, 7]), iterator])
+        sample_batch, target_batch = combined_iterator.get_batch([4, 0, 2])
+        assert isinstance(sample_batch, np.ndarray) and isinstance(target_batch, torch.Tensor)
+        assert sample_batch.tolist() == [[2, 3], [18, 19], [14, 15]]
+        assert target_batch.tolist() == [1, 9, 7]
+
+    def test_get_batch_fallback(self, dataset_iterator: DatasetIteratorIF):
+        in_memory_iterator = InMemoryDatasetIterator(dataset_iterator)
+        assert in_memory_iterator.get_batch([1, 0]) == dataset_iterator.get_batch([1, 0])
+
+    def test_compiled_dataset_iterator(self, dataset_iterator: DatasetIteratorIF, dataset_iterator_view: DatasetIteratorIF):
+        meta = MetaFactory.get_dataset_meta(identifier="id_1")
+        shuffled_iterator = InformedDatasetFactory.get_shuffled_dataset_iterator(dataset_iterator, meta, seed=1)
+        other_iterator = SequenceDatasetIterator(dataset_sequences=[[10, 11], [0, 1], ["x", "y"]])
+        combined_iterator = CombinedDatasetIterator(iterators=[dataset_iterator_view, shuffled_iterator, other_iterator])
+        nested_iterator = DatasetIteratorView(DatasetIteratorView(combined_iterator, indices=[8, 1, 2, 5, 0]), indices=[4, 0, 2])
+        compiled_iterator = InformedDatasetFactory.get_compiled_dataset_iterator(nested_iterator, meta)
+
+        sources, _, _ = compiled_iterator.flatten()
+        assert len(sources) == 2 and sources[0] is dataset_iterator and sources[1] is other_iterator
+        assert len(compiled_iterator) == len(nested_iterator)
+        assert [compiled_iterator[i] for i in range(len(compiled_iterator))] == [nested_iterator[i] for i in range(len(nested_iterator))]
+        assert compiled_iterator.get_batch([2, 0]) == nested_iterator.get_batch([2, 0])
+
+    def test_dataset_iterator_view_compact_indices(self, dataset_iterator_view: DatasetIteratorView, dataset_view_indices):
+        assert isinstance(dataset_iterator_view.indices, np.ndarray) and dataset_iterator_view.indices.dtype == np.int32
+        assert dataset_iterator_view.indices.tolist() == dataset_view_indices
+
+    def test_get_column(self, dataset_iterator: DatasetIteratorIF, dataset_iterator_view: DatasetIteratorIF,
+                        target_position: int):
+        meta = MetaFactory.get_dataset_meta(identifier="id_1", iterator_meta=MetaFactory.get_iterator_meta(0, target_position, 2))
+        combined_iterator = CombinedDatasetIterator(iterators=[dataset_iterator_view, dataset_iterator])
+        nested_iterator = DatasetIteratorView(combined_iterator, indices=[6, 0, 3, 1])
+        for iterator in [dataset_iterator, dataset_iterator_view, combined_iterator, nested_iterator,
+                         CompiledDatasetIterator(nested_iterator), InMemoryDatasetIterator(nested_iterator)]:
+            informed_iterator = InformedDatasetFactory.get_dataset_iterator(iterator, meta)
+            assert list(informed_iterator.get_targets()) == [row[target_position] for row in iterator]
+
+    @pytest.mark.parametrize("use_processes", [False, True])
+    def test_prefetching_dataset_iterator(self, dataset_iterator: DatasetIteratorIF, sequences, use_processes: bool):
+        with PrefetchingDatasetIterator(dataset_iterator, num_workers=2, prefetch_size=3,
+                                        use_processes=use_processes) as iterator:
+            # multiple passes reuse the workers
+            for _ in range(2):
+                assert list(iterator) == list(zip(*sequences))
+            assert iterator.statistics.num_samples == 2 * len(dataset_iterator)
+            assert 0 <= iterator.statistics.starvation_ratio <= 1
+
+    def test_prefetching_dataset_iterator_indices(self, dataset_iterator: DatasetIteratorIF,
+                                                  dataset_iterator_view: DatasetIteratorIF, dataset_view_indices):
+        iterator = PrefetchingDatasetIterator(dataset_iterator, num_workers=2, indices=dataset_view_indices)
+        assert len(iterator) == len(dataset_iterator_view)
+        assert list(iterator) == list(dataset_iterator_view)
+        assert [iterator[i] for i in range(len(iterator))] == list(dataset_iterator_view)
+        assert iterator.get_batch([1, 0]) == dataset_iterator_view.get_batch([1, 0])
+        assert list(iterator.get_column(2)) == list(dataset_iterator_view.get_column(2))
+        iterator.close()
+
+    def test_prefetching_dataset_iterator_shuffle(self, dataset_iterator: DatasetIteratorIF):
+        iterator = PrefetchingDatasetIterator(dataset_iterator, num_workers=2, shuffle=True, seed=1)
+        passes = [list(iterator) for _ in range(4)]
+        assert all(sorted(samples) == sorted(dataset_iterator) for samples in passes)
+        # each pass draws a new permutation
+        assert any(samples != passes[0] for samples in passes[1:])
+        # the index streams are reproducible given the seed
+        other_iterator = PrefetchingDatasetIterator(dataset_iterator, num_workers=2, shuffle=True, seed=1)
+        assert [list(other_iterator) for _ in range(4)] == passes
+        iterator.close()
+        other_iterator.close()
+
+    def test_prefetching_dataset_iterator_early_stop(self, dataset_iterator: DatasetIteratorIF, sequences):
+        iterator = PrefetchingDatasetIterator(dataset_iterator, num_workers=1, prefetch_size=2)
+        for index, sample in enumerate(iterator):
+            if index == 1:
+                break
+        assert sample == tuple(s[1] for s in sequences)
+        assert list(iterator) == list(zip(*sequences))
+        iterator.close()
+
+    def test_informed_prefetching_dataset_iterator(self, dataset_iterator: DatasetIteratorIF, sequences,
+                                                   target_position: int):
+        meta = MetaFactory.get_dataset_meta(identifier="id_1", iterator_meta=MetaFactory.get_iterator_meta(0, target_position, 2))
+        iterator = InformedDatasetFactory.get_prefetching_dataset_iterator(dataset_iterator, meta, num_workers=2)
+        assert list(iterator) == list(zip(*sequences))
+        assert list(iterator.get_targets()) == sequences[target_position]
+        assert iterator.underlying_iterators == [dataset_iterator]
+
+    def test_iter(self, dataset_iterator: DatasetIteratorIF, dataset_iterator_view: DatasetIteratorIF):
+        combined_iterator = CombinedDatasetIterator(iterators=[dataset_iterator_view, dataset_iterator, dataset_iterator_view])
+        nested_iterator = DatasetIteratorView(combined_iterator, indices=[6, 0, 3, 1, 8])
+        prefetching_iterator = PrefetchingDatasetIterator(combined_iterator, num_workers=2, indices=[7, 2, 5])
+        for iterator in [dataset_iterator, dataset_iterator_view, combined_iterator, nested_iterator,
+                         CompiledDatasetIterator(nested_iterator), InMemoryDatasetIterator(nested_iterator),
+                         prefetching_iterator]:
+            # the sequential fast path yields the same samples as random access
+            assert list(iterator) == [iterator[index] for index in range(len(iterator))]
+            with pytest.raises(IndexError):
+                iterator[len(iterator)]
+        prefetching_iterator.close()
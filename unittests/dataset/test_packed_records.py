@@ -0,0 +1,80 @@
+import os
+import pytest
+import torch
+import numpy as np
+from data_stack.dataset.iterator import DatasetIteratorIF, SequenceDatasetIterator
+from data_stack.dataset.packed_records import PackedRecordWriter, PackedRecordIterator, PackedRecords
+from data_stack.io.storage_connectors import StorageConnectorFactory, StorageConnector
+
+
+class TestPackedRecords:
+
+    @pytest.fixture
+    def dataset_iterator(self) -> DatasetIteratorIF:
+        samples = [torch.full((i % 7 + 1,), i) for i in range(500)]
+        targets = list(range(500))
+        tags = [f"tag_{i}" for i in range(500)]
+        return SequenceDatasetIterator(dataset_sequences=[samples, targets, tags])
+
+    @pytest.fixture
+    def storage_connector(self, tmp_folder_path: str) -> StorageConnector:
+        return StorageConnectorFactory.get_file_storage_connector(tmp_folder_path)
+
+    @staticmethod
+    def assert_samples_equal(sample, expected_sample):
+        assert torch.equal(sample[0], expected_sample[0])
+        assert sample[1:] == expected_sample[1:]
+
+    def test_random_access(self, storage_connector: StorageConnector, dataset_iterator: DatasetIteratorIF):
+        num_shards = PackedRecordWriter(storage_connector, max_shard_size=10000).write("packed", dataset_iterator)
+        assert num_shards > 1
+        packed_iterator = PackedRecordIterator(storage_connector, "packed")
+        assert len(packed_iterator) == len(dataset_iterator)
+        for index in np.random.RandomState(1).permutation(len(dataset_iterator)):
+            TestPackedRecords.assert_samples_equal(packed_iterator[int(index)], dataset_iterator[int(index)])
+        TestPackedRecords.assert_samples_equal(packed_iterator[-1], dataset_iterator[len(dataset_iterator) - 1])
+        with pytest.raises(IndexError):
+            packed_iterator[len(dataset_iterator)]
+
+    def test_streaming(self, storage_connector: StorageConnector, dataset_iterator: DatasetIteratorIF):
+        PackedRecordWriter(storage_connector, max_shard_size=10000).write("packed", dataset_iterator)
+        packed_iterator = PackedRecordIterator(storage_connector, "packed")
+        samples = list(packed_iterator)
+        assert len(samples) == len(dataset_iterator)
+        for index, sample in enumerate(samples):
+            TestPackedRecords.assert_samples_equal(sample, dataset_iterator[index])
+        packed_iterator.close()
+
+    def test_object_store(self, object_store_url: str, dataset_iterator: DatasetIteratorIF, monkeypatch):
+        storage_connector = StorageConnectorFactory.get_object_store_storage_connector(object_store_url, "test-bucket")
+        PackedRecordWriter(storage_connector, max_shard_size=10000).write("packed", dataset_iterator)
+        packed_iterator = PackedRecordIterator(storage_connector, "packed")
+        TestPackedRecords.assert_samples_equal(packed_iterator[123], dataset_iterator[123])
+        # the shards are streamed in small blocks, such that records span the block boundaries
+        monkeypatch.setattr(PackedRecordIterator, "READ_BLOCK_SIZE", 100)
+        for index, sample in enumerate(packed_iterator):
+            TestPackedRecords.assert_samples_equal(sample, dataset_iterator[index])
+
+    def test_mixed_backings(self, tmp_folder_path: str, storage_connector: StorageConnector,
+                            dataset_iterator: DatasetIteratorIF):
+        num_shards = PackedRecordWriter(storage_connector, max_shard_size=10000).write("packed", dataset_iterator)
+        # only the last (smallest) shard fits into the memory cache, the others are served from the disk cache
+        max_memory_bytes = storage_connector.get_resource_size(PackedRecords.get_shard_identifier("packed",
+                                                                                                  num_shards - 1))
+        caching_storage_connector = StorageConnectorFactory.get_caching_storage_connector(
+            storage_connector, os.path.join(tmp_folder_path, "cache"), max_memory_bytes=max_memory_bytes)
+        packed_iterator = PackedRecordIterator(caching_storage_connector, "packed")
+        backings = [mmap is not None for mmap in packed_iterator._mmaps]
+        assert any(backings) and not all(backings)
+        for index in [0, len(dataset_iterator) // 2, len(dataset_iterator) - 1]:
+            TestPackedRecords.assert_samples_equal(packed_iterator[index], dataset_iterator[index])
+        for index, sample in enumerate(packed_iterator):
+            TestPackedRecords.assert_samples_equal(sample, dataset_iterator[index])
+        packed_iterator.close()
+
+    def test_empty_dataset(self, storage_connector: StorageConnector):
+        dataset_iterator = SequenceDatasetIterator(dataset_sequences=[[], []])
+        assert PackedRecordWriter(storage_connector).write("packed", dataset_iterator) == 0
+        packed_iterator = PackedRecordIterator(storage_connector, "packed")
+        assert len(packed_iterator) == 0
+        assert list(packed_iterator) == []
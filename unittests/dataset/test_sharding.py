@@ -0,0 +1,121 @@
+import pytest
+import torch
+from collections import Counter
+from types import SimpleNamespace
+from data_stack.dataset.iterator import SequenceDatasetIterator, CombinedDatasetIterator
+from data_stack.dataset.sharding import ShardedDatasetIterator, worker_init_fn
+from data_stack.dataset.shuffle import FeistelPermutation
+from data_stack.dataset.factory import InformedDatasetFactory
+from data_stack.dataset.meta import MetaFactory
+
+
+class TestShardedDatasetIterator:
+
+    @pytest.fixture
+    def dataset_iterator(self) -> SequenceDatasetIterator:
+        return SequenceDatasetIterator(dataset_sequences=[list(range(23)), [i % 3 for i in range(23)]])
+
+    @staticmethod
+    def get_shards(dataset_iterator, world_size: int, num_workers: int, **kwargs):
+        return [ShardedDatasetIterator(dataset_iterator, world_size=world_size, rank=rank, num_workers=num_workers,
+                                       worker_id=worker_id, **kwargs)
+                for rank in range(world_size) for worker_id in range(num_workers)]
+
+    @pytest.mark.parametrize("contiguous", [False, True])
+    @pytest.mark.parametrize("shuffle", [False, True])
+    def test_drop_last(self, dataset_iterator: SequenceDatasetIterator, contiguous: bool, shuffle: bool):
+        shards = self.get_shards(dataset_iterator, 2, 3, contiguous=contiguous, shuffle=shuffle, drop_last=True)
+        samples = [sample for shard in shards for sample in shard]
+        assert all(len(shard) == 23 // 6 for shard in shards)
+        # the shards are disjoint
+        assert len(set(samples)) == len(samples) == 6 * (23 // 6)
+
+    @pytest.mark.parametrize("contiguous", [False, True])
+    @pytest.mark.parametrize("shuffle", [False, True])
+    def test_padding(self, dataset_iterator: SequenceDatasetIterator, contiguous: bool, shuffle: bool):
+        shards = self.get_shards(dataset_iterator, 2, 3, contiguous=contiguous, shuffle=shuffle)
+        samples = [sample for shard in shards for sample in shard]
+        assert all(len(shard) == 4 for shard in shards)
+        # every sample is covered and only the padding is repeated
+        counts = Counter(samples)
+        assert set(counts) == set(dataset_iterator)
+        assert sum(count - 1 for count in counts.values()) == 6 * 4 - 23
+
+    def test_partitioning(self, dataset_iterator: SequenceDatasetIterator):
+        strided = ShardedDatasetIterator(dataset_iterator, world_size=2, rank=1, num_workers=2, worker_id=1)
+        assert [sample[0] for sample in strided] == [3, 7, 11, 15, 19, 0]
+        contiguous = ShardedDatasetIterator(dataset_iterator, world_size=2, rank=1, num_workers=2, worker_id=1,
+                                            contiguous=True)
+        assert [sample[0] for sample in contiguous] == [18, 19, 20, 21, 22, 0]
+        with pytest.raises(ValueError):
+            ShardedDatasetIterator(dataset_iterator, world_size=2, rank=2)
+
+    @pytest.mark.parametrize("bijective", [False, True])
+    def test_epoch_reseeding(self, dataset_iterator: SequenceDatasetIterator, bijective: bool):
+        shards = self.get_shards(dataset_iterator, 2, 2, shuffle=True, seed=5, bijective=bijective, drop_last=True)
+        epochs = []
+        for epoch in range(2):
+            for shard in shards:
+                shard.set_epoch(epoch)
+            samples = [sample for shard in shards for sample in shard]
+            # all processes draw the same permutation, so the shards stay disjoint
+            assert len(set(samples)) == len(samples)
+            epochs.append(samples)
+        assert epochs[0] != epochs[1]
+        other_shards = self.get_shards(dataset_iterator, 2, 2, shuffle=True, seed=5, bijective=bijective,
+                                       drop_last=True, epoch=1)
+        assert [sample for shard in other_shards for sample in shard] == epochs[1]
+
+    def test_random_access(self, dataset_iterator: SequenceDatasetIterator):
+        shard = ShardedDatasetIterator(dataset_iterator, world_size=3, rank=2, shuffle=True, block_size=4)
+        samples = list(shard)
+        assert [shard[i] for i in range(len(shard))] == samples
+        assert shard[-1] == samples[-1]
+        with pytest.raises(IndexError):
+            shard[len(shard)]
+        values, _ = shard.get_batch([2, 0])
+        assert list(values) == [samples[2][0], samples[0][0]]
+        assert list(shard.get_column(1)) == [sample[1] for sample in samples]
+        _, _, source_indices = shard.flatten()
+        assert source_indices.tolist() == [sample[0] for sample in samples]
+
+    def test_informed_sharded_dataset_iterator(self, dataset_iterator: SequenceDatasetIterator):
+        meta = MetaFactory.get_dataset_meta(identifier="id_1", iterator_meta=MetaFactory.get_iterator_meta(0, 1, 1))
+        iterator = InformedDatasetFactory.get_sharded_dataset_iterator(dataset_iterator, meta, world_size=4, rank=1,
+                                                                      shuffle=True, seed=2)
+        first_epoch = list(iterator)
+        iterator.set_epoch(1)
+        assert len(iterator) == 6 and list(iterator) != first_epoch
+        assert list(iterator.get_targets()) == [sample[1] for sample in iterator]
+
+    def test_set_worker(self, dataset_iterator: SequenceDatasetIterator, monkeypatch):
+        meta = MetaFactory.get_dataset_meta(identifier="id_1", iterator_meta=MetaFactory.get_iterator_meta(0, 1, 1))
+        expected = ShardedDatasetIterator(dataset_iterator, world_size=2, rank=1, num_workers=3, worker_id=2)
+        shard = ShardedDatasetIterator(dataset_iterator, world_size=2, rank=1)
+        assert len(shard) == 12
+        shard.set_worker(3, 2)
+        assert shard.shard == expected.shard and list(shard) == list(expected)
+        with pytest.raises(ValueError):
+            shard.set_worker(3, 3)
+        # within a data loader worker, the worker is bound through the whole iterator graph
+        iterator = InformedDatasetFactory.get_sharded_dataset_iterator(dataset_iterator, meta, world_size=2, rank=1)
+        worker_info = SimpleNamespace(id=2, num_workers=3, dataset=iterator)
+        monkeypatch.setattr(torch.utils.data, "get_worker_info", lambda: worker_info)
+        worker_init_fn(2)
+        assert list(iterator) == list(expected)
+
+    def test_set_worker_combined(self, dataset_iterator: SequenceDatasetIterator):
+        other_iterator = SequenceDatasetIterator(dataset_sequences=[list(range(100, 110)), [0] * 10])
+        iterator = CombinedDatasetIterator([ShardedDatasetIterator(dataset_iterator),
+                                            ShardedDatasetIterator(other_iterator)])
+        iterator.set_worker(2, 0)
+        # the combined iterator recomputes its offsets for the shorter shards
+        expected = list(ShardedDatasetIterator(dataset_iterator, num_workers=2, worker_id=0)) + \
+            list(ShardedDatasetIterator(other_iterator, num_workers=2, worker_id=0))
+        assert len(iterator) == len(expected) == 17
+        assert [iterator[i] for i in range(len(iterator))] == list(iterator) == expected
+
+    def test_shuffle_is_bijective(self, dataset_iterator: SequenceDatasetIterator):
+        shard = ShardedDatasetIterator(dataset_iterator, world_size=2, shuffle=True)
+        # the permutation is computed per index instead of materializing it for all shards
+        assert isinstance(shard._shuffled_iterator.order, FeistelPermutation)
@@ -0,0 +1,104 @@
+import pytest
+import numpy as np
+from data_stack.dataset.iterator import SequenceDatasetIterator, InformedDatasetIterator, PrefetchingDatasetIterator, \
+    CompiledDatasetIterator
+from data_stack.dataset.shuffle import FeistelPermutation, get_permutation_array, EpochShuffledDatasetIterator
+from data_stack.dataset.transforms import MappedDatasetIterator, TransformStage
+from data_stack.dataset.factory import InformedDatasetFactory
+from data_stack.dataset.meta import MetaFactory
+
+
+class TestShuffle:
+
+    @pytest.fixture
+    def dataset_iterator(self) -> SequenceDatasetIterator:
+        return SequenceDatasetIterator(dataset_sequences=[list(range(100)), [i % 10 for i in range(100)]])
+
+    @pytest.mark.parametrize("length", [1, 2, 5, 16, 17, 1000])
+    @pytest.mark.parametrize("block_size", [None, 1, 7, 100])
+    def test_permutations(self, length: int, block_size: int):
+        permutation = FeistelPermutation(length, seed=[1, 2], block_size=block_size)
+        order = permutation[np.arange(length)]
+        # the vectorized and the per-index evaluation agree
+        assert order.tolist() == [permutation[i] for i in range(length)]
+        for order in [order, get_permutation_array(length, seed=[1, 2], block_size=block_size)]:
+            assert sorted(order.tolist()) == list(range(length))
+            assert order.dtype == np.int32
+            if block_size is not None:
+                # each full block is mapped to a single block, the partial block stays last
+                num_full = length // block_size * block_size
+                blocks = order[:num_full].reshape(-1, block_size) // block_size
+                assert np.all(blocks == blocks[:, :1])
+                assert np.all(order[num_full:] >= num_full)
+        with pytest.raises(IndexError):
+            permutation[length]
+
+    @pytest.mark.parametrize("bijective", [False, True])
+    def test_set_epoch(self, dataset_iterator: SequenceDatasetIterator, bijective: bool):
+        iterator = EpochShuffledDatasetIterator(dataset_iterator, seed=3, bijective=bijective)
+        epochs = []
+        for epoch in range(3):
+            iterator.set_epoch(epoch)
+            assert iterator.epoch == epoch
+            epochs.append(list(iterator))
+            assert sorted(epochs[-1]) == list(dataset_iterator)
+        assert epochs[0] != epochs[1] and epochs[1] != epochs[2]
+        # the order is reproducible given seed and epoch
+        other_iterator = EpochShuffledDatasetIterator(dataset_iterator, seed=3, bijective=bijective, epoch=1)
+        assert list(other_iterator) == epochs[1]
+        assert list(EpochShuffledDatasetIterator(dataset_iterator, seed=4, bijective=bijective, epoch=1)) != epochs[1]
+
+    @pytest.mark.parametrize("bijective", [False, True])
+    def test_random_access(self, dataset_iterator: SequenceDatasetIterator, bijective: bool):
+        iterator = EpochShuffledDatasetIterator(dataset_iterator, seed=3, block_size=8, bijective=bijective, epoch=2)
+        samples = list(iterator)
+        assert [iterator[i] for i in range(len(iterator))] == samples
+        assert iterator[-1] == samples[-1]
+        with pytest.raises(IndexError):
+            iterator[len(iterator)]
+        values, targets = iterator.get_batch([5, 0, -1])
+        assert list(values) == [samples[5][0], samples[0][0], samples[-1][0]]
+        assert list(iterator.get_column(1)) == [sample[1] for sample in samples]
+        sources, source_ids, source_indices = iterator.flatten()
+        assert sources == [dataset_iterator] and source_indices.tolist() == [sample[0] for sample in samples]
+
+    def test_informed_epoch_shuffled_dataset_iterator(self, dataset_iterator: SequenceDatasetIterator):
+        meta = MetaFactory.get_dataset_meta(identifier="id_1", iterator_meta=MetaFactory.get_iterator_meta(0, 1, 1))
+        iterator = InformedDatasetFactory.get_epoch_shuffled_dataset_iterator(dataset_iterator, meta, seed=1)
+        first_epoch = list(iterator)
+        iterator.set_epoch(1)
+        assert list(iterator) != first_epoch
+        assert list(iterator.get_targets()) == [sample[1] for sample in iterator]
+
+    def test_set_epoch_forwarding(self, dataset_iterator: SequenceDatasetIterator):
+        meta = MetaFactory.get_dataset_meta(identifier="id_1", iterator_meta=MetaFactory.get_iterator_meta(0, 1, 1))
+        # iterators that are not epoch-aware ignore the epoch
+        iterator = InformedDatasetIterator(dataset_iterator, meta)
+        iterator.set_epoch(1)
+        assert list(iterator) == list(dataset_iterator)
+        # the epoch reaches shuffled iterators nested below other iterators
+        shuffled_iterator = EpochShuffledDatasetIterator(dataset_iterator, seed=1)
+        mapped_iterator = MappedDatasetIterator(shuffled_iterator, [TransformStage(lambda x: -x, position=0)])
+        iterator = InformedDatasetIterator(mapped_iterator, meta)
+        first_epoch = list(iterator)
+        iterator.set_epoch(1)
+        assert shuffled_iterator.epoch == 1
+        assert list(iterator) != first_epoch
+
+    @pytest.mark.parametrize("use_processes", [False, True])
+    def test_prefetching_set_epoch(self, dataset_iterator: SequenceDatasetIterator, use_processes: bool):
+        shuffled_iterator = EpochShuffledDatasetIterator(dataset_iterator, seed=1)
+        with PrefetchingDatasetIterator(shuffled_iterator, num_workers=2, use_processes=use_processes) as iterator:
+            assert list(iterator) == list(shuffled_iterator)
+            iterator.set_epoch(1)
+            # the workers load the samples in the order of the new epoch
+            expected = list(EpochShuffledDatasetIterator(dataset_iterator, seed=1, epoch=1))
+            assert list(iterator) == expected
+
+    def test_compiled_set_epoch(self, dataset_iterator: SequenceDatasetIterator):
+        shuffled_iterator = EpochShuffledDatasetIterator(dataset_iterator, seed=1)
+        iterator = CompiledDatasetIterator(shuffled_iterator)
+        first_epoch = list(iterator)
+        iterator.set_epoch(1)
+        # the mapping is recompiled for the new order
+        assert list(iterator) == list(shuffled_iterator) != first_epoch
@@ -180,3 +180,15 @@ class TestSplitter:
 
         assert splits_indices_1[0] == splits_indices_2[0] and splits_indices_1[1] == splits_indices_2[1]
         assert splits_indices_1[0] != splits_indices_3[0] and splits_indices_1[1] != splits_indices_3[1]
+
+    def test_splitters_use_target_column(self, big_dataset_iterator: DatasetIteratorIF):
+        class ColumnOnlyDatasetIterator(SequenceDatasetIterator):
+            def __getitem__(self, index: int):
+                raise AssertionError("Samples must not be evaluated to determine the targets.")
+
+        iterator = ColumnOnlyDatasetIterator(dataset_sequences=[big_dataset_iterator.get_column(0),
+                                                                np.array(big_dataset_iterator.get_column(1))])
+        assert len(StratifiedSplitterImpl(ratios=[0.5, 0.5], seed=1).get_indices(iterator)) == 2
+        assert len(CVSplitterImpl(num_folds=5).get_indices(iterator)) == 5
+        outer_folds_indices, _ = NestedCVSplitterImpl(num_outer_loop_folds=5, num_inner_loop_folds=2).get_indices(iterator)
+        assert len(outer_folds_indices) == 5
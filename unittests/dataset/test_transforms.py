@@ -0,0 +1,125 @@
+import pytest
+import numpy as np
+import torch
+from typing import List
+from data_stack.dataset.iterator import SequenceDatasetIterator, DatasetIteratorView, CombinedDatasetIterator
+from data_stack.dataset.shuffle import EpochShuffledDatasetIterator
+from data_stack.dataset.transforms import TransformStage, MappedDatasetIterator, LRUTransformMemo, \
+    StorageTransformMemo
+from data_stack.dataset.factory import InformedDatasetFactory
+from data_stack.dataset.meta import MetaFactory
+from data_stack.io.storage_connectors import StorageConnectorFactory
+
+
+class CountingTransform:
+
+    def __init__(self, transform):
+        self.transform = transform
+        self.num_calls = 0
+
+    def __call__(self, x):
+        self.num_calls += 1
+        return self.transform(x)
+
+
+class TestMappedDatasetIterator:
+
+    @pytest.fixture
+    def dataset_iterator(self) -> SequenceDatasetIterator:
+        samples = [torch.full((2,), float(i)) for i in range(10)]
+        return SequenceDatasetIterator(dataset_sequences=[samples, list(range(10))])
+
+    @pytest.fixture
+    def stages(self) -> List[TransformStage]:
+        normalize = TransformStage(CountingTransform(lambda x: x / 10), position=0, cacheable=True)
+        shift = TransformStage(CountingTransform(lambda x: x + 1), position=0, batch_transform=lambda x: x + 1)
+        return [normalize, shift]
+
+    def test_lazy_transform(self, dataset_iterator: SequenceDatasetIterator, stages: List[TransformStage]):
+        iterator = MappedDatasetIterator(dataset_iterator, stages)
+        assert stages[0].transform.num_calls == 0
+        assert len(iterator) == len(dataset_iterator)
+        for index, (sample, target) in enumerate(iterator):
+            assert torch.equal(sample, torch.full((2,), index / 10 + 1)) and target == index
+        assert torch.equal(iterator[-1][0], iterator[9][0])
+        with pytest.raises(IndexError):
+            iterator[10]
+        # without memo, deterministic stages are recomputed
+        assert stages[0].transform.num_calls == 12
+
+    @pytest.mark.parametrize("memo_type", ["lru", "storage"])
+    def test_memo(self, dataset_iterator: SequenceDatasetIterator, stages: List[TransformStage], memo_type: str,
+                  tmp_folder_path: str):
+        if memo_type == "lru":
+            memo = LRUTransformMemo(max_size=100)
+        else:
+            memo = StorageTransformMemo(StorageConnectorFactory.get_file_storage_connector(tmp_folder_path), "memo")
+        iterator = MappedDatasetIterator(dataset_iterator, stages, memo)
+        expected = [sample for sample in MappedDatasetIterator(dataset_iterator, stages)]
+        stages[0].transform.num_calls = stages[1].transform.num_calls = 0
+        for _ in range(3):
+            for (sample, target), (expected_sample, expected_target) in zip(iterator, expected):
+                assert torch.equal(sample, expected_sample) and target == expected_target
+        # the cacheable stage runs once per sample, the subsequent stage every time
+        assert stages[0].transform.num_calls == len(dataset_iterator)
+        assert stages[1].transform.num_calls == 3 * len(dataset_iterator)
+        if memo_type == "storage":
+            # the memo survives across iterators
+            other_iterator = MappedDatasetIterator(dataset_iterator, stages, memo)
+            assert torch.equal(other_iterator[3][0], expected[3][0])
+            assert stages[0].transform.num_calls == len(dataset_iterator)
+
+    def test_memo_set_epoch(self, dataset_iterator: SequenceDatasetIterator, stages: List[TransformStage]):
+        shuffled_iterator = EpochShuffledDatasetIterator(CombinedDatasetIterator([dataset_iterator, dataset_iterator]),
+                                                         seed=1)
+        iterator = MappedDatasetIterator(shuffled_iterator, stages, LRUTransformMemo(max_size=100))
+        for epoch in range(2):
+            iterator.set_epoch(epoch)
+            expected = list(MappedDatasetIterator(shuffled_iterator, stages))
+            stages[0].transform.num_calls = 0
+            # the memoized samples follow the order of the current epoch
+            for (sample, target), (expected_sample, expected_target) in zip(iterator, expected):
+                assert torch.equal(sample, expected_sample) and target == expected_target
+            # the memo is keyed by the source samples, which are shared by both copies and across epochs
+            assert stages[0].transform.num_calls == (len(dataset_iterator) if epoch == 0 else 0)
+
+    def test_lru_memo_eviction(self):
+        memo = LRUTransformMemo(max_size=2)
+        memo.store(0, "a")
+        memo.store(1, "b")
+        assert memo.lookup(0) == (True, "a")
+        memo.store(2, "c")
+        # 1 has been the least recently used one
+        assert memo.lookup(1) == (False, None)
+        assert memo.lookup(0) == (True, "a") and memo.lookup(2) == (True, "c")
+        assert len(memo) == 2
+
+    @pytest.mark.parametrize("use_memo", [False, True])
+    def test_get_batch(self, dataset_iterator: SequenceDatasetIterator, stages: List[TransformStage], use_memo: bool):
+        memo = LRUTransformMemo(max_size=100) if use_memo else None
+        iterator = MappedDatasetIterator(dataset_iterator, stages, memo)
+        samples, targets = iterator.get_batch([3, 1, -1])
+        assert torch.equal(samples, torch.stack([iterator[i][0] for i in [3, 1, 9]]))
+        assert list(targets) == [3, 1, 9]
+        # the vectorized shift replaces the per-sample one
+        num_calls = stages[1].transform.num_calls
+        iterator.get_batch([0, 1, 2])
+        assert stages[1].transform.num_calls == num_calls
+
+    def test_whole_sample_transform(self, dataset_iterator: SequenceDatasetIterator):
+        swap = TransformStage(lambda sample: (sample[1], sample[0]), batch_transform=lambda batch: (batch[1], batch[0]))
+        iterator = MappedDatasetIterator(DatasetIteratorView(dataset_iterator, indices=[4, 2]), [swap])
+        assert [sample[0] for sample in iterator] == [4, 2]
+        targets, samples = iterator.get_batch([1, 0])
+        assert list(targets) == [2, 4] and len(samples) == 2
+        assert list(iterator.get_column(0)) == [4, 2]
+
+    def test_informed_mapped_dataset_iterator(self, dataset_iterator: SequenceDatasetIterator,
+                                              stages: List[TransformStage]):
+        meta = MetaFactory.get_dataset_meta(identifier="id_1", iterator_meta=MetaFactory.get_iterator_meta(0, 1, 1))
+        iterator = InformedDatasetFactory.get_mapped_dataset_iterator(dataset_iterator, meta, stages)
+        num_calls = stages[0].transform.num_calls
+        # the targets are not touched by any stage, so no sample is transformed
+        assert list(iterator.get_targets()) == list(range(10))
+        assert stages[0].transform.num_calls == num_calls
+        assert np.allclose(iterator[5][0].numpy(), 1.5)
@@ -0,0 +1,36 @@
+from data_stack.io.array_io import ArrayIO
+from data_stack.io.storage_connectors import StorageConnectorFactory, StorageConnector
+import numpy as np
+import pytest
+
+
+class TestArrayIO:
+
+    @pytest.fixture
+    def storage_connector(self, tmp_folder_path: str) -> StorageConnector:
+        return StorageConnectorFactory.get_file_storage_connector(tmp_folder_path)
+
+    @pytest.fixture
+    def array(self) -> np.ndarray:
+        return np.arange(60, dtype=np.float32).reshape(5, 3, 4)
+
+    def test_memory_mapped_roundtrip(self, storage_connector: StorageConnector, array: np.ndarray):
+        storage_connector.set_resource("arrays/a.npy", ArrayIO.to_streamed_resource("arrays/a.npy", array))
+        with storage_connector.get_resource("arrays/a.npy") as resource:
+            loaded = ArrayIO.from_streamed_resource(resource)
+        assert isinstance(loaded, np.memmap)
+        assert loaded.dtype == array.dtype and loaded.shape == array.shape
+        assert np.array_equal(loaded, array)
+
+    def test_in_memory_roundtrip(self, array: np.ndarray):
+        resource = ArrayIO.to_streamed_resource("a.npy", array)
+        loaded = ArrayIO.from_streamed_resource(resource)
+        assert not isinstance(loaded, np.memmap)
+        assert np.array_equal(loaded, array)
+
+    def test_empty_array(self, storage_connector: StorageConnector):
+        array = np.empty((0, 28, 28), dtype=np.float32)
+        storage_connector.set_resource("empty.npy", ArrayIO.to_streamed_resource("empty.npy", array))
+        with storage_connector.get_resource("empty.npy") as resource:
+            loaded = ArrayIO.from_streamed_resource(resource)
+        assert loaded.shape == (0, 28, 28)
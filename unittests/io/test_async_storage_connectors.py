@@ -0,0 +1,39 @@
+from data_stack.io.async_storage_connectors import AsyncStorageConnectorFactory, ExecutorStorageConnector, \
+    AsyncStorageConnector
+from data_stack.io.storage_connectors import StorageConnectorFactory
+from data_stack.exception import ResourceNotFoundError
+import pytest
+import asyncio
+import io
+
+
+class TestExecutorStorageConnector:
+
+    @pytest.fixture
+    @pytest.mark.usefixtures("tmp_folder_path")
+    def storage_connector(self, tmp_folder_path: str) -> AsyncStorageConnector:
+        return AsyncStorageConnectorFactory.get_executor_storage_connector(
+            StorageConnectorFactory.get_file_storage_connector(tmp_folder_path))
+
+    def test_factory(self, storage_connector: AsyncStorageConnector):
+        assert isinstance(storage_connector, ExecutorStorageConnector)
+
+    def test_set_get_resource(self, storage_connector: AsyncStorageConnector):
+        async def run():
+            contents = {f"resources/{i}": bytes([i]) * (1000 + i) for i in range(16)}
+            # all resources are written concurrently
+            await asyncio.gather(*[storage_connector.set_resource(identifier, io.BytesIO(content))
+                                   for identifier, content in contents.items()])
+            for identifier, content in contents.items():
+                assert await storage_connector.has_resource(identifier)
+                assert await storage_connector.get_resource_size(identifier) == len(content)
+                with await storage_connector.get_resource(identifier) as resource:
+                    assert resource.read() == content
+            await storage_connector.delete_resource("resources/0")
+            assert not await storage_connector.has_resource("resources/0")
+
+        asyncio.run(run())
+
+    def test_get_resource_404(self, storage_connector: AsyncStorageConnector):
+        with pytest.raises(ResourceNotFoundError):
+            asyncio.run(storage_connector.get_resource("xxxxxxxx"))
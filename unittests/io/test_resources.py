@@ -1,4 +1,8 @@
-from data_stack.io.resources import StreamedResource, StreamedTextResource
+from data_stack.io.resources import StreamedResource, StreamedTextResource, ResourceFactory, IteratorStream
+from data_stack.exception import DatasetFileCorruptError
+import hashlib
+import gzip
+import io
 import os
 import tempfile
 import pytest
@@ -69,3 +73,82 @@ class TestStreamedTextResource(BaseTest):
     def test_from_streamed_resouce(self, streamed_resource: StreamedResource, encoding: str, content: str):
         streamed_text_resource = StreamedTextResource.from_streamed_resouce(streamed_resource, encoding=encoding)
         assert streamed_text_resource.read() == content
+
+
+class TestVerifiedStreamedResource(BaseTest):
+
+    def test_verified_resource(self, path_to_random_bin_file: str, content: str):
+        md5_sum = hashlib.md5(content.encode()).hexdigest()
+        with open(path_to_random_bin_file, "rb") as fd:
+            resource = ResourceFactory.get_verified_resource("my_resource", fd, md5_sum=md5_sum, chunk_size=100)
+            assert b"".join(resource) == content.encode()
+            assert resource.num_bytes == len(content)
+
+    def test_corrupt_resource(self, path_to_random_bin_file: str):
+        with open(path_to_random_bin_file, "rb") as fd:
+            resource = ResourceFactory.get_verified_resource("my_resource", fd, md5_sum="0" * 32)
+            with pytest.raises(DatasetFileCorruptError):
+                b"".join(resource)
+
+
+class TestChunkedIteration(BaseTest):
+
+    @pytest.fixture
+    def file_size(self) -> int:
+        return 3 * 1024 * 1024 + 17
+
+    def test_adaptive_chunk_size(self, path_to_random_bin_file: str, content: str):
+        with open(path_to_random_bin_file, "rb") as fd:
+            chunk_sizes = [len(chunk) for chunk in StreamedResource("my_resource", fd)]
+        assert sum(chunk_sizes) == len(content)
+        assert chunk_sizes[0] == StreamedResource.MIN_CHUNK_SIZE and chunk_sizes[1] == 2 * StreamedResource.MIN_CHUNK_SIZE
+
+    @pytest.mark.parametrize("chunk_size", [None, 1000])
+    def test_iter_into(self, path_to_random_bin_file: str, content: str, chunk_size: int):
+        with open(path_to_random_bin_file, "rb") as fd:
+            resource = StreamedResource("my_resource", fd, chunk_size=chunk_size)
+            views = []
+            for view in resource.iter_into():
+                assert isinstance(view, memoryview)
+                views.append(bytes(view))
+        assert b"".join(views) == content.encode()
+        if chunk_size is not None:
+            assert all(len(view) == chunk_size for view in views[:-1])
+
+    def test_iter_into_buffer_size(self, path_to_random_bin_file: str):
+        # small resources do not allocate a buffer of the maximum chunk size
+        views = list(StreamedResource("my_resource", io.BytesIO(b"abc")).iter_into())
+        assert len(views) == 1 and len(views[0].obj) == StreamedResource.MIN_CHUNK_SIZE
+        # the buffer grows along with the adaptive chunk size
+        with open(path_to_random_bin_file, "rb") as fd:
+            buffer_sizes = [len(view.obj) for view in StreamedResource("my_resource", fd).iter_into()]
+        with open(path_to_random_bin_file, "rb") as fd:
+            assert buffer_sizes[:-1] == [len(chunk) for chunk in StreamedResource("my_resource", fd)][:-1]
+
+    def test_verified_iter_into(self, path_to_random_bin_file: str, content: str):
+        with open(path_to_random_bin_file, "rb") as fd:
+            resource = ResourceFactory.get_verified_resource("my_resource", fd, md5_sum="0" * 32)
+            assert not resource.allows_direct_copy
+            with pytest.raises(DatasetFileCorruptError):
+                for _ in resource.iter_into():
+                    pass
+
+    def test_file_backed(self, path_to_random_bin_file: str):
+        with open(path_to_random_bin_file, "rb") as fd:
+            assert StreamedResource("my_resource", fd).is_file_backed
+            # the file descriptor of a gzip stream refers to the compressed file
+            assert not StreamedResource("my_resource", gzip.GzipFile(fileobj=fd)).is_file_backed
+        assert not StreamedResource("my_resource", io.BytesIO(b"abc")).is_file_backed
+
+    def test_iterator_stream(self, content: str):
+        def iter_chunks():
+            # the same buffer is reused for every chunk
+            chunk = bytearray(1000)
+            data = content.encode()
+            for start in range(0, len(data), len(chunk)):
+                num_bytes = len(data[start:start + len(chunk)])
+                chunk[:num_bytes] = data[start:start + num_bytes]
+                yield memoryview(chunk)[:num_bytes]
+
+        resource = ResourceFactory.get_resource("my_resource", IteratorStream(iter_chunks()), chunk_size=300)
+        assert b"".join(bytes(view) for view in resource.iter_into()) == content.encode()
@@ -1,11 +1,17 @@
-from data_stack.io.retriever import RetrieverFactory, HTTPRetrieverImpl, Retriever
+from data_stack.io.retriever import RetrieverFactory, HTTPRetrieverImpl, PooledHTTPRetrieverImpl, Retriever
 from data_stack.io.storage_connectors import StorageConnectorFactory, StorageConnector
 from data_stack.io.resources import StreamedResource
 import pytest
 import hashlib
 import tempfile
 import os
+import io
+import asyncio
+import socket
+import urllib.error
 from data_stack.io.resource_definition import ResourceDefinition
+from data_stack.exception import DatasetFileCorruptError
+from typing import List
 
 
 class TestBaseRetriever:
@@ -75,8 +81,247 @@ class TestRetriever(TestBaseRetriever):
     #         md5_sum = TestBaseRetriever.get_md5(fd)
     #     return md5_sum == http_retrieval_job.md5_sum
 
+    @pytest.fixture
+    def http_retrieval_jobs(self, http_server_root: str, http_server_url: str) -> List[ResourceDefinition]:
+        retrieval_jobs = []
+        for i in range(8):
+            content = os.urandom(100000 + i)
+            # all files share the same name, but are located in different folders
+            os.makedirs(os.path.join(http_server_root, str(i)))
+            with open(os.path.join(http_server_root, str(i), "data.bin"), "wb") as fd:
+                fd.write(content)
+            retrieval_jobs.append(ResourceDefinition(identifier=f"resources/{i}",
+                                                     source=f"{http_server_url}/{i}/data.bin",
+                                                     md5_sum=hashlib.md5(content).hexdigest()))
+        return retrieval_jobs
+
+    @pytest.mark.parametrize("num_workers", [1, 4])
+    def test_http_retriever_retrieve_local(self, storage_connector: StorageConnector, http_retrieval_jobs: List[ResourceDefinition],
+                                           num_workers: int):
+        http_retriever = RetrieverFactory.get_http_retriever(storage_connector, num_workers=num_workers)
+        identifiers = http_retriever.retrieve(http_retrieval_jobs)
+        assert identifiers == [retrieval_job.identifier for retrieval_job in http_retrieval_jobs]
+        for retrieval_job in http_retrieval_jobs:
+            resource = storage_connector.get_resource(retrieval_job.identifier)
+            assert TestBaseRetriever.get_md5(resource) == retrieval_job.md5_sum
+        statistics = http_retriever.retriever_impl.download_statistics
+        assert sorted(s.source for s in statistics) == sorted(job.source for job in http_retrieval_jobs)
+        assert all(s.num_bytes > 0 and s.throughput > 0 for s in statistics)
+
+    def test_http_retriever_corrupt_file(self, storage_connector: StorageConnector, http_retrieval_jobs: List[ResourceDefinition]):
+        http_retrieval_jobs[3].md5_sum = "0" * 32
+        http_retriever = RetrieverFactory.get_http_retriever(storage_connector, num_workers=4)
+        with pytest.raises(DatasetFileCorruptError):
+            http_retriever.retrieve(http_retrieval_jobs)
+        # corrupt resources are never committed to the storage
+        assert not storage_connector.has_resource(http_retrieval_jobs[3].identifier)
+        assert not [f for f in os.listdir(os.path.join(storage_connector.root_path, "resources")) if f.endswith(".tmp")]
+
+    @pytest.fixture
+    def large_http_retrieval_job(self, http_server_root: str, http_server_url: str) -> ResourceDefinition:
+        content = os.urandom(1000003)
+        with open(os.path.join(http_server_root, "large.bin"), "wb") as fd:
+            fd.write(content)
+        return ResourceDefinition(identifier="resources/large", source=f"{http_server_url}/large.bin",
+                                  md5_sum=hashlib.md5(content).hexdigest())
+
+    @staticmethod
+    def assert_retrieved(storage_connector: StorageConnector, retrieval_job: ResourceDefinition):
+        resource = storage_connector.get_resource(retrieval_job.identifier)
+        assert TestBaseRetriever.get_md5(resource) == retrieval_job.md5_sum
+        assert not storage_connector.has_resource(HTTPRetrieverImpl._get_partial_identifier(retrieval_job.identifier))
+
+    def test_http_retriever_resume_dropped_connection(self, storage_connector: StorageConnector, http_server,
+                                                      large_http_retrieval_job: ResourceDefinition):
+        http_server.drop_after["/large.bin"] = 300000
+        http_retriever_impl = HTTPRetrieverImpl(storage_connector, chunk_size=4096)
+        http_retriever_impl.retrieve([large_http_retrieval_job])
+        TestRetriever.assert_retrieved(storage_connector, large_http_retrieval_job)
+        assert [r for _, _, r in http_server.requests] == [None, "bytes=300000-"]
+        assert http_retriever_impl.download_statistics[0].num_bytes == 1000003
+
+    @pytest.mark.parametrize("support_ranges", [True, False])
+    def test_http_retriever_resume_partial_resource(self, storage_connector: StorageConnector, http_server, http_server_root: str,
+                                                    large_http_retrieval_job: ResourceDefinition, support_ranges: bool):
+        http_server.support_ranges = support_ranges
+        with open(os.path.join(http_server_root, "large.bin"), "rb") as fd:
+            partial_content = fd.read(123456)
+        # partial resource left behind by a previous run
+        storage_connector.set_resource(HTTPRetrieverImpl._get_partial_identifier(large_http_retrieval_job.identifier),
+                                       io.BytesIO(partial_content))
+        http_retriever_impl = HTTPRetrieverImpl(storage_connector)
+        http_retriever_impl.retrieve([large_http_retrieval_job])
+        TestRetriever.assert_retrieved(storage_connector, large_http_retrieval_job)
+        expected_num_bytes = 1000003 - 123456 if support_ranges else 1000003
+        assert http_retriever_impl.download_statistics[0].num_bytes == expected_num_bytes
+
+    def test_http_retriever_segmented(self, storage_connector: StorageConnector, http_server,
+                                      large_http_retrieval_job: ResourceDefinition):
+        http_server.drop_after["/large.bin"] = 1000
+        http_retriever_impl = HTTPRetrieverImpl(storage_connector, num_segments=4, min_segment_size=1024)
+        http_retriever_impl.retrieve([large_http_retrieval_job])
+        TestRetriever.assert_retrieved(storage_connector, large_http_retrieval_job)
+        ranges = sorted(r for method, _, r in http_server.requests if method == "GET")
+        # four segments, one of which was resumed after the dropped connection
+        assert len(ranges) == 5 and all(r.startswith("bytes=") for r in ranges)
+        for segment in range(4):
+            assert not storage_connector.has_resource(HTTPRetrieverImpl._get_partial_identifier(large_http_retrieval_job.identifier, segment))
+
+    @pytest.mark.parametrize("num_segments", [1, 4])
+    def test_http_retriever_corrupt_partial(self, storage_connector: StorageConnector, large_http_retrieval_job: ResourceDefinition,
+                                            num_segments: int):
+        large_http_retrieval_job.md5_sum = "0" * 32
+        http_retriever_impl = HTTPRetrieverImpl(storage_connector, num_segments=num_segments, min_segment_size=1024)
+        with pytest.raises(DatasetFileCorruptError):
+            http_retriever_impl.retrieve([large_http_retrieval_job])
+        assert not os.listdir(os.path.join(storage_connector.root_path, "resources"))
+
     def test_file_retriever_retrieve(self, file_retriever: Retriever, file_retrieval_job: ResourceDefinition):
         file_retriever.retrieve([file_retrieval_job])
         storage_connector = file_retriever.retriever_impl.storage_connector
         resource = storage_connector.get_resource(file_retrieval_job.identifier)
         assert TestBaseRetriever.get_md5(resource) == file_retrieval_job.md5_sum
+
+    def test_http_retriever_skips_verified_resources(self, storage_connector: StorageConnector, http_server,
+                                                     http_retrieval_jobs: List[ResourceDefinition]):
+        RetrieverFactory.get_http_retriever(storage_connector, num_workers=4).retrieve(http_retrieval_jobs)
+        num_requests = len(http_server.requests)
+        http_retriever = RetrieverFactory.get_http_retriever(storage_connector, num_workers=4)
+        http_retriever.retrieve(http_retrieval_jobs)
+        assert len(http_server.requests) == num_requests
+        assert not http_retriever.retriever_impl.download_statistics
+
+    @pytest.fixture
+    def file_retrieval_jobs(self) -> List[ResourceDefinition]:
+        with tempfile.TemporaryDirectory() as source_folder:
+            retrieval_jobs = []
+            for i in range(8):
+                content = os.urandom(10000 + i)
+                with open(os.path.join(source_folder, f"{i}.bin"), "wb") as fd:
+                    fd.write(content)
+                retrieval_jobs.append(ResourceDefinition(identifier=f"resources/{i}",
+                                                         source=os.path.join(source_folder, f"{i}.bin"),
+                                                         md5_sum=hashlib.md5(content).hexdigest()))
+            yield retrieval_jobs
+
+    @pytest.mark.parametrize("num_workers", [1, 4])
+    def test_file_retriever_manifest(self, storage_connector: StorageConnector, file_retrieval_jobs: List[ResourceDefinition],
+                                     num_workers: int):
+        RetrieverFactory.get_file_retriever(storage_connector, num_workers=num_workers).retrieve(file_retrieval_jobs)
+        for retrieval_job in file_retrieval_jobs:
+            assert storage_connector.get_verified_checksum(retrieval_job.identifier) == retrieval_job.md5_sum
+            # the sources are not touched again, once the resources have been verified
+            os.remove(retrieval_job.source)
+        identifiers = RetrieverFactory.get_file_retriever(storage_connector, num_workers=num_workers).retrieve(file_retrieval_jobs)
+        assert identifiers == [retrieval_job.identifier for retrieval_job in file_retrieval_jobs]
+
+    def test_file_retriever_deep_verify(self, storage_connector: StorageConnector, file_retrieval_jobs: List[ResourceDefinition]):
+        RetrieverFactory.get_file_retriever(storage_connector).retrieve(file_retrieval_jobs)
+        # tamper with a resource without changing its size and modification time
+        resource_path = os.path.join(storage_connector.root_path, file_retrieval_jobs[0].identifier)
+        stat = os.stat(resource_path)
+        with open(resource_path, "r+b") as fd:
+            content = fd.read()
+            fd.seek(0)
+            fd.write(bytes([content[0] ^ 0xFF]) + content[1:])
+        os.utime(resource_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert storage_connector.get_verified_checksum(file_retrieval_jobs[0].identifier) == file_retrieval_jobs[0].md5_sum
+        # deep verification rehashes the resources and retrieves the tampered one again
+        RetrieverFactory.get_file_retriever(storage_connector, num_workers=4, deep_verify=True).retrieve(file_retrieval_jobs)
+        with storage_connector.get_resource(file_retrieval_jobs[0].identifier) as resource:
+            assert TestBaseRetriever.get_md5(resource) == file_retrieval_jobs[0].md5_sum
+
+    def test_manifest_invalidated_on_change(self, storage_connector: StorageConnector, file_retrieval_jobs: List[ResourceDefinition]):
+        RetrieverFactory.get_file_retriever(storage_connector).retrieve(file_retrieval_jobs)
+        identifier = file_retrieval_jobs[0].identifier
+        storage_connector.append_resource(identifier, io.BytesIO(b"more"))
+        assert storage_connector.get_verified_checksum(identifier) is None
+
+    def test_async_http_retriever(self, storage_connector: StorageConnector, http_retrieval_jobs: List[ResourceDefinition]):
+        async def run():
+            ticks = 0
+            retrieval = asyncio.ensure_future(
+                RetrieverFactory.get_async_http_retriever(storage_connector, max_concurrency=4).retrieve(http_retrieval_jobs))
+            # the event loop stays responsive while the resources are retrieved
+            while not retrieval.done():
+                ticks += 1
+                await asyncio.sleep(0)
+            return await retrieval, ticks
+
+        identifiers, ticks = asyncio.run(run())
+        assert identifiers == [retrieval_job.identifier for retrieval_job in http_retrieval_jobs]
+        assert ticks > 0
+        for retrieval_job in http_retrieval_jobs:
+            resource = storage_connector.get_resource(retrieval_job.identifier)
+            assert TestBaseRetriever.get_md5(resource) == retrieval_job.md5_sum
+
+    def test_async_http_retriever_corrupt_file(self, storage_connector: StorageConnector,
+                                               http_retrieval_jobs: List[ResourceDefinition]):
+        http_retrieval_jobs[3].md5_sum = "0" * 32
+        async_retriever = RetrieverFactory.get_async_http_retriever(storage_connector, max_concurrency=4)
+        with pytest.raises(DatasetFileCorruptError):
+            asyncio.run(async_retriever.retrieve(http_retrieval_jobs))
+        assert not storage_connector.has_resource(http_retrieval_jobs[3].identifier)
+        assert storage_connector.has_resource(http_retrieval_jobs[4].identifier)
+
+    def test_async_file_retriever(self, storage_connector: StorageConnector, file_retrieval_jobs: List[ResourceDefinition]):
+        async_retriever = RetrieverFactory.get_async_file_retriever(storage_connector)
+        identifiers = asyncio.run(async_retriever.retrieve(file_retrieval_jobs))
+        assert identifiers == [retrieval_job.identifier for retrieval_job in file_retrieval_jobs]
+        for retrieval_job in file_retrieval_jobs:
+            assert storage_connector.get_verified_checksum(retrieval_job.identifier) == retrieval_job.md5_sum
+
+    def test_async_retriever_per_resource(self, storage_connector: StorageConnector,
+                                          file_retrieval_jobs: List[ResourceDefinition], monkeypatch):
+        async_retriever = RetrieverFactory.get_async_file_retriever(storage_connector)
+
+        def retrieve(retrieval_jobs):
+            raise AssertionError("The batch retrieval spawns its own thread pool.")
+
+        # each resource is retrieved by the per-resource primitive in the async retriever's threads
+        monkeypatch.setattr(async_retriever.retriever_impl, "retrieve", retrieve)
+        identifiers = asyncio.run(async_retriever.retrieve(file_retrieval_jobs))
+        assert identifiers == [retrieval_job.identifier for retrieval_job in file_retrieval_jobs]
+
+    @pytest.mark.parametrize("num_workers", [1, 4])
+    def test_pooled_http_retriever(self, storage_connector: StorageConnector, http_retrieval_jobs: List[ResourceDefinition],
+                                   num_workers: int):
+        http_retriever = RetrieverFactory.get_pooled_http_retriever(storage_connector, num_workers=num_workers,
+                                                                    pool_size=num_workers)
+        identifiers = http_retriever.retrieve(http_retrieval_jobs)
+        assert identifiers == [retrieval_job.identifier for retrieval_job in http_retrieval_jobs]
+        for retrieval_job in http_retrieval_jobs:
+            resource = storage_connector.get_resource(retrieval_job.identifier)
+            assert TestBaseRetriever.get_md5(resource) == retrieval_job.md5_sum
+        statistics = http_retriever.retriever_impl.connection_pool.statistics
+        assert statistics.num_requests == len(http_retrieval_jobs)
+        assert statistics.num_connections_created <= num_workers
+        assert statistics.num_connections_reused == len(http_retrieval_jobs) - statistics.num_connections_created
+
+    def test_pooled_http_retriever_resume_dropped_connection(self, storage_connector: StorageConnector, http_server,
+                                                             large_http_retrieval_job: ResourceDefinition):
+        http_server.drop_after["/large.bin"] = 100000
+        http_retriever_impl = PooledHTTPRetrieverImpl(storage_connector)
+        http_retriever_impl.retrieve([large_http_retrieval_job])
+        resource = storage_connector.get_resource(large_http_retrieval_job.identifier)
+        assert TestBaseRetriever.get_md5(resource) == large_http_retrieval_job.md5_sum
+        # the dropped connection is not returned to the pool
+        assert http_retriever_impl.connection_pool.statistics.num_connections_created == 2
+
+    def test_pooled_http_retriever_stale_connection(self, storage_connector: StorageConnector,
+                                                    http_retrieval_jobs: List[ResourceDefinition]):
+        http_retriever_impl = PooledHTTPRetrieverImpl(storage_connector)
+        http_retriever_impl.retrieve(http_retrieval_jobs[:1])
+        # the server closes the idle connection, such that the next request has to reconnect
+        for idle_connections in http_retriever_impl.connection_pool._idle_connections.values():
+            for connection, _ in idle_connections:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+        http_retriever_impl.retrieve(http_retrieval_jobs[1:])
+        for retrieval_job in http_retrieval_jobs:
+            resource = storage_connector.get_resource(retrieval_job.identifier)
+            assert TestBaseRetriever.get_md5(resource) == retrieval_job.md5_sum
+
+    def test_pooled_http_retriever_not_found(self, storage_connector: StorageConnector, http_server_url: str):
+        retrieval_job = ResourceDefinition(identifier="missing", source=f"{http_server_url}/missing.bin", md5_sum="0" * 32)
+        with pytest.raises(urllib.error.HTTPError):
+            RetrieverFactory.get_pooled_http_retriever(storage_connector).retrieve([retrieval_job])
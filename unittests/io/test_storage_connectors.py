@@ -1,7 +1,28 @@
-from data_stack.io.storage_connectors import StorageConnector, FileStorageConnector, StorageConnectorFactory
-from data_stack.exception import ResourceNotFoundError
+from data_stack.io.storage_connectors import StorageConnector, FileStorageConnector, StorageConnectorFactory, \
+    ContentAddressedFileStorageConnector, ObjectStoreStorageConnector, CachingStorageConnector
+from data_stack.io.retriever import RetrieverFactory
+from data_stack.io.resource_definition import ResourceDefinition
+from data_stack.exception import ResourceNotFoundError, DatasetFileCorruptError
+from data_stack.io.resources import ResourceFactory, IteratorStream
 import pytest
 import io
+import os
+import hashlib
+import multiprocessing
+import tempfile
+import shutil
+import stat
+
+
+def get_default_mode() -> int:
+    # permissions of a regularly created file
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def get_mode(path: str) -> int:
+    return stat.S_IMODE(os.stat(path).st_mode)
 
 
 class TestStorageConnectorFactory:
@@ -34,3 +55,304 @@ class TestFileStorageConnector:
         bin_stream1.seek(0)
         bin_stream2.seek(0)
         assert bin_stream2.read() == bin_stream1.read()
+
+    def test_set_resource_atomic(self, storage_connector: FileStorageConnector):
+        def failing_resource():
+            yield b"abc"
+            raise IOError("Connection lost")
+
+        storage_connector.set_resource("x", io.BytesIO(b"abcdef"))
+        with pytest.raises(IOError):
+            storage_connector.set_resource("x", ResourceFactory.get_resource("x", IteratorStream(failing_resource())))
+        # the previous version is kept and no temporary files remain
+        assert storage_connector.get_resource("x").read() == b"abcdef"
+        assert os.listdir(storage_connector.root_path) == ["x"]
+
+    @pytest.mark.parametrize("file_backed", [True, False])
+    def test_set_resource_copy(self, storage_connector: FileStorageConnector, tmp_folder_path: str, file_backed: bool):
+        content = os.urandom(5 * 1024 * 1024 + 3)
+        source_path = os.path.join(tmp_folder_path, "source")
+        with open(source_path, "wb") as fd:
+            fd.write(content)
+        with open(source_path, "rb") as fd:
+            buffer = fd if file_backed else io.BytesIO(fd.read())
+            resource = ResourceFactory.get_resource("copy", buffer)
+            assert resource.allows_direct_copy == file_backed
+            storage_connector.set_resource("copy", resource)
+        assert storage_connector.get_resource("copy").read() == content
+
+    def test_manifest_compaction(self, storage_connector: FileStorageConnector, monkeypatch):
+        monkeypatch.setattr(FileStorageConnector, "COMPACTION_MIN_LINES", 8)
+        for identifier in ["a", "b"]:
+            storage_connector.set_resource(identifier, io.BytesIO(identifier.encode()))
+        for i in range(20):
+            storage_connector.set_verified_checksum("a" if i % 2 else "b", str(i))
+        manifest_path = os.path.join(storage_connector.root_path, FileStorageConnector.MANIFEST_FILE)
+        with open(manifest_path) as f:
+            # the superseded entries are dropped repeatedly, such that the manifest stays bounded
+            assert len(f.readlines()) < 8
+        # other connectors on the same folder detect the replaced manifest
+        other_storage_connector = StorageConnectorFactory.get_file_storage_connector(storage_connector.root_path)
+        assert other_storage_connector.get_verified_checksum("a") == "19"
+        storage_connector.set_verified_checksum("a", "20")
+        assert other_storage_connector.get_verified_checksum("a") == "20"
+        assert get_mode(manifest_path) == get_default_mode()
+
+    def test_permissions(self, storage_connector: FileStorageConnector):
+        # committed temporary files must not stay private to the owner
+        storage_connector.set_resource("x", io.BytesIO(b"abcdef"))
+        assert get_mode(os.path.join(storage_connector.root_path, "x")) == get_default_mode()
+
+    def test_manifest_replaced(self, storage_connector: FileStorageConnector):
+        storage_connector.set_resource("a", io.BytesIO(b"a"))
+        storage_connector.set_verified_checksum("a", "1")
+        assert storage_connector.get_verified_checksum("a") == "1"
+        manifest_path = os.path.join(storage_connector.root_path, FileStorageConnector.MANIFEST_FILE)
+        # a truncated manifest is read from the start again
+        open(manifest_path, "w").close()
+        assert storage_connector.get_verified_checksum("a") is None
+        storage_connector.set_verified_checksum("a", "2")
+        assert storage_connector.get_verified_checksum("a") == "2"
+
+
+class TestContentAddressedFileStorageConnector:
+
+    @pytest.fixture
+    def storage_connector(self, tmp_folder_path: str) -> ContentAddressedFileStorageConnector:
+        return StorageConnectorFactory.get_content_addressed_file_storage_connector(tmp_folder_path)
+
+    def test_deduplication(self, storage_connector: ContentAddressedFileStorageConnector):
+        storage_connector.set_resource("a/x", io.BytesIO(b"abcdef"))
+        storage_connector.set_resource("b/y", ResourceFactory.get_resource("b/y", io.BytesIO(b"abcdef")))
+        assert storage_connector.get_resource("a/x").read() == storage_connector.get_resource("b/y").read() == b"abcdef"
+        full_path_x, full_path_y = os.path.join(storage_connector.root_path, "a/x"), os.path.join(storage_connector.root_path, "b/y")
+        assert os.path.samefile(full_path_x, full_path_y)
+        assert storage_connector.has_blob(hashlib.md5(b"abcdef").hexdigest())
+        assert get_mode(full_path_x) == get_default_mode()
+
+    def test_link_resource(self, storage_connector: ContentAddressedFileStorageConnector):
+        md5_sum = hashlib.md5(b"abcdef").hexdigest()
+        assert not storage_connector.link_resource("y", md5_sum)
+        storage_connector.set_resource("x", io.BytesIO(b"abcdef"))
+        assert storage_connector.link_resource("y", md5_sum)
+        assert storage_connector.get_resource("y").read() == b"abcdef"
+
+    def test_retriever_short_circuit(self, storage_connector: ContentAddressedFileStorageConnector, tmp_folder_path: str):
+        source_path = os.path.join(tmp_folder_path, "source")
+        with open(source_path, "wb") as fd:
+            fd.write(b"abcdef")
+        md5_sum = hashlib.md5(b"abcdef").hexdigest()
+        retriever = RetrieverFactory.get_file_retriever(storage_connector)
+        retriever.retrieve([ResourceDefinition(identifier="x", source=source_path, md5_sum=md5_sum)])
+        # the source does not exist, so it can only be retrieved via the blob
+        retriever.retrieve([ResourceDefinition(identifier="y", source="/does/not/exist", md5_sum=md5_sum)])
+        assert storage_connector.get_resource("y").read() == b"abcdef"
+
+    def test_append_copy_on_write(self, storage_connector: ContentAddressedFileStorageConnector):
+        storage_connector.set_resource("x", io.BytesIO(b"abc"))
+        storage_connector.link_resource("y", hashlib.md5(b"abc").hexdigest())
+        storage_connector.append_resource("y", [b"def"])
+        assert storage_connector.get_resource("x").read() == b"abc"
+        assert storage_connector.get_resource("y").read() == b"abcdef"
+
+    def test_move_resource_and_garbage_collection(self, storage_connector: ContentAddressedFileStorageConnector):
+        storage_connector.append_resource("x.partial", [b"abc", b"def"])
+        storage_connector.move_resource("x.partial", "x")
+        assert not storage_connector.has_resource("x.partial")
+        assert storage_connector.has_blob(hashlib.md5(b"abcdef").hexdigest())
+        assert storage_connector.collect_garbage() == 0
+        storage_connector.delete_resource("x")
+        assert storage_connector.collect_garbage() == 1
+        assert not storage_connector.has_blob(hashlib.md5(b"abcdef").hexdigest())
+
+
+class TestObjectStoreStorageConnector:
+
+    @pytest.fixture
+    def storage_connector(self, object_store_url: str) -> ObjectStoreStorageConnector:
+        return StorageConnectorFactory.get_object_store_storage_connector(
+            object_store_url, "test-bucket", prefix="datasets/", access_key="key", secret_key="secret", part_size=1000)
+
+    def test_set_get_resource(self, storage_connector: ObjectStoreStorageConnector, object_store_server):
+        storage_connector.set_resource("x", io.BytesIO(b"abcdef"))
+        assert object_store_server.objects["datasets/x"] == b"abcdef"
+        assert storage_connector.get_resource("x").read() == b"abcdef"
+        assert storage_connector.get_resource_size("x") == 6
+        # all requests are signed
+        assert all(authorization.startswith("AWS4-HMAC-SHA256") for *_, authorization in object_store_server.requests)
+
+    def test_get_resource_404(self, storage_connector: ObjectStoreStorageConnector):
+        with pytest.raises(ResourceNotFoundError):
+            storage_connector.get_resource("x")
+
+    @pytest.mark.parametrize("num_bytes", [0, 999, 1000, 4567])
+    def test_multipart_upload(self, storage_connector: ObjectStoreStorageConnector, object_store_server, num_bytes: int):
+        content = os.urandom(num_bytes)
+        storage_connector.set_resource("x", ResourceFactory.get_resource("x", io.BytesIO(content)))
+        assert object_store_server.objects["datasets/x"] == content
+        num_uploaded_parts = sum(1 for method, _, query, _ in object_store_server.requests if "partNumber" in query)
+        assert num_uploaded_parts == (-(-num_bytes // 1000) if num_bytes > 1000 else 0)
+        assert not object_store_server.uploads
+
+    def test_ranged_reads(self, storage_connector: ObjectStoreStorageConnector, object_store_server):
+        content = os.urandom(5000)
+        object_store_server.objects["datasets/x"] = content
+        storage_connector.block_size = 1024
+        resource = storage_connector.get_resource("x")
+        resource.seek(4000)
+        assert resource.read(10) == content[4000:4010]
+        resource.seek(0)
+        assert b"".join(resource) == content
+        ranges = [request for request in object_store_server.requests if request[0] == "GET"]
+        # each read is served by a ranged GET instead of downloading the whole object
+        assert len(ranges) > 1
+
+    def test_has_resources(self, storage_connector: ObjectStoreStorageConnector, object_store_server):
+        object_store_server.max_keys = 3
+        for i in range(10):
+            storage_connector.set_resource(f"resources/{i}", io.BytesIO(b"abc"))
+        object_store_server.requests.clear()
+        identifiers = [f"resources/{i}" for i in range(0, 20, 2)]
+        assert storage_connector.has_resources(identifiers) == [i < 10 for i in range(0, 20, 2)]
+        # a paginated listing instead of one request per resource
+        assert len(object_store_server.requests) == 4
+
+    def test_move_delete_resource(self, storage_connector: ObjectStoreStorageConnector):
+        storage_connector.set_resource("x", io.BytesIO(b"abcdef"))
+        storage_connector.move_resource("x", "y")
+        assert not storage_connector.has_resource("x")
+        assert storage_connector.get_resource("y").read() == b"abcdef"
+        storage_connector.delete_resource("y")
+        assert not storage_connector.has_resource("y")
+        with pytest.raises(ResourceNotFoundError):
+            storage_connector.delete_resource("y")
+
+    def test_retrieve_into_object_store(self, storage_connector: ObjectStoreStorageConnector, tmp_folder_path: str):
+        source_path = os.path.join(tmp_folder_path, "source")
+        content = os.urandom(2500)
+        with open(source_path, "wb") as fd:
+            fd.write(content)
+        retriever = RetrieverFactory.get_file_retriever(storage_connector)
+        retriever.retrieve([ResourceDefinition(identifier="x", source=source_path, md5_sum=hashlib.md5(content).hexdigest())])
+        assert storage_connector.get_resource("x").read() == content
+
+    @pytest.mark.parametrize("num_bytes", [500, 2500])
+    def test_retrieve_corrupt_into_object_store(self, storage_connector: ObjectStoreStorageConnector,
+                                                object_store_server, tmp_folder_path: str, num_bytes: int):
+        source_path = os.path.join(tmp_folder_path, "source")
+        with open(source_path, "wb") as fd:
+            fd.write(os.urandom(num_bytes))
+        retriever = RetrieverFactory.get_file_retriever(storage_connector)
+        with pytest.raises(DatasetFileCorruptError):
+            retriever.retrieve([ResourceDefinition(identifier="x", source=source_path, md5_sum="0" * 32)])
+        # neither a single-part object nor a (pending) multipart upload is left behind
+        assert not storage_connector.has_resource("x")
+        assert not object_store_server.uploads
+
+    @pytest.mark.parametrize("pooled", [False, True])
+    def test_http_retrieve_into_object_store(self, storage_connector: ObjectStoreStorageConnector, object_store_server,
+                                             http_server_root: str, http_server_url: str, pooled: bool):
+        retrieval_jobs = []
+        for i, num_bytes in enumerate([500, 2500]):
+            content = os.urandom(num_bytes)
+            with open(os.path.join(http_server_root, f"{i}.bin"), "wb") as fd:
+                fd.write(content)
+            retrieval_jobs.append(ResourceDefinition(identifier=f"resources/{i}", source=f"{http_server_url}/{i}.bin",
+                                                     md5_sum=hashlib.md5(content).hexdigest()))
+        # object stores cannot persist partial downloads, so the resources are streamed in directly
+        assert not storage_connector.supports_partial_resources
+        if pooled:
+            retriever = RetrieverFactory.get_pooled_http_retriever(storage_connector, num_workers=2, num_segments=4)
+        else:
+            retriever = RetrieverFactory.get_http_retriever(storage_connector, num_workers=2, num_segments=4)
+        assert retriever.retrieve(retrieval_jobs) == [job.identifier for job in retrieval_jobs]
+        for i, retrieval_job in enumerate(retrieval_jobs):
+            with open(os.path.join(http_server_root, f"{i}.bin"), "rb") as fd:
+                assert object_store_server.objects[f"datasets/resources/{i}"] == fd.read()
+        retrieval_jobs[0].md5_sum = "0" * 32
+        storage_connector.delete_resource(retrieval_jobs[0].identifier)
+        with pytest.raises(DatasetFileCorruptError):
+            retriever.retrieve(retrieval_jobs[:1])
+        assert not storage_connector.has_resource(retrieval_jobs[0].identifier)
+
+
+class TestCachingStorageConnector:
+
+    @pytest.fixture
+    def backing_storage_connector(self, tmp_folder_path: str) -> StorageConnector:
+        storage_connector = StorageConnectorFactory.get_file_storage_connector(tmp_folder_path)
+        for i in range(10):
+            storage_connector.set_resource(f"resources/{i}", io.BytesIO(bytes([i]) * 100))
+        return storage_connector
+
+    @pytest.fixture
+    def cache_folder_path(self) -> str:
+        path = tempfile.mkdtemp()
+        yield path
+        shutil.rmtree(path)
+
+    @pytest.fixture
+    def storage_connector(self, backing_storage_connector: StorageConnector, cache_folder_path: str) -> CachingStorageConnector:
+        return StorageConnectorFactory.get_caching_storage_connector(backing_storage_connector, cache_folder_path,
+                                                                     max_disk_bytes=500, max_memory_bytes=250)
+
+    def test_tiers(self, storage_connector: CachingStorageConnector, backing_storage_connector: StorageConnector):
+        assert storage_connector.get_resource("resources/0").read() == bytes([0]) * 100
+        assert storage_connector.statistics.misses == 1
+        # the resource is cached, so it is served without the backing storage
+        os.remove(os.path.join(backing_storage_connector.root_path, "resources/0"))
+        assert storage_connector.get_resource("resources/0").read() == bytes([0]) * 100
+        assert storage_connector.statistics.memory_hits == 1
+        for i in range(1, 4):
+            storage_connector.get_resource(f"resources/{i}")
+        # the RAM tier holds two resources, the least recently used ones have been evicted to the disk tier
+        assert storage_connector.statistics.memory_evictions == 2
+        assert storage_connector.get_resource("resources/0").read() == bytes([0]) * 100
+        assert storage_connector.statistics.disk_hits == 1
+        assert storage_connector.statistics.hit_ratio == 2 / 6
+
+    def test_disk_eviction(self, storage_connector: CachingStorageConnector, cache_folder_path: str):
+        for i in range(10):
+            storage_connector.get_resource(f"resources/{i}").read()
+        assert storage_connector.statistics.disk_evictions == 5
+        cached = sorted(os.listdir(os.path.join(cache_folder_path, "resources")))
+        assert cached == [str(i) for i in range(5, 10)]
+        assert get_mode(os.path.join(cache_folder_path, "resources", cached[0])) == get_default_mode()
+
+    def test_large_resource(self, storage_connector: CachingStorageConnector, backing_storage_connector: StorageConnector):
+        backing_storage_connector.set_resource("large", io.BytesIO(b"x" * 1000))
+        # the resource exceeds both tiers, but is still served from the (evicted) file
+        resource = storage_connector.get_resource("large")
+        assert resource.is_file_backed
+        assert resource.read() == b"x" * 1000
+        assert not storage_connector._memory_cache
+
+    def test_write_invalidates(self, storage_connector: CachingStorageConnector):
+        storage_connector.get_resource("resources/0")
+        storage_connector.set_resource("resources/0", io.BytesIO(b"new"))
+        assert storage_connector.get_resource("resources/0").read() == b"new"
+        assert storage_connector.get_resource_size("resources/0") == 3
+        storage_connector.delete_resource("resources/0")
+        assert not storage_connector.has_resource("resources/0")
+
+    @staticmethod
+    def read_resources(storage_connector: StorageConnector, seed: int, queue):
+        storage_connector = CachingStorageConnector(storage_connector.storage_connector,
+                                                    storage_connector.disk_cache.root_path, max_disk_bytes=500,
+                                                    max_memory_bytes=0)
+        order = list(range(10)) * 5
+        order = order[seed:] + order[:seed]
+        queue.put(all(storage_connector.get_resource(f"resources/{i}").read() == bytes([i]) * 100 for i in order))
+
+    def test_shared_disk_tier(self, storage_connector: CachingStorageConnector):
+        context = multiprocessing.get_context("fork")
+        queue = context.Queue()
+        processes = [context.Process(target=TestCachingStorageConnector.read_resources,
+                                     args=(storage_connector, seed, queue)) for seed in range(4)]
+        for process in processes:
+            process.start()
+        results = [queue.get(timeout=30) for _ in processes]
+        for process in processes:
+            process.join()
+        assert all(results)
+        assert sum(size for _, size, _ in storage_connector._list_disk_cache()) <= 500
@@ -0,0 +1,31 @@
+import pytest
+import numpy as np
+import torch
+from data_stack.mnist.iterator import MNISTIterator
+from data_stack.io.array_io import ArrayIO
+from data_stack.io.storage_connectors import StorageConnectorFactory, StorageConnector
+
+
+class TestMNISTIterator:
+
+    @pytest.fixture
+    def storage_connector(self, tmp_folder_path: str) -> StorageConnector:
+        random_gen = np.random.RandomState(1)
+        storage_connector = StorageConnectorFactory.get_file_storage_connector(tmp_folder_path)
+        samples = random_gen.rand(50, 28, 28).astype(np.float32)
+        targets = random_gen.randint(0, 10, size=50).astype(np.int64)
+        for identifier, array in [("samples.npy", samples), ("targets.npy", targets)]:
+            with ArrayIO.to_streamed_resource(identifier, array) as resource:
+                storage_connector.set_resource(identifier, resource)
+        return storage_connector
+
+    @pytest.mark.parametrize("read_block_size", [1, 7, 64])
+    def test_iter(self, storage_connector: StorageConnector, read_block_size: int, monkeypatch):
+        monkeypatch.setattr(MNISTIterator, "READ_BLOCK_SIZE", read_block_size)
+        iterator = MNISTIterator(storage_connector.get_resource("samples.npy"), storage_connector.get_resource("targets.npy"))
+        samples = list(iterator)
+        assert len(samples) == len(iterator)
+        for index, (sample, target, tag) in enumerate(samples):
+            expected_sample, expected_target, _ = iterator[index]
+            assert torch.equal(sample, expected_sample)
+            assert target == tag == expected_target and isinstance(target, int)
@@ -0,0 +1,56 @@
+import pytest
+import gzip
+import io
+import numpy as np
+import torch
+from torchvision import transforms
+from data_stack.mnist.preprocessor import MNISTPreprocessor
+from data_stack.io.array_io import ArrayIO
+from data_stack.io.storage_connectors import StorageConnectorFactory, StorageConnector
+
+
+class TestMNISTPreprocessor:
+
+    @pytest.fixture
+    def images(self) -> np.ndarray:
+        return np.random.RandomState(1).randint(0, 256, size=(50, 28, 28), dtype=np.uint8)
+
+    @pytest.fixture
+    def labels(self) -> np.ndarray:
+        return np.random.RandomState(1).randint(0, 10, size=50, dtype=np.uint8)
+
+    @pytest.fixture
+    def storage_connector(self, tmp_folder_path: str, images: np.ndarray, labels: np.ndarray) -> StorageConnector:
+        storage_connector = StorageConnectorFactory.get_file_storage_connector(tmp_folder_path)
+        # IDX files: magic number (type and number of dimensions), big-endian dimensions and the payload
+        image_file = np.array([2051, *images.shape], dtype=">i4").tobytes() + images.tobytes()
+        label_file = np.array([2049, len(labels)], dtype=">i4").tobytes() + labels.tobytes()
+        storage_connector.set_resource("raw/samples.gz", io.BytesIO(gzip.compress(image_file)))
+        storage_connector.set_resource("raw/targets.gz", io.BytesIO(gzip.compress(label_file)))
+        return storage_connector
+
+    @pytest.mark.parametrize("chunk_size", [None, 1, 7, 50, 64])
+    def test_preprocess(self, storage_connector: StorageConnector, images: np.ndarray, labels: np.ndarray, chunk_size: int):
+        preprocessor = MNISTPreprocessor(storage_connector, chunk_size=chunk_size)
+        preprocessor.preprocess("raw/samples.gz", "raw/targets.gz", "prep/samples.npy", "prep/targets.npy")
+        samples = ArrayIO.from_streamed_resource(storage_connector.get_resource("prep/samples.npy"))
+        targets = ArrayIO.from_streamed_resource(storage_connector.get_resource("prep/targets.npy"))
+        expected_samples = torch.cat([transforms.ToTensor()(image) for image in images], dim=0)
+        assert samples.dtype == np.float32
+        assert torch.equal(torch.from_numpy(np.array(samples)), expected_samples)
+        assert np.array_equal(targets, labels.astype(np.int64))
+
+    @pytest.mark.parametrize("dtype", [np.uint8, np.int16, np.float64])
+    def test_read_sn3_pascalvincent_tensor(self, dtype: np.dtype, tmp_folder_path: str):
+        type_codes = {np.uint8: 8, np.int16: 11, np.float64: 14}
+        array = np.arange(2 * 3 * 5).reshape(2, 3, 5).astype(dtype)
+        content = np.array([type_codes[dtype] * 256 + 3, *array.shape], dtype=">i4").tobytes()
+        content += array.astype(np.dtype(dtype).newbyteorder(">")).tobytes()
+        assert torch.equal(MNISTPreprocessor.read_sn3_pascalvincent_tensor(content), torch.from_numpy(array))
+        # decoded incrementally from a stream into a preallocated output file
+        out = np.lib.format.open_memmap(f"{tmp_folder_path}/out.npy", mode="w+", dtype=dtype, shape=array.shape)
+        MNISTPreprocessor.read_sn3_pascalvincent_tensor(gzip.GzipFile(fileobj=io.BytesIO(gzip.compress(content))), out=out)
+        out.flush()
+        assert np.array_equal(np.load(f"{tmp_folder_path}/out.npy"), array)
+        with pytest.raises(ValueError):
+            MNISTPreprocessor.read_sn3_pascalvincent_tensor(content[:-1])